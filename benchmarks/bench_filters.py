@@ -0,0 +1,86 @@
+"""Compare chained and fused application of the Pandoc filters.
+
+The template used to apply `convert_div` and `convert_raw_html` one after the
+other, parsing and serializing the document for each filter. This benchmark
+times that chain against `convert_filters`, which applies both filters in a
+single walk, for documents of increasing size.
+
+Run it with::
+
+    python benchmarks/bench_filters.py
+
+"""
+# Standard library
+from argparse import ArgumentParser
+from typing import Optional, Sequence
+import json
+import timeit
+
+# Third Party
+from pandocfilters import Div, Para, RawInline, Space, Str
+
+# Local imports
+from thermohw.filters import convert_div, convert_filters, convert_raw_html
+
+
+def make_document(blocks: int) -> str:
+    """Make a Pandoc JSON document with ``blocks`` paragraphs and alert divs."""
+    para = Para(
+        [Str("Water"), Space(), Str("is"), Space(), Str("H")]
+        + [RawInline("html", "<sub>"), Str("2"), RawInline("html", "</sub>")]
+        + [Str("O.")] * 20
+    )
+    content = []
+    for index in range(blocks):
+        if index % 10 == 0:
+            content.append(Div(["", ["alert", "alert-info"], []], [para]))
+        else:
+            content.append(para)
+    doc = {"pandoc-api-version": [1, 22], "meta": {}, "blocks": content}
+    return json.dumps(doc)
+
+
+def chained(text: str) -> str:
+    """Apply the filters one after the other."""
+    return convert_raw_html(convert_div(text, "latex"), "latex")
+
+
+def fused(text: str) -> str:
+    """Apply the filters in a single walk."""
+    return convert_filters(text, "latex")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Time the chained and fused filters for each document size."""
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="*",
+        default=[10, 100, 1000, 5000],
+        help="Numbers of blocks in the generated documents",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of times to repeat each timing"
+    )
+    args = parser.parse_args(argv)
+
+    print(f"{'blocks':>8} {'chained (ms)':>14} {'fused (ms)':>12} {'speedup':>8}")
+    for size in args.sizes:
+        text = make_document(size)
+        assert chained(text) == fused(text)
+        number = max(1, 1000 // size)
+        t_chained = min(
+            timeit.repeat(lambda: chained(text), number=number, repeat=args.repeat)
+        )
+        t_fused = min(
+            timeit.repeat(lambda: fused(text), number=number, repeat=args.repeat)
+        )
+        print(
+            f"{size:>8} {1e3 * t_chained / number:>14.3f} "
+            f"{1e3 * t_fused / number:>12.3f} {t_chained / t_fused:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
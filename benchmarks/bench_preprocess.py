@@ -0,0 +1,128 @@
+"""Compare the combined preprocessor with the chain of separate preprocessors.
+
+The `~thermohw.preprocessors.HomeworkPreprocessor` applies the raw cell
+removal, the solution removal, the variable substitution and the attachment
+extraction in a single pass over the cells. This benchmark exports generated
+Notebooks with both pipelines, checks that the output is the same, and times
+each pipeline, including the validation of the Notebook that the exporter does
+after each preprocessor that runs.
+
+Run it with::
+
+    python benchmarks/bench_preprocess.py
+
+"""
+# Standard library
+from argparse import ArgumentParser
+from typing import Any, Dict, Optional, Sequence
+import copy
+import os
+import sys
+import warnings
+
+# Local imports
+from thermohw import (
+    ExtractAttachmentsPreprocessor,
+    HomeworkPreprocessor,
+    PyMarkdownPreprocessor,
+    RawRemover,
+    SolutionRemover,
+)
+from thermohw.exporters import HomeworkNotebookExporter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from suite import SIZES, make_notebook, time_function  # noqa: E402
+
+RESOURCES = {
+    "remove_solution": True,
+    "by_hand": False,
+    "delete_pymarkdown": True,
+    "unique_key": "homework-1-1",
+    "global_content_filter": {"include_raw": False},
+}
+
+
+def make_exporters() -> Dict[str, HomeworkNotebookExporter]:
+    """Return an exporter with the chained and with the combined preprocessors."""
+    chained = HomeworkNotebookExporter(
+        preprocessors=[
+            RawRemover,
+            SolutionRemover,
+            PyMarkdownPreprocessor,
+            ExtractAttachmentsPreprocessor,
+        ]
+    )
+    combined = HomeworkNotebookExporter(
+        preprocessors=[HomeworkPreprocessor(extract_attachments=True)]
+    )
+    return {"chained": chained, "combined": combined}
+
+
+VARIANTS = {
+    "tags": {"legacy": False},
+    "legacy": {"legacy": True},
+    "solution": {"legacy": False, "remove_solution": False},
+}
+
+
+def export(exporter: HomeworkNotebookExporter, nb: Any, variant: str) -> Any:
+    """Export ``nb`` and return the output and the extracted files."""
+    resources = dict(RESOURCES, **VARIANTS[variant])
+    output, resources = exporter.from_notebook_node(nb, resources=resources)
+    return output, dict(resources["outputs"])
+
+
+def run(sizes: Sequence[str], repeat: int) -> None:
+    """Check and time both pipelines for each of the ``sizes``."""
+    exporters = make_exporters()
+    print(f"{'benchmark':<30} {'chained':>12} {'combined':>12} {'speedup':>8}")
+    for size in sizes:
+        for variant in VARIANTS:
+            nb = make_notebook(**SIZES[size], legacy=variant == "legacy")
+            # Cells without an ID are given a random one by the validation
+            for index, cell in enumerate(nb.cells):
+                cell["id"] = f"cell-{index}"
+            outputs = {
+                name: export(exporter, copy.deepcopy(nb), variant)
+                for name, exporter in exporters.items()
+            }
+            if outputs["chained"] != outputs["combined"]:
+                raise RuntimeError(f"The outputs differ for the {size} Notebook")
+
+            timings = {
+                name: time_function(
+                    lambda nb: export(exporter, nb, variant),
+                    lambda: copy.deepcopy(nb),
+                    repeat,
+                )["min"]
+                for name, exporter in exporters.items()
+            }
+            key = f"{size}[{variant}]"
+            print(
+                f"{key:<30} {1e3 * timings['chained']:>10.3f}ms "
+                f"{1e3 * timings['combined']:>10.3f}ms "
+                f"{timings['chained'] / timings['combined']:>8.2f}"
+            )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Compare the chained and combined preprocessors."""
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        nargs="*",
+        choices=list(SIZES),
+        default=list(SIZES),
+        help="Sizes of the generated Notebooks",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of times to repeat each timing"
+    )
+    args = parser.parse_args(argv)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        run(args.sizes, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
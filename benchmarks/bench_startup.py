@@ -0,0 +1,91 @@
+"""Time starting the command line interface and importing the package.
+
+The exporters and the modules that depend on nbconvert are only imported when
+a problem is converted, so ``--help`` and ``--clean`` should start quickly.
+This benchmark times each command in a new Python process, and lists any of
+the heavy dependencies that were imported. Rendering the first Notebook is
+also timed, which loads the compiled templates from the cache after the
+first run.
+
+Run it with::
+
+    python benchmarks/bench_startup.py
+
+"""
+# Standard library
+from argparse import ArgumentParser
+from typing import Dict, List, Optional, Sequence
+import json
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ("nbconvert", "nbformat", "traitlets", "pdfrw", "pandocfilters")
+
+COMMANDS = {
+    "import thermohw": "import thermohw",
+    "import SolutionRemover": "from thermohw import SolutionRemover",
+    "convert_thermo_hw --help": (
+        "from thermohw.convert_thermo_hw import main\n"
+        "try:\n"
+        "    main(['--help'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+    ),
+    # Builds the exporters and loads the compiled templates from the cache
+    "render an empty Notebook": (
+        "import nbformat\n"
+        "from thermohw.convert_thermo_hw import get_exporters\n"
+        "get_exporters()[1].latex_from_notebook_node(\n"
+        "    nbformat.v4.new_notebook(), {'remove_solution': False}\n"
+        ")\n"
+    ),
+}
+
+REPORT = (
+    "\nimport json, sys\n"
+    f"heavy = {HEAVY_MODULES!r}\n"
+    "print(json.dumps([m for m in heavy if m in sys.modules]), file=sys.stderr)\n"
+)
+
+
+def run_command(code: str) -> List[str]:
+    """Run ``code`` in a new Python process and return the heavy modules it used."""
+    result = subprocess.run(
+        [sys.executable, "-c", code + REPORT],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    return json.loads(result.stderr.decode("utf-8").splitlines()[-1])
+
+
+def time_startup(repeat: int = 5) -> Dict[str, Dict[str, float]]:
+    """Return the shortest time of ``repeat`` runs of each command."""
+    results = {}
+    for name, code in COMMANDS.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run_command(code)
+            times.append(time.perf_counter() - start)
+        results[name] = {"min": min(times), "repeat": repeat}
+    return results
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Time each command and list the heavy modules it imports."""
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of times to repeat each timing"
+    )
+    args = parser.parse_args(argv)
+
+    print(f"{'command':<30} {'time (ms)':>10}  heavy imports")
+    for name, timing in time_startup(args.repeat).items():
+        heavy = run_command(COMMANDS[name])
+        print(f"{name:<30} {1e3 * timing['min']:>10.1f}  {', '.join(heavy)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""Benchmark the hot paths of the homework conversion.
+
+The suite times the preprocessors, the Pandoc filters, the exporters, including
+the HTML exporter of the drafts, and the merging of PDFs on generated Notebooks
+of increasing size, and the time to start the command line interface. The
+results are written to a JSON file that can be compared with the results of another run,
+so that regressions are caught before a release.
+
+Run the suite and save the results with::
+
+    python benchmarks/suite.py --output before.json
+
+and compare a later run against those results with::
+
+    python benchmarks/suite.py --output after.json --compare before.json
+
+The comparison exits with a non-zero status if any benchmark is slower than
+the ``--threshold``.
+"""
+# Standard library
+from argparse import ArgumentParser
+from base64 import b64encode
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Any, Callable, Dict, Optional, Sequence
+import copy
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import time
+import warnings
+
+# Third Party
+import nbformat
+from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook, new_raw_cell
+
+# Local imports
+from thermohw import (
+    ExtractAttachmentsPreprocessor,
+    HomeworkPreprocessor,
+    PyMarkdownPreprocessor,
+    RawRemover,
+    SolutionRemover,
+    __version__,
+    convert_div,
+    convert_raw_html,
+)
+from thermohw.utils import combine_pdf_as_bytes
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_filters import make_document  # noqa: E402
+from bench_startup import time_startup  # noqa: E402
+
+Timings = Dict[str, Dict[str, Any]]
+
+SIZES = {
+    "small": {"cells": 20, "attachments": 2, "variables": 5},
+    "medium": {"cells": 100, "attachments": 10, "variables": 25},
+    "large": {"cells": 500, "attachments": 50, "variables": 100},
+}
+
+
+def make_notebook(
+    cells: int, attachments: int, variables: int, legacy: bool = False
+) -> nbformat.NotebookNode:
+    """Generate a homework problem Notebook.
+
+    Arguments
+    ---------
+    cells
+        The approximate number of cells in the Notebook
+    attachments
+        The number of Markdown cells with an image attachment
+    variables
+        The number of python-markdown variables in the problem statement
+    legacy, optional
+        Mark the solution with headers instead of tags
+    """
+    statement = " ".join(f"x{i} = {{{{x{i}}}}}." for i in range(variables))
+    statement_cell = new_markdown_cell(source=f"## Problem Statement\n\n{statement}")
+    statement_cell.metadata["variables"] = {
+        f"x{i}": f"{i}.0 m<sup>3</sup>" for i in range(variables)
+    }
+    nb_cells = [
+        new_markdown_cell(source="# Homework 1-1\n\n---\n\n## Imports"),
+        new_code_cell(source="import numpy as np"),
+        new_raw_cell(source="A raw cell"),
+        statement_cell,
+    ]
+    if legacy:
+        nb_cells.append(new_markdown_cell(source="---\n\n## Solution"))
+    else:
+        nb_cells.append(
+            new_markdown_cell(
+                source="---\n\n## Solution", metadata={"tags": ["solution"]}
+            )
+        )
+
+    # A PNG header followed by filler bytes to give the attachment a
+    # realistic size. It isn't a valid image, but it is never decoded.
+    image = b64encode(b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 200).decode("ascii")
+    parts = max(1, cells // 10)
+    per_part = max(1, (cells - len(nb_cells)) // parts)
+    attached = 0
+    for part in range(parts):
+        if legacy:
+            nb_cells.append(new_markdown_cell(source=f"### Part {part}"))
+        else:
+            nb_cells.append(
+                new_markdown_cell(
+                    source=f"### Part {part}", metadata={"tags": ["part"]}
+                )
+            )
+        for index in range(per_part - 1):
+            if index % 3 == 0:
+                nb_cells.append(new_code_cell(source=f"y = {index} * 2\nprint(y)"))
+            elif attached < attachments:
+                name = f"fig{attached}.png"
+                cell = new_markdown_cell(source=f"![{name}](attachment:{name})")
+                cell["attachments"] = {name: {"image/png": image}}
+                nb_cells.append(cell)
+                attached += 1
+            else:
+                nb_cells.append(
+                    new_markdown_cell(
+                        source=(
+                            '<div class="alert alert-success">\n\n'
+                            f"**Answer:** H<sub>2</sub>O is {index} kg\n\n</div>"
+                        )
+                    )
+                )
+    nb = new_notebook(cells=nb_cells)
+    # Remove the random cell IDs so that the Notebook is the same every run
+    for cell in nb.cells:
+        cell.pop("id", None)
+    return nb
+
+
+def time_function(
+    function: Callable[[], Any],
+    setup: Optional[Callable[[], Any]] = None,
+    repeat: int = 5,
+) -> Dict[str, Any]:
+    """Time ``function``, calling ``setup`` before each repeat without timing it.
+
+    If ``setup`` is given, its return value is passed to ``function``.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            argument = setup()
+            start = time.perf_counter()
+            function(argument)  # type: ignore
+        else:
+            start = time.perf_counter()
+            function()
+        times.append(time.perf_counter() - start)
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "repeat": repeat,
+    }
+
+
+def run_suite(sizes: Sequence[str], repeat: int, pdf: bool) -> Timings:
+    """Run all of the benchmarks for each of the ``sizes``."""
+    results: Timings = {}
+
+    def record(name: str, size: str, timing: Dict[str, Any]) -> None:
+        key = f"{name}[{size}]"
+        results[key] = timing
+        print(f"{key:<45} {1e3 * timing['min']:>10.3f} ms")
+
+    for name, timing in time_startup(repeat).items():
+        record("startup", name, timing)
+
+    from thermohw.convert_thermo_hw import get_exporters
+    from thermohw.draft import get_draft_exporter
+
+    nb_exp, pdf_exp = get_exporters()
+    html_exp = get_draft_exporter()
+
+    for size in sizes:
+        params = SIZES[size]
+        tag_nb = make_notebook(**params)
+        legacy_nb = make_notebook(**params, legacy=True)
+        resources = {
+            "remove_solution": True,
+            "by_hand": False,
+            "legacy": False,
+            "delete_pymarkdown": True,
+            "unique_key": "homework-1-1",
+            "global_content_filter": {"include_raw": False},
+        }
+        legacy_resources = dict(resources, legacy=True)
+
+        def tag_copy() -> nbformat.NotebookNode:
+            return copy.deepcopy(tag_nb)
+
+        def legacy_copy() -> nbformat.NotebookNode:
+            return copy.deepcopy(legacy_nb)
+
+        preprocessors = {
+            "RawRemover": RawRemover(),
+            "PyMarkdownPreprocessor": PyMarkdownPreprocessor(),
+            "ExtractAttachmentsPreprocessor": ExtractAttachmentsPreprocessor(),
+        }
+        for name, preprocessor in preprocessors.items():
+            record(
+                name,
+                size,
+                time_function(
+                    lambda nb: preprocessor.preprocess(
+                        nb, {**resources, "outputs": {}}
+                    ),
+                    tag_copy,
+                    repeat,
+                ),
+            )
+
+        solution_remover = SolutionRemover()
+        record(
+            "SolutionRemover-tags",
+            size,
+            time_function(
+                lambda nb: solution_remover.preprocess(nb, dict(resources)),
+                tag_copy,
+                repeat,
+            ),
+        )
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)
+            record(
+                "SolutionRemover-legacy",
+                size,
+                time_function(
+                    lambda nb: solution_remover.preprocess(nb, dict(legacy_resources)),
+                    legacy_copy,
+                    repeat,
+                ),
+            )
+
+        homework_preprocessor = HomeworkPreprocessor(extract_attachments=True)
+        record(
+            "HomeworkPreprocessor-tags",
+            size,
+            time_function(
+                lambda nb: homework_preprocessor.preprocess(
+                    nb, {**resources, "outputs": {}}
+                ),
+                tag_copy,
+                repeat,
+            ),
+        )
+
+        document = make_document(params["cells"] * 10)
+        record(
+            "convert_div",
+            size,
+            time_function(lambda: convert_div(document, "latex"), repeat=repeat),
+        )
+        record(
+            "convert_raw_html",
+            size,
+            time_function(lambda: convert_raw_html(document, "latex"), repeat=repeat),
+        )
+
+        record(
+            "nb_exp",
+            size,
+            time_function(
+                lambda: nb_exp.from_notebook_node(tag_nb, resources=dict(resources)),
+                repeat=repeat,
+            ),
+        )
+
+        record(
+            "html_exp",
+            size,
+            time_function(
+                lambda: html_exp.from_notebook_node(tag_nb, resources=dict(resources)),
+                repeat=repeat,
+            ),
+        )
+
+        if pdf:
+            pdf_timing = time_function(
+                lambda: pdf_exp.from_notebook_node(tag_nb, resources=dict(resources)),
+                repeat=1,
+            )
+            record("pdf_exp", size, pdf_timing)
+            assignment_pdf, _ = pdf_exp.from_notebook_node(
+                tag_nb, resources=dict(resources)
+            )
+            pdfs = [assignment_pdf] * (params["cells"] // 10)
+            record(
+                "combine_pdf_as_bytes",
+                size,
+                time_function(
+                    lambda: combine_pdf_as_bytes([BytesIO(p) for p in pdfs]),
+                    repeat=repeat,
+                ),
+            )
+            record(
+                "combine_pdf_as_bytes-deduplicate",
+                size,
+                time_function(
+                    lambda: combine_pdf_as_bytes(
+                        [BytesIO(p) for p in pdfs], deduplicate=True
+                    ),
+                    repeat=repeat,
+                ),
+            )
+
+    return results
+
+
+def compare(results: Timings, baseline: Timings, threshold: float) -> bool:
+    """Compare ``results`` to ``baseline`` and return whether any regressed."""
+    regressed = False
+    print(f"\n{'benchmark':<45} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for key, timing in results.items():
+        if key not in baseline:
+            continue
+        before = baseline[key]["min"]
+        after = timing["min"]
+        ratio = after / before if before > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(
+            f"{key:<45} {1e3 * before:>8.3f}ms {1e3 * after:>8.3f}ms "
+            f"{ratio:>7.2f}{flag}"
+        )
+    return regressed
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Run the benchmark suite."""
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        nargs="*",
+        choices=list(SIZES),
+        default=list(SIZES),
+        help="Sizes of the generated Notebooks",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of times to repeat each timing"
+    )
+    parser.add_argument(
+        "--skip-pdf",
+        action="store_true",
+        help="Skip the benchmarks that need LaTeX. Skipped if xelatex isn't found.",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare the results to this JSON file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Fraction slower than the baseline that counts as a regression",
+    )
+    args = parser.parse_args(argv)
+
+    pdf = not args.skip_pdf and shutil.which("xelatex") is not None
+    results = run_suite(args.sizes, args.repeat, pdf)
+    report = {
+        "metadata": {
+            "thermohw": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "date": datetime.now(timezone.utc).isoformat(),
+        },
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,52 @@
-"""Convert thermo homework assignments."""
-
-from .convert_thermo_hw import process as hw_process  # noqa: F401
-from .extract_attachments import ExtractAttachmentsPreprocessor  # noqa: F401
-from .pymarkdown import PyMarkdownPreprocessor  # noqa: F401
-from .preprocessors import RawRemover, SolutionRemover  # noqa: F401
-from .filters import (  # noqa: F401
-    ALLOWED_ALERT_TYPES,
-    div_filter,
-    convert_div,
-    raw_html_filter,
-    convert_raw_html,
-)
+"""Convert thermo homework assignments.
+
+The contents of the package are imported the first time they are used, so
+that importing a single preprocessor does not import every dependency.
+"""
+from typing import Any, Dict, List, Tuple
+import importlib
+
 from ._version import __version__  # noqa: F401
+
+_lazy_attributes: Dict[str, Tuple[str, str]] = {
+    "hw_process": (".convert_thermo_hw", "process"),
+    "hw_process_course": (".convert_thermo_hw", "process_course"),
+    "hw_process_draft": (".draft", "process_draft"),
+    "ConversionServer": (".server", "ConversionServer"),
+    "ExtractAttachmentsPreprocessor": (
+        ".extract_attachments",
+        "ExtractAttachmentsPreprocessor",
+    ),
+    "PyMarkdownPreprocessor": (".pymarkdown", "PyMarkdownPreprocessor"),
+    "RawRemover": (".preprocessors", "RawRemover"),
+    "SolutionRemover": (".preprocessors", "SolutionRemover"),
+    "HomeworkPreprocessor": (".preprocessors", "HomeworkPreprocessor"),
+    "MarkdownPrerenderer": (".prerender", "MarkdownPrerenderer"),
+    "ImageOptimizer": (".images", "ImageOptimizer"),
+    "ALLOWED_ALERT_TYPES": (".filters", "ALLOWED_ALERT_TYPES"),
+    "div_filter": (".filters", "div_filter"),
+    "convert_div": (".filters", "convert_div"),
+    "html_div_filter": (".filters", "html_div_filter"),
+    "convert_html_div": (".filters", "convert_html_div"),
+    "raw_html_filter": (".filters", "raw_html_filter"),
+    "convert_raw_html": (".filters", "convert_raw_html"),
+    "apply_filters": (".filters", "apply_filters"),
+    "convert_filters": (".filters", "convert_filters"),
+    "register_filter": (".filters", "register_filter"),
+}
+
+__all__ = ["__version__"] + list(_lazy_attributes)
+
+
+def __getattr__(name: str) -> Any:
+    try:
+        module_name, attribute = _lazy_attributes[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module(module_name, __name__), attribute)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(__all__)
@@ -0,0 +1,248 @@
+"""An on-disk cache of converted homework problems.
+
+Converting a problem requires several runs of Pandoc and LaTeX, but the
+result only depends on the content of the problem Notebook, the template,
+the version of this package, and the conversion options. This module stores
+the converted files in a directory keyed by a hash of those inputs, so that
+unchanged problems do not need to be converted again.
+
+Classes
+-------
+BuildCache:
+    Store and retrieve the converted files for each problem.
+
+RenderCache:
+    Store and retrieve the LaTeX rendered for each Markdown cell, removing
+    the least recently used entries when the cache is too large.
+
+Functions
+---------
+user_cache_directory:
+    The directory for caches that are shared between homework assignments.
+
+"""
+
+# Standard Library
+from typing import Any, Dict, Iterable, Optional, Tuple
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+# Local imports
+from ._version import __version__
+
+here = Path(__file__).resolve().parent
+template_file = here / "homework.tpl"
+draft_template_file = here / "draft.tpl"
+
+CACHE_DIRECTORY_NAME = ".cache"
+
+ProblemResult = Tuple[bytes, str, bytes, str]
+
+
+def user_cache_directory() -> Path:
+    """Return the directory for caches that are shared between assignments.
+
+    This is the ``thermohw`` folder in ``$XDG_CACHE_HOME``, which defaults to
+    ``~/.cache``.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "thermohw"
+
+
+RESULT_FILES = ("assignment.pdf", "assignment.ipynb", "solution.pdf", "solution.ipynb")
+
+ProblemFiles = Tuple[Path, Path, Path, Path]
+
+
+def result_files(directory: Path) -> ProblemFiles:
+    """Return the paths of the converted files of a problem in ``directory``.
+
+    The paths are the assignment PDF, the assignment Notebook, the solution
+    PDF, and the solution Notebook, in that order.
+    """
+    assignment_pdf, assignment_nb, solution_pdf, solution_nb = (
+        directory / name for name in RESULT_FILES
+    )
+    return assignment_pdf, assignment_nb, solution_pdf, solution_nb
+
+
+def write_result(directory: Path, result: ProblemResult) -> ProblemFiles:
+    """Write the converted files in ``result`` to ``directory``."""
+    directory.mkdir(parents=True, exist_ok=True)
+    files = result_files(directory)
+    for path, data in zip(files, result):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        path.write_bytes(data)
+    return files
+
+
+class BuildCache:
+    """Cache the converted files for homework problems in ``directory``.
+
+    Each entry is a directory named for the problem and the hash of its
+    inputs. Storing a new entry for a problem removes any older entries for
+    the same problem, so the cache does not grow as problems are edited.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = Path(directory)
+
+    def key(
+        self,
+        problem: Path,
+        by_hand: bool = False,
+        legacy: bool = False,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """Compute the cache key for ``problem`` with the given options.
+
+        Arguments
+        ---------
+        problem
+            A `~pathlib.Path` to the problem Notebook
+        by_hand, optional
+            Whether the problem is to be completed by hand
+        legacy, optional
+            Whether the legacy method of finding solutions is used
+        options, optional
+            Any other options that change the converted files
+        """
+        digest = hashlib.sha256()
+        digest.update(problem.read_bytes())
+        digest.update(template_file.read_bytes())
+        key_options: Dict[str, Any] = {
+            "version": __version__,
+            "name": problem.name,
+            "by_hand": by_hand,
+            "legacy": legacy,
+        }
+        if options:
+            key_options.update(options)
+        digest.update(json.dumps(key_options, sort_keys=True).encode("utf-8"))
+        return f"{problem.stem}-{digest.hexdigest()}"
+
+    def get(self, key: str) -> Optional[ProblemFiles]:
+        """Return the cached files for ``key``, or `None` if there are none."""
+        files = result_files(self.directory / key)
+        if not all(path.is_file() for path in files):
+            return None
+        return files
+
+    def put(self, key: str, directory: Path) -> ProblemFiles:
+        """Move the converted files in ``directory`` into the cache as ``key``.
+
+        The ``directory`` should be on the same file system as the cache, so
+        that it can be moved without copying. Returns the paths of the files
+        in the cache.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stem = key.rsplit("-", 1)[0]
+        for old_entry in self.directory.glob(f"{stem}-*"):
+            if old_entry.name.rsplit("-", 1)[0] == stem and old_entry.name != key:
+                shutil.rmtree(old_entry, ignore_errors=True)
+
+        entry = self.directory / key
+        if entry.exists():
+            shutil.rmtree(entry, ignore_errors=True)
+        try:
+            # Renaming the whole directory means that an interrupted run never
+            # leaves a partial entry.
+            Path(directory).rename(entry)
+        except OSError:
+            # The directory is on another file system, so copy the files to
+            # a staging directory next to the entry and rename that.
+            staging = Path(tempfile.mkdtemp(dir=self.directory, prefix=".tmp-"))
+            for source, destination in zip(
+                result_files(directory), result_files(staging)
+            ):
+                shutil.copyfile(source, destination)
+            try:
+                staging.rename(entry)
+            except OSError:
+                # Another process stored the same entry first
+                shutil.rmtree(staging, ignore_errors=True)
+        return result_files(entry)
+
+
+class RenderCache:
+    """Cache the LaTeX rendered from Markdown cells in ``directory``.
+
+    Each entry is a file named by a hash of the Markdown source and the
+    ``context`` of the rendering, such as the versions of Pandoc and the
+    filters. Reading an entry updates its modification time, and when the
+    total size of the entries is larger than ``max_size`` bytes, the least
+    recently used entries are removed.
+
+    Arguments
+    ---------
+    directory
+        The directory to store the entries in
+    context
+        Strings that identify how the LaTeX is rendered
+    max_size, optional
+        The maximum size of the cache in bytes
+    """
+
+    def __init__(
+        self, directory: Path, context: Iterable[str], max_size: int = 32 * 2 ** 20
+    ) -> None:
+        self.directory = Path(directory)
+        self.max_size = max_size
+        digest = hashlib.sha256()
+        for item in (__version__, *context):
+            digest.update(item.encode("utf-8") + b"\0")
+        self._context = digest.digest()
+
+    def key(self, source: str) -> str:
+        """Compute the cache key for the Markdown ``source``."""
+        digest = hashlib.sha256(self._context)
+        digest.update(source.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the LaTeX for ``key``, or `None` if it is not cached."""
+        path = self.directory / key
+        try:
+            latex = path.read_text(encoding="utf-8")
+            os.utime(path)
+        except OSError:
+            return None
+        return latex
+
+    def put(self, key: str, latex: str) -> None:
+        """Store the rendered ``latex`` as ``key``."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / key
+        staging = self.directory / f".{key}.{os.getpid()}.tmp"
+        staging.write_text(latex, encoding="utf-8")
+        os.replace(staging, path)
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits."""
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.startswith(".") or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        except OSError:
+            return
+        if total <= self.max_size:
+            return
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_size:
+                break
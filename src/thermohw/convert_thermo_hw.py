@@ -20,63 +20,685 @@ Input files should be named according to the convention::
 where ``A`` is the homework number and ``B`` is the problem number of this input
 file in the homework assignment.
 
+The exporters are built the first time they are needed by `get_exporters`,
+and the modules that depend on nbconvert are imported at the same time, so
+that the command line interface starts quickly.
+
 Methods
 -------
-process(hw_num, problems_to_do=None, prefix=None): Process the files for
-    homework number ``hw_num``. Only process the specific problems in the
-    ``problems`` argument.
+get_exporters(): Return the Notebook and PDF exporters, building them the first
+    time this is called.
+
+process(hw_num, problems_to_do=None, prefix=None, jobs=1, profile=None,
+    latex_jobs=1): Process the files for homework number ``hw_num``. Only process
+    the specific problems in the ``problems`` argument. Convert up to ``jobs``
+    problems concurrently, or with one job, run up to ``latex_jobs`` LaTeX
+    processes while the next problems are prepared. Write the time spent in each
+    stage to the ``profile`` trace file.
+
+process_course(hw_nums=None, course_root=None, jobs=1): Process the files for
+    several homework assignments in the ``course_root`` folder with a single pool
+    of ``jobs`` workers, writing the files of each homework as soon as its
+    problems are converted.
+
+watch(hw_num, problems_to_do=None, prefix=None, interval=1.0, draft=False,
+    **kwargs): Process the files for homework number ``hw_num`` again whenever
+    they change, or write the HTML drafts of the problems with
+    `thermohw.draft.process_draft`.
 
 main(argv=None): Process the command line arguments and run the `process`
-    function
+    function, or serve conversions with `thermohw.server.serve`
 
 """
 # Standard library
-from typing import Iterable, Dict, Sequence, Optional, List, Any, Union
+from typing import (
+    TYPE_CHECKING,
+    Iterable,
+    Dict,
+    Sequence,
+    Optional,
+    List,
+    Tuple,
+    Any,
+    Callable,
+    Set,
+)
 from pathlib import Path
-from argparse import ArgumentParser
-from zipfile import ZipFile
-from io import BytesIO
-from datetime import date
+from argparse import ArgumentParser, ArgumentTypeError
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
+from functools import lru_cache
+import asyncio
 import shutil
 import sys
-
-# Third Party
-from nbconvert import NotebookExporter, PDFExporter
-from traitlets.config import Config
-from nbconvert.writers import FilesWriter
-import nbformat
+import tempfile
+import time
+import traceback
 
 # Local imports
-from .extract_attachments import ExtractAttachmentsPreprocessor
-from .pymarkdown import PyMarkdownPreprocessor
-from .preprocessors import RawRemover, SolutionRemover
-from .filters import convert_div, convert_raw_html
-from .utils import combine_pdf_as_bytes
-
-c = Config()
-here = Path(__file__).resolve().parent
-c.PDFExporter.template_file = str(here / "homework.tpl")
-c.PDFExporter.filters = {
-    "convert_div": convert_div,
-    "convert_raw_html": convert_raw_html,
-}
-c.PDFExporter.latex_count = 1
-
-
-nb_exp = NotebookExporter(
-    preprocessors=[RawRemover, SolutionRemover, PyMarkdownPreprocessor]
+from .memory import MemoryBudget, parse_size
+from .profiling import Event, profiler, stage
+from .cache import (
+    draft_template_file,
+    template_file,
+    BuildCache,
+    ProblemFiles,
+    ProblemResult,
+    CACHE_DIRECTORY_NAME,
+    write_result,
 )
 
-pdf_exp = PDFExporter(
-    preprocessors=[
-        RawRemover,
-        SolutionRemover,
-        PyMarkdownPreprocessor,
-        ExtractAttachmentsPreprocessor(config=c),
-    ],
-    config=c,
-)
-pdf_exp.writer.build_directory = "."
+if TYPE_CHECKING:
+    # typing only
+    from nbformat import NotebookNode  # noqa: F401
+    from traitlets.config import Config  # noqa: F401
+    from .exporters import (  # noqa: F401
+        HomeworkNotebookExporter,
+        HomeworkPDFExporter,
+    )
+    from .utils import ZipMember  # noqa: F401
+
+
+@lru_cache(maxsize=None)
+def get_exporters() -> Tuple["HomeworkNotebookExporter", "HomeworkPDFExporter"]:
+    """Return the Notebook and PDF exporters, building them on the first call.
+
+    Building the exporters imports nbconvert, which takes most of the time
+    of starting the program, so it is only done once a problem is converted.
+    """
+    from traitlets.config import Config
+    from .preprocessors import HomeworkPreprocessor
+    from .prerender import MarkdownPrerenderer
+    from .filters import convert_div, convert_raw_html, convert_filters
+    from .exporters import HomeworkNotebookExporter, HomeworkPDFExporter
+    from .images import ImageOptimizer
+
+    c = Config()
+    c.PDFExporter.template_file = str(template_file)
+    c.PDFExporter.filters = {
+        "convert_div": convert_div,
+        "convert_raw_html": convert_raw_html,
+        "convert_filters": convert_filters,
+    }
+    c.PDFExporter.latex_count = 1
+    c.HomeworkPreprocessor.extract_attachments = True
+    # Keep the memory used by large attachments bounded
+    c.ExtractAttachmentsPreprocessor.spill_to_disk = True
+
+    nb_exp = HomeworkNotebookExporter(preprocessors=[HomeworkPreprocessor])
+
+    pdf_exp = HomeworkPDFExporter(
+        preprocessors=[HomeworkPreprocessor, MarkdownPrerenderer], config=c
+    )
+    pdf_exp.writer.build_directory = "."
+    # Disabled unless the images are to be optimized
+    pdf_exp.register_preprocessor(ImageOptimizer(parent=pdf_exp))
+    return nb_exp, pdf_exp
+
+
+def __getattr__(name: str) -> Any:
+    """Build the exporters when ``nb_exp`` or ``pdf_exp`` are first used."""
+    if name == "nb_exp":
+        return get_exporters()[0]
+    if name == "pdf_exp":
+        return get_exporters()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def configure_exporters(config: "Config") -> None:
+    """Update the configuration of the exporters and their preprocessors.
+
+    This is also the initializer of the worker processes, so that they use
+    the same configuration as the main process.
+    """
+    from traitlets.config import Configurable
+
+    for exporter in get_exporters():
+        exporter.update_config(config)
+        for preprocessor in exporter._preprocessors:
+            if isinstance(preprocessor, Configurable):
+                preprocessor.update_config(config)
+
+
+def _init_worker(config: "Config", profile: bool, track_memory: bool = False) -> None:
+    """Configure the exporters and the profiler of a worker process."""
+    configure_exporters(config)
+    # Forked workers start with a copy of the events of the main process
+    profiler.collect()
+    profiler.enabled = profile
+    profiler.track_memory = track_memory
+
+
+def exporter_config(
+    precompile_preamble: bool = False,
+    optimize_images: bool = False,
+    image_dpi: int = 150,
+    cache_size: Optional[int] = None,
+) -> "Config":
+    """Return the configuration of the exporters for the conversion options.
+
+    See `process` for the arguments. ``cache_size`` is the number of bytes
+    that each cache kept in memory may use, or `None` for the defaults.
+    """
+    from traitlets.config import Config
+
+    config = Config()
+    config.HomeworkPDFExporter.precompile_preamble = precompile_preamble
+    config.ImageOptimizer.enabled = optimize_images
+    config.ImageOptimizer.dpi = image_dpi
+    if cache_size is not None:
+        config.ExtractAttachmentsPreprocessor.decoded_cache_size = cache_size
+        config.ImageOptimizer.memory_cache_size = cache_size
+    return config
+
+
+def problem_resources(unique_key: str, by_hand: bool, legacy: bool) -> Dict[str, Any]:
+    """Return the export resources of a problem.
+
+    The ``remove_solution`` key is set for each variant before exporting.
+    """
+    return {
+        "delete_pymarkdown": True,
+        "global_content_filter": {"include_raw": False},
+        "legacy": legacy,
+        "unique_key": unique_key,
+        "by_hand": by_hand,
+    }
+
+
+def _read_problem(
+    problem: Path, by_hand: bool, legacy: bool
+) -> Tuple["NotebookNode", Dict[str, Any]]:
+    """Read the ``problem`` Notebook and return it with the export resources."""
+    import nbformat
+
+    res = problem_resources(problem.stem, by_hand, legacy)
+    problem_fname = str(problem.resolve())
+    with stage("read"):
+        problem_nb = nbformat.read(problem_fname, as_version=4)
+    if "celltoolbar" in problem_nb.metadata:
+        del problem_nb.metadata["celltoolbar"]
+    return problem_nb, res
+
+
+def convert_problem(
+    problem: Path, by_hand: bool = False, legacy: bool = False
+) -> ProblemResult:
+    """Convert a single homework problem to its assignment and solution files.
+
+    Arguments
+    ---------
+    problem
+        A `~pathlib.Path` to the problem Notebook
+    by_hand, optional
+        A boolean flag determining whether the problem should be labeled
+        to be completed by hand.
+    legacy, optional
+        A boolean flag determining whether the legacy method of finding
+        solutions will be used, based on parsing cell content.
+
+    Returns
+    -------
+    tuple
+        The assignment PDF, the assignment Notebook, the solution PDF,
+        and the solution Notebook, in that order.
+    """
+    nb_exp, pdf_exp = get_exporters()
+    print("Working on:", problem)
+    with stage("problem", problem=problem.stem):
+        problem_nb, res = _read_problem(problem, by_hand, legacy)
+
+        # Process assignments
+        res["remove_solution"] = True
+        with stage("export:pdf", variant="assignment"):
+            assignment_pdf, _ = pdf_exp.from_notebook_node(problem_nb, resources=res)
+        with stage("export:notebook", variant="assignment"):
+            assignment_nb, _ = nb_exp.from_notebook_node(problem_nb, resources=res)
+
+        # Process solutions
+        res["remove_solution"] = False
+        with stage("export:pdf", variant="solution"):
+            solution_pdf, _ = pdf_exp.from_notebook_node(problem_nb, resources=res)
+        with stage("export:notebook", variant="solution"):
+            solution_nb, _ = nb_exp.from_notebook_node(problem_nb, resources=res)
+
+        return assignment_pdf, assignment_nb, solution_pdf, solution_nb
+
+
+async def convert_problem_async(
+    problem: Path,
+    latex_slots: asyncio.Semaphore,
+    by_hand: bool = False,
+    legacy: bool = False,
+) -> ProblemResult:
+    """Convert a single homework problem, running LaTeX as asyncio subprocesses.
+
+    The Notebooks are preprocessed and the LaTeX is rendered in this thread,
+    and each PDF is compiled as soon as its LaTeX is ready, so the solution is
+    prepared while the assignment PDF compiles. The result is the same as
+    `convert_problem`.
+
+    Arguments
+    ---------
+    problem
+        A `~pathlib.Path` to the problem Notebook
+    latex_slots
+        A semaphore that limits the number of LaTeX processes that run at once
+    by_hand, legacy, optional
+        See `convert_problem`.
+    """
+    nb_exp, pdf_exp = get_exporters()
+    print("Working on:", problem)
+
+    async def compile_pdf(latex: str, resources: Dict[str, Any]) -> bytes:
+        async with latex_slots:
+            pdf, _ = await pdf_exp.pdf_from_latex_async(latex, resources)
+        return pdf
+
+    with stage("problem", problem=problem.stem):
+        problem_nb, res = _read_problem(problem, by_hand, legacy)
+        pdfs: List["asyncio.Future[bytes]"] = []
+        notebooks: List[str] = []
+        for variant, remove_solution in (("assignment", True), ("solution", False)):
+            res["remove_solution"] = remove_solution
+            with stage("export:latex", variant=variant):
+                latex, resources = pdf_exp.latex_from_notebook_node(
+                    problem_nb, resources=res
+                )
+            pdfs.append(asyncio.ensure_future(compile_pdf(latex, resources)))
+            # Let the LaTeX process start before the next export
+            await asyncio.sleep(0)
+            with stage("export:notebook", variant=variant):
+                notebook, _ = nb_exp.from_notebook_node(problem_nb, resources=res)
+            notebooks.append(notebook)
+
+        try:
+            assignment_pdf, solution_pdf = await asyncio.gather(*pdfs)
+        except BaseException:
+            for pdf in pdfs:
+                pdf.cancel()
+            raise
+
+    return assignment_pdf, notebooks[0], solution_pdf, notebooks[1]
+
+
+def _convert_problem_to_files(
+    problem: Path, directory: Path, by_hand: bool = False, legacy: bool = False
+) -> Tuple[ProblemFiles, List[Event]]:
+    """Convert a single homework problem and write the files to ``directory``.
+
+    Writing the files in the worker means that only the paths are sent back
+    to the main process, instead of the contents of the PDFs. The events
+    recorded by the profiler of the worker are sent back with the paths.
+    """
+    result = convert_problem(problem, by_hand, legacy)
+    with stage("write", problem=problem.stem):
+        files = write_result(directory, result)
+    return files, profiler.collect()
+
+
+def find_problems(
+    hw_num: int, problems_to_do: Optional[Iterable[int]], prefix: Path
+) -> List[Path]:
+    """Find the problem Notebooks of homework ``hw_num`` in the ``prefix`` folder.
+
+    If ``problems_to_do`` is given, only those problems are returned.
+    """
+    problems: Iterable[Path]
+
+    if problems_to_do is None:
+        # The glob syntax here means a the filename must start with
+        # homework-, be followed the homework number, followed by a
+        # dash, then a digit representing the problem number for this
+        # homework number, then any number of characters (in practice
+        # either nothing or, rarely, another digit), then the ipynb
+        # extension. Examples:
+        # homework-1-1.ipynb, homework-10-1.ipynb, homework-3-10.ipynb
+        problems = list(prefix.glob(f"homework-{hw_num}-[0-9]*.ipynb"))
+    else:
+        problems = [prefix / f"homework-{hw_num}-{i}.ipynb" for i in problems_to_do]
+
+    return sorted(problems, key=lambda k: k.stem[-1])
+
+
+class _HomeworkBuild:
+    """The state of converting and assembling the problems of one homework.
+
+    Arguments
+    ---------
+    hw_num
+        The number of this homework
+    prefix
+        A `~pathlib.Path` to this homework assignment folder
+    problems_to_do
+        A list of the problems to be processed, or `None` for all problems
+    by_hand
+        A list of the problems that should be labeled to be completed by hand
+    legacy
+        A boolean flag determining whether the legacy method of finding
+        solutions will be used
+    """
+
+    def __init__(
+        self,
+        hw_num: int,
+        prefix: Path,
+        problems_to_do: Optional[Iterable[int]],
+        by_hand: Optional[Iterable[int]],
+        legacy: bool,
+    ) -> None:
+        self.hw_num = hw_num
+        self.legacy = legacy
+        # When only some problems are converted, keep the other problems that
+        # are already in the archives.
+        self.keep_existing = problems_to_do is not None
+        self.problems = find_problems(hw_num, problems_to_do, prefix)
+        # The order of all of the problems of the homework, so that a new
+        # problem is added among the problems that are kept in the zip files
+        # and the merged PDFs
+        self.order = [problem.stem for problem in find_problems(hw_num, None, prefix)]
+        self.output_directory: Path = (prefix / "output").resolve()
+
+        by_hand_problems = set(by_hand) if by_hand is not None else set()
+        self.by_hand_flags = [
+            int(problem.stem.split("-")[-1]) in by_hand_problems
+            for problem in self.problems
+        ]
+        self.results: List[Optional[ProblemFiles]] = [None] * len(self.problems)
+        self.cache: Optional[BuildCache] = None
+        self.cache_keys: List[str] = []
+        self.to_convert: List[int] = []
+        self._build_directory: Optional[tempfile.TemporaryDirectory] = None
+
+    def start(self, use_cache: bool, cache_options: Dict[str, Any]) -> None:
+        """Create the output folder and find the problems to convert.
+
+        The problems that are in the cache are not converted again. The
+        ``cache_options`` are the other options that change the converted
+        files.
+        """
+        self.output_directory.mkdir(parents=True, exist_ok=True)
+        # The converted files are written to a build directory next to the
+        # cache, so that they can be moved into the cache without copying them.
+        self._build_directory = tempfile.TemporaryDirectory(
+            dir=self.output_directory, prefix=".build-"
+        )
+        if use_cache:
+            self.cache = BuildCache(self.output_directory / CACHE_DIRECTORY_NAME)
+
+        for index, (problem, problem_by_hand) in enumerate(
+            zip(self.problems, self.by_hand_flags)
+        ):
+            if self.cache is not None:
+                with stage("cache", problem=problem.stem):
+                    key = self.cache.key(
+                        problem,
+                        by_hand=problem_by_hand,
+                        legacy=self.legacy,
+                        options=cache_options,
+                    )
+                    self.results[index] = self.cache.get(key)
+                self.cache_keys.append(key)
+                if self.results[index] is not None:
+                    print("Using cached:", problem)
+                    continue
+            self.to_convert.append(index)
+
+    def convert_args(self, index: int) -> Tuple[Path, Path, bool, bool]:
+        """Return the arguments of `_convert_problem_to_files` for a problem."""
+        assert self._build_directory is not None
+        problem = self.problems[index]
+        directory = Path(self._build_directory.name) / problem.stem
+        return problem, directory, self.by_hand_flags[index], self.legacy
+
+    def add_result(self, index: int, files: ProblemFiles) -> None:
+        """Store the converted files of a problem, adding them to the cache."""
+        if self.cache is not None:
+            files = self.cache.put(self.cache_keys[index], files[0].parent)
+        self.results[index] = files
+
+    @property
+    def done(self) -> bool:
+        """Whether all of the problems have been converted."""
+        return all(result is not None for result in self.results)
+
+    def finish(self, zip_level: int) -> None:
+        """Write the merged PDFs and zip files of the homework."""
+        from .utils import combine_pdfs, write_zip
+
+        hw_num = self.hw_num
+        output_directory = self.output_directory
+        assignment_zip_name = output_directory / f"homework-{hw_num}.zip"
+        solution_zip_name = output_directory / f"homework-{hw_num}-soln.zip"
+
+        assignment_pdfs: List[Path] = []
+        solution_pdfs: List[Path] = []
+        assignment_nbs: List["ZipMember"] = []
+        solution_nbs: List["ZipMember"] = []
+
+        for problem, result in zip(self.problems, self.results):
+            assert result is not None
+            assignment_pdf, assignment_nb, solution_pdf, solution_nb = result
+            assignment_pdfs.append(assignment_pdf)
+            solution_pdfs.append(solution_pdf)
+            assignment_nbs.append((problem.name, assignment_nb))
+            solution_nbs.append((problem.stem + "-soln" + problem.suffix, solution_nb))
+
+        keep_existing = self.keep_existing
+        with stage("zip", homework=hw_num, variant="assignment"):
+            write_zip(
+                assignment_zip_name,
+                assignment_nbs,
+                zip_level,
+                keep_existing,
+                order=[f"{stem}.ipynb" for stem in self.order],
+            )
+        with stage("zip", homework=hw_num, variant="solution"):
+            write_zip(
+                solution_zip_name,
+                solution_nbs,
+                zip_level,
+                keep_existing,
+                order=[f"{stem}-soln.ipynb" for stem in self.order],
+            )
+
+        # The page index of each merged PDF is used to replace only the pages
+        # of the converted problems when only some problems are converted. The
+        # fonts and other resources shared by the problems are written once.
+        labels = [problem.stem for problem in self.problems]
+        for variant, pdfs, pdf_name in (
+            ("assignment", assignment_pdfs, f"homework-{hw_num}.pdf"),
+            ("solution", solution_pdfs, f"homework-{hw_num}-soln.pdf"),
+        ):
+            output = output_directory / pdf_name
+            existed = output.is_file()
+            with stage("merge", homework=hw_num, variant=variant):
+                kept = combine_pdfs(
+                    pdfs,
+                    output,
+                    labels,
+                    keep_existing,
+                    deduplicate=True,
+                    order=self.order,
+                )
+            if keep_existing and existed and not kept:
+                print(
+                    f"The pages of the other problems in {pdf_name} could not be "
+                    "found, so it only has the converted problems"
+                )
+        self.cleanup()
+
+    def cleanup(self) -> None:
+        """Remove the build directory."""
+        if self._build_directory is not None:
+            self._build_directory.cleanup()
+            self._build_directory = None
+
+
+async def _convert_problems_async(
+    tasks: Sequence[Tuple[_HomeworkBuild, int]],
+    latex_jobs: int,
+    add_result: Callable[[_HomeworkBuild, int, Tuple[ProblemFiles, List[Event]]], None],
+    budget: Optional[MemoryBudget] = None,
+) -> None:
+    """Convert the problems of ``tasks`` in order, overlapping LaTeX with the rest.
+
+    The next problem is read, preprocessed, and rendered while the PDFs of the
+    previous problems compile, with up to ``latex_jobs`` LaTeX processes at
+    once. At most ``latex_jobs + 1`` problems are in progress, the problems
+    that compile and one that is prepared, so that the rendered problems
+    don't pile up in memory, and problems are only prepared while the memory
+    used is below the ``budget``.
+    """
+    latex_slots = asyncio.Semaphore(latex_jobs)
+
+    async def convert(build: _HomeworkBuild, index: int) -> None:
+        problem, directory, by_hand, legacy = build.convert_args(index)
+        result = await convert_problem_async(problem, latex_slots, by_hand, legacy)
+        with stage("write", problem=problem.stem):
+            files = write_result(directory, result)
+        # The events are already recorded by the profiler of this process
+        add_result(build, index, (files, []))
+
+    running: Set["asyncio.Future[None]"] = set()
+    try:
+        for build, index in tasks:
+            # One more problem than the LaTeX processes, which is prepared
+            # while the others compile
+            while len(running) > latex_jobs or (
+                running and budget is not None and budget.exceeded()
+            ):
+                done, running = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    future.result()
+            running.add(asyncio.ensure_future(convert(build, index)))
+            # Start preparing the problem before deciding on the next one
+            await asyncio.sleep(0)
+        if running:
+            await asyncio.gather(*running)
+    except BaseException:
+        for future in running:
+            future.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        raise
+
+
+def _run_builds(
+    builds: Sequence[_HomeworkBuild],
+    jobs: int,
+    use_cache: bool,
+    zip_level: int,
+    profile: Optional[Path],
+    precompile_preamble: bool,
+    optimize_images: bool,
+    image_dpi: int,
+    latex_jobs: int = 1,
+    memory_budget: Optional[int] = None,
+) -> None:
+    """Convert the problems of all of the ``builds`` and assemble each homework.
+
+    The problems are converted in the order of the ``builds``, and each
+    homework is assembled as soon as its last problem is converted. See
+    `process` for the arguments.
+    """
+    budget = None if memory_budget is None else MemoryBudget(memory_budget)
+    config = exporter_config(
+        precompile_preamble,
+        optimize_images,
+        image_dpi,
+        cache_size=None if budget is None else budget.cache_size,
+    )
+    configure_exporters(config)
+
+    # Options that change the converted files are part of the cache key
+    cache_options: Dict[str, Any] = {}
+    if optimize_images:
+        cache_options["image_dpi"] = image_dpi
+
+    if profile is not None or budget is not None:
+        profiler.enabled = True
+        profiler.track_memory = budget is not None
+        profiler.collect()
+
+    try:
+        # The latest RSS of each worker process, from its profiler events
+        worker_rss: Dict[int, int] = {}
+
+        def over_budget() -> bool:
+            return budget is not None and budget.exceeded(worker_rss.values())
+
+        tasks = []
+        for build in builds:
+            build.start(use_cache, cache_options)
+            if build.done:
+                build.finish(zip_level)
+            tasks.extend((build, index) for index in build.to_convert)
+
+        def add_result(
+            build: _HomeworkBuild,
+            index: int,
+            converted: Tuple[ProblemFiles, List[Event]],
+        ) -> None:
+            files, events = converted
+            for event in events:
+                if event["args"].get("rss") is not None:
+                    worker_rss[event["pid"]] = event["args"]["rss"]
+            profiler.events.extend(events)
+            build.add_result(index, files)
+            if build.done:
+                build.finish(zip_level)
+
+        if jobs > 1 and len(tasks) > 1:
+            # The results are stored by index, so the merged outputs match a
+            # serial run regardless of the order the problems finish in.
+            with ProcessPoolExecutor(
+                max_workers=jobs,
+                initializer=_init_worker,
+                initargs=(config, profiler.enabled, profiler.track_memory),
+            ) as executor:
+                futures: Dict["Future[Tuple[ProblemFiles, List[Event]]]", Any] = {}
+                for build, index in tasks:
+                    # With a memory budget, only give the workers a new problem
+                    # when one is free and the memory used is below the budget
+                    while (
+                        budget is not None
+                        and futures
+                        and (len(futures) >= jobs or over_budget())
+                    ):
+                        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            add_result(*futures.pop(future), future.result())
+                    futures[
+                        executor.submit(
+                            _convert_problem_to_files, *build.convert_args(index)
+                        )
+                    ] = (build, index)
+                for future in as_completed(futures):
+                    add_result(*futures[future], future.result())
+        elif latex_jobs > 1 and tasks:
+            asyncio.run(
+                _convert_problems_async(tasks, latex_jobs, add_result, budget)
+            )
+        else:
+            for build, index in tasks:
+                add_result(
+                    build, index, _convert_problem_to_files(*build.convert_args(index))
+                )
+    finally:
+        for build in builds:
+            build.cleanup()
+
+    if profile is not None:
+        profiler.write_trace(profile)
+    if profile is not None or budget is not None:
+        profiler.print_summary()
 
 
 def process(
@@ -85,6 +707,15 @@ def process(
     prefix: Optional[Path] = None,
     by_hand: Optional[Iterable[int]] = None,
     legacy: bool = False,
+    jobs: int = 1,
+    use_cache: bool = True,
+    precompile_preamble: bool = False,
+    zip_level: int = 6,
+    profile: Optional[Path] = None,
+    optimize_images: bool = False,
+    image_dpi: int = 150,
+    latex_jobs: int = 1,
+    memory_budget: Optional[int] = None,
 ) -> None:
     """Process the homework problems in ``prefix`` folder.
 
@@ -102,89 +733,265 @@ def process(
     legacy, optional
         A boolean flag determining whether the legacy method of finding
         solutions will be used, based on parsing cell content.
+    jobs, optional
+        The number of problems to convert concurrently in separate
+        processes. The output is identical to converting the problems
+        one at a time.
+    use_cache, optional
+        A boolean flag determining whether converted problems are stored
+        in and retrieved from the cache in the output folder. Problems are
+        only converted again when the Notebook, the template, the version
+        of thermohw, or the options change.
+    precompile_preamble, optional
+        A boolean flag determining whether the LaTeX preamble is compiled
+        to a format file once and reused for every PDF. See
+        `~thermohw.exporters.HomeworkPDFExporter`.
+    zip_level, optional
+        The level of compression of the zip files of Notebooks, from 0 (no
+        compression) to 9. The zip files are identical for identical inputs.
+    profile, optional
+        A `~pathlib.Path` to write the time spent in each stage of the
+        conversion to, in the Chrome trace event format. A summary of the
+        time spent in each stage is also printed.
+    optimize_images, optional
+        A boolean flag determining whether the PNG and JPEG attachments are
+        resized and recompressed before they are included in the PDFs. See
+        `~thermohw.images.ImageOptimizer`. Requires Pillow.
+    image_dpi, optional
+        The resolution of the optimized images in the PDFs.
+    latex_jobs, optional
+        The number of LaTeX processes to run at once when ``jobs`` is 1. If
+        more than 1, LaTeX runs as asyncio subprocesses, and the next problem
+        is prepared while the PDFs of the previous problems compile. The
+        output is identical to converting the problems one at a time.
+    memory_budget, optional
+        The number of bytes of memory that the conversion should stay below,
+        including the worker processes. Over the budget, no new problems are
+        started until the problems in progress are done, although one
+        problem is always in progress. The caches kept in memory are sized
+        to fit in the budget, and the peak RSS of each stage is printed at
+        the end. See `~thermohw.memory.MemoryBudget`.
     """
+    if jobs < 1:
+        raise ValueError(f"The number of jobs must be at least 1, not {jobs}.")
+    if latex_jobs < 1:
+        raise ValueError(
+            f"The number of LaTeX jobs must be at least 1, not {latex_jobs}."
+        )
+
     if prefix is None:
         prefix = Path(".")
 
-    problems: Iterable[Path]
+    build = _HomeworkBuild(hw_num, prefix, problems_to_do, by_hand, legacy)
+    _run_builds(
+        [build],
+        jobs,
+        use_cache,
+        zip_level,
+        profile,
+        precompile_preamble=precompile_preamble,
+        optimize_images=optimize_images,
+        image_dpi=image_dpi,
+        latex_jobs=latex_jobs,
+        memory_budget=memory_budget,
+    )
 
-    if problems_to_do is None:
-        # The glob syntax here means a the filename must start with
-        # homework-, be followed the homework number, followed by a
-        # dash, then a digit representing the problem number for this
-        # homework number, then any number of characters (in practice
-        # either nothing or, rarely, another digit), then the ipynb
-        # extension. Examples:
-        # homework-1-1.ipynb, homework-10-1.ipynb, homework-3-10.ipynb
-        problems = list(prefix.glob(f"homework-{hw_num}-[0-9]*.ipynb"))
-    else:
-        problems = [prefix / f"homework-{hw_num}-{i}.ipynb" for i in problems_to_do]
 
-    problems = sorted(problems, key=lambda k: k.stem[-1])
+def find_homeworks(course_root: Path) -> List[int]:
+    """Find the numbers of the homework folders in the ``course_root`` folder.
 
-    output_directory: Path = (prefix / "output").resolve()
-    fw = FilesWriter(build_directory=str(output_directory))
+    The homework folders are named ``homework/homework-N`` in the course root.
+    """
+    numbers = []
+    for folder in (course_root / "homework").glob("homework-*"):
+        number = folder.name.split("-", 1)[1]
+        if folder.is_dir() and number.isdigit():
+            numbers.append(int(number))
+    return sorted(numbers)
 
-    assignment_zip_name = output_directory / f"homework-{hw_num}.zip"
-    solution_zip_name = output_directory / f"homework-{hw_num}-soln.zip"
 
-    assignment_pdfs: List[BytesIO] = []
-    solution_pdfs: List[BytesIO] = []
+def process_course(
+    hw_nums: Optional[Iterable[int]] = None,
+    course_root: Optional[Path] = None,
+    legacy: bool = False,
+    jobs: int = 1,
+    use_cache: bool = True,
+    precompile_preamble: bool = False,
+    zip_level: int = 6,
+    profile: Optional[Path] = None,
+    optimize_images: bool = False,
+    image_dpi: int = 150,
+    latex_jobs: int = 1,
+    memory_budget: Optional[int] = None,
+) -> None:
+    """Process several homework assignments of a course at once.
 
-    assignment_pdf: bytes
-    solution_pdf: bytes
-    assignment_nb: str
-    solution_nb: str
+    The problems of all of the homework assignments are converted by one pool
+    of ``jobs`` worker processes, in the order of the homework numbers. The
+    merged PDFs and zip files of each homework are written as soon as all of
+    its problems are converted, while the problems of later homework
+    assignments are still being converted.
 
-    res: Dict[str, Union[Dict[str, bool], str, bool]] = {
-        "delete_pymarkdown": True,
-        "global_content_filter": {"include_raw": False},
-        "legacy": legacy,
-    }
+    Arguments
+    ---------
+    hw_nums, optional
+        The numbers of the homework assignments to process. By default, every
+        homework folder in the course root is processed.
+    course_root, optional
+        A `~pathlib.Path` to the folder with the ``homework`` folder of the
+        course. Defaults to the current folder.
+    legacy, jobs, use_cache, precompile_preamble, zip_level, profile, optional
+        See `process`.
+    optimize_images, image_dpi, latex_jobs, memory_budget, optional
+        See `process`.
+    """
+    if jobs < 1:
+        raise ValueError(f"The number of jobs must be at least 1, not {jobs}.")
+    if latex_jobs < 1:
+        raise ValueError(
+            f"The number of LaTeX jobs must be at least 1, not {latex_jobs}."
+        )
 
-    for problem in problems:
-        print("Working on:", problem)
-        res["unique_key"] = problem.stem
-        problem_number = int(problem.stem.split("-")[-1])
-        if by_hand is not None and problem_number in by_hand:
-            res["by_hand"] = True
-        else:
-            res["by_hand"] = False
-        problem_fname = str(problem.resolve())
-        problem_nb = nbformat.read(problem_fname, as_version=4)
-        if "celltoolbar" in problem_nb.metadata:
-            del problem_nb.metadata["celltoolbar"]
+    if course_root is None:
+        course_root = Path(".")
+    if hw_nums is None:
+        hw_nums = find_homeworks(course_root)
 
-        # Process assignments
-        res["remove_solution"] = True
-        assignment_pdf, _ = pdf_exp.from_notebook_node(problem_nb, resources=res)
-        assignment_pdfs.append(BytesIO(assignment_pdf))
+    builds = []
+    for hw_num in hw_nums:
+        prefix = course_root / "homework" / f"homework-{hw_num}"
+        build = _HomeworkBuild(hw_num, prefix, None, None, legacy)
+        if not build.problems:
+            print(f"No problems found for homework {hw_num} in {prefix}")
+            continue
+        builds.append(build)
 
-        assignment_nb, _ = nb_exp.from_notebook_node(problem_nb, resources=res)
-        with ZipFile(assignment_zip_name, mode="a") as zip_file:
-            zip_file.writestr(problem.name, assignment_nb)
+    _run_builds(
+        builds,
+        jobs,
+        use_cache,
+        zip_level,
+        profile,
+        precompile_preamble=precompile_preamble,
+        optimize_images=optimize_images,
+        image_dpi=image_dpi,
+        latex_jobs=latex_jobs,
+        memory_budget=memory_budget,
+    )
+
+
+def _snapshot(paths: Iterable[Path]) -> Dict[Path, Tuple[int, int]]:
+    """Return the modification time and size of each of the ``paths``."""
+    snapshot = {}
+    for path in paths:
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def watch(
+    hw_num: int,
+    problems_to_do: Optional[Iterable[int]] = None,
+    prefix: Optional[Path] = None,
+    interval: float = 1.0,
+    draft: bool = False,
+    **kwargs: Any,
+) -> None:
+    """Process the homework problems again whenever they change.
+
+    The problems are converted once, and then the folder is checked for
+    changes every ``interval`` seconds until interrupted. The problems are
+    converted in this process, so the exporters are only set up once, and the
+    cache in the output folder means that only the problems whose content
+    changed are converted again. The combined PDFs and zip files are written
+    after every change.
+
+    Arguments
+    ---------
+    hw_num
+        The number of this homework
+    problems_to_do, optional
+        A list of the problems to be processed
+    prefix, optional
+        A `~pathlib.Path` to this homework assignment folder
+    interval, optional
+        The number of seconds between checks for changes
+    draft, optional
+        A boolean flag determining whether the HTML drafts of the problems
+        are written with `~thermohw.draft.process_draft` instead of the PDFs
+    kwargs, optional
+        Other arguments passed to `process`, or to
+        `~thermohw.draft.process_draft` for drafts. The cache is always used
+        for the PDFs.
+    """
+    folder = Path(".") if prefix is None else prefix
+    problem_numbers = None if problems_to_do is None else list(problems_to_do)
+    convert: Callable[..., Any]
+    if draft:
+        from .draft import process_draft
+
+        convert = process_draft
+        watched_template = draft_template_file
+    else:
+        convert = process
+        watched_template = template_file
+        kwargs["use_cache"] = True
+
+    def current_snapshot() -> Dict[Path, Tuple[int, int]]:
+        problems = find_problems(hw_num, problem_numbers, folder)
+        return _snapshot(problems + [watched_template])
+
+    last_snapshot = None
+    try:
+        while True:
+            snapshot = current_snapshot()
+            if snapshot != last_snapshot:
+                # Editors often save a file in several steps, so wait for the
+                # files to settle before converting them.
+                time.sleep(interval)
+                if current_snapshot() != snapshot:
+                    continue
+                try:
+                    convert(hw_num, problem_numbers, folder, **kwargs)
+                except Exception:
+                    traceback.print_exc()
+                last_snapshot = snapshot
+                print("Watching for changes, press Ctrl+C to stop")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
 
-        # Process solutions
-        res["remove_solution"] = False
-        solution_pdf, _ = pdf_exp.from_notebook_node(problem_nb, resources=res)
-        solution_pdfs.append(BytesIO(solution_pdf))
-
-        solution_nb, _ = nb_exp.from_notebook_node(problem_nb, resources=res)
-        with ZipFile(solution_zip_name, mode="a") as zip_file:
-            zip_file.writestr(problem.stem + "-soln" + problem.suffix, solution_nb)
-
-    resources: Dict[str, Any] = {
-        "metadata": {
-            "name": f"homework-{hw_num}",
-            "path": str(prefix),
-            "modified_date": date.today().strftime("%B %d, %Y"),
-        },
-        "output_extension": ".pdf",
-    }
-    fw.write(combine_pdf_as_bytes(assignment_pdfs), resources, f"homework-{hw_num}")
 
-    resources["metadata"]["name"] = f"homework-{hw_num}-soln"
-    fw.write(combine_pdf_as_bytes(solution_pdfs), resources, f"homework-{hw_num}-soln")
+def parse_homework_numbers(value: str) -> List[int]:
+    """Parse a homework number, such as ``3``, or a range, such as ``1-15``."""
+    first, _, last = value.partition("-")
+    try:
+        start = int(first)
+        stop = int(last) if last else start
+    except ValueError:
+        raise ArgumentTypeError(f"invalid homework number or range: {value!r}")
+    if stop < start:
+        raise ArgumentTypeError(f"invalid homework range: {value!r}")
+    return list(range(start, stop + 1))
+
+
+def parse_memory_size(value: str) -> int:
+    """Parse a memory size, such as ``512M`` or ``2G``, for the command line."""
+    try:
+        return parse_size(value)
+    except ValueError:
+        raise ArgumentTypeError(f"invalid memory size: {value!r}")
+
+
+def parse_server_address(value: str) -> Tuple[str, int]:
+    """Parse the address of the server, such as ``8765`` or ``localhost:8765``."""
+    host, _, port = value.rpartition(":")
+    if not port.isdigit() or int(port) > 65535:
+        raise ArgumentTypeError(f"invalid server address: {value!r}")
+    return host or "127.0.0.1", int(port)
 
 
 def main(argv: Optional[Sequence[str]] = None) -> None:
@@ -192,10 +999,23 @@ def main(argv: Optional[Sequence[str]] = None) -> None:
     parser = ArgumentParser(description="Convert Jupyter Notebook assignments to PDFs")
     parser.add_argument(
         "--hw",
-        type=int,
-        required=True,
-        help="Homework number to convert",
-        dest="hw_num",
+        type=parse_homework_numbers,
+        nargs="+",
+        help=(
+            "Homework numbers or ranges of numbers to convert, such as 3 or 1-15. "
+            "Several homework assignments are converted by one pool of jobs"
+        ),
+        dest="hw_nums",
+        metavar="N[-M]",
+    )
+    parser.add_argument(
+        "--course-root",
+        type=Path,
+        help=(
+            "Folder with the homework folder of the course (default: the current "
+            "folder). Without --hw, every homework in the course is converted"
+        ),
+        dest="course_root",
     )
     parser.add_argument(
         "-p",
@@ -228,20 +1048,249 @@ def main(argv: Optional[Sequence[str]] = None) -> None:
             "finding specific cell content."
         ),
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of problems to convert concurrently (default: 1)",
+        dest="jobs",
+    )
+    parser.add_argument(
+        "--latex-jobs",
+        type=int,
+        default=1,
+        help=(
+            "Number of LaTeX processes to run at once with --jobs 1 or --serve, "
+            "and for each problem with --variants. One more problem is prepared "
+            "while the PDFs compile (default: 1)"
+        ),
+        dest="latex_jobs",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_false",
+        help="Convert every problem, even if it has not changed since the last run",
+        dest="use_cache",
+    )
+    parser.add_argument(
+        "--precompile-preamble",
+        action="store_true",
+        help=(
+            "Compile the LaTeX preamble to a format file once and reuse it for "
+            "every PDF. Requires the mylatexformat LaTeX package."
+        ),
+    )
+    parser.add_argument(
+        "--zip-level",
+        type=int,
+        default=6,
+        choices=range(10),
+        metavar="{0-9}",
+        help="Compression level of the zip files of Notebooks (default: 6)",
+        dest="zip_level",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=(
+            "Keep running and convert the problems again whenever they change. "
+            "Only the changed problems are converted."
+        ),
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="Seconds between checks for changes with --watch (default: 1)",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        metavar="FILE",
+        help=(
+            "Write the time spent in each stage of the conversion to FILE in the "
+            "Chrome trace event format, and print a summary of the stages"
+        ),
+    )
+    parser.add_argument(
+        "--optimize-images",
+        action="store_true",
+        help=(
+            "Resize and recompress the PNG and JPEG attachments to --image-dpi "
+            "before building the PDFs. Requires Pillow."
+        ),
+        dest="optimize_images",
+    )
+    parser.add_argument(
+        "--image-dpi",
+        type=int,
+        default=150,
+        help="Resolution of the optimized images in the PDFs (default: 150)",
+        dest="image_dpi",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=parse_memory_size,
+        metavar="SIZE",
+        help=(
+            "Memory the conversion should stay below, such as 512M or 2G. New "
+            "problems wait while the budget is exceeded, and the peak memory of "
+            "each stage is printed at the end"
+        ),
+        dest="memory_budget",
+    )
+    parser.add_argument(
+        "--variants",
+        type=Path,
+        metavar="CSV",
+        help=(
+            "Convert a variant of the problems for each row of the CSV file, whose "
+            "first column is an ID, such as a student ID, and whose other columns "
+            "are the values of the variables used in the Markdown cells. The "
+            "files of each variant are written to output/variants/ID"
+        ),
+    )
+    parser.add_argument(
+        "--draft",
+        action="store_true",
+        help=(
+            "Render the assignment and the solution of each problem to HTML in "
+            "output/draft for a quick preview, without building the PDFs with "
+            "LaTeX"
+        ),
+    )
+    parser.add_argument(
+        "--serve",
+        type=parse_server_address,
+        metavar="[HOST:]PORT",
+        help=(
+            "Keep the exporters loaded and convert the Notebooks sent to an HTTP "
+            "server on PORT of HOST (default host: 127.0.0.1) instead of a "
+            "homework folder"
+        ),
+    )
     args = parser.parse_args(argv)
-    prefix = Path(f"homework/homework-{args.hw_num}")
+    for option in ("jobs", "latex_jobs"):
+        if getattr(args, option) < 1:
+            parser.error(f"--{option.replace('_', '-')} must be at least 1")
+    if args.serve is not None:
+        for option in ("hw_nums", "watch"):
+            if getattr(args, option):
+                parser.error("--serve can't be used with --hw or --watch")
+        from .server import serve
+
+        host, port = args.serve
+        config = exporter_config(
+            args.precompile_preamble,
+            args.optimize_images,
+            args.image_dpi,
+            cache_size=(
+                None
+                if args.memory_budget is None
+                else MemoryBudget(args.memory_budget).cache_size
+            ),
+        )
+        serve(host, port, jobs=args.latex_jobs, config=config)
+        return
+
+    if args.hw_nums is None and args.course_root is None:
+        parser.error("one of the arguments --hw or --course-root is required")
+
+    course_root = Path(".") if args.course_root is None else args.course_root
+    if args.hw_nums is not None:
+        hw_nums = sorted(set(n for numbers in args.hw_nums for n in numbers))
+    else:
+        hw_nums = find_homeworks(course_root)
+        if not hw_nums:
+            parser.error(f"no homework folders found in {course_root / 'homework'}")
+
+    if len(hw_nums) != 1:
+        for option in ("problems", "by_hand", "watch", "variants", "draft"):
+            if getattr(args, option):
+                parser.error(f"--{option.replace('_', '-')} needs a single homework")
+
     if args.clean:
-        shutil.rmtree(prefix.joinpath("output"), ignore_errors=True)
-        if not args.problems:
+        for hw_num in hw_nums:
+            prefix = course_root / "homework" / f"homework-{hw_num}"
+            shutil.rmtree(prefix.joinpath("output"), ignore_errors=True)
+        if not args.problems and not args.watch:
             sys.exit(0)
 
-    process(
-        args.hw_num,
-        args.problems,
-        prefix=prefix,
-        by_hand=args.by_hand,
+    kwargs: Dict[str, Any] = dict(
         legacy=args.legacy,
+        jobs=args.jobs,
+        latex_jobs=args.latex_jobs,
+        precompile_preamble=args.precompile_preamble,
+        zip_level=args.zip_level,
+        profile=args.profile,
+        optimize_images=args.optimize_images,
+        image_dpi=args.image_dpi,
+        memory_budget=args.memory_budget,
     )
+    if len(hw_nums) != 1:
+        process_course(
+            hw_nums, course_root=course_root, use_cache=args.use_cache, **kwargs
+        )
+        return
+
+    hw_num = hw_nums[0]
+    prefix = course_root / "homework" / f"homework-{hw_num}"
+    kwargs["by_hand"] = args.by_hand
+    if args.draft:
+        if args.variants is not None:
+            parser.error("--draft can't be used with --variants")
+        from .draft import process_draft
+
+        draft_kwargs = dict(by_hand=args.by_hand, legacy=args.legacy)
+        if args.watch:
+            watch(
+                hw_num,
+                args.problems,
+                prefix=prefix,
+                interval=args.interval,
+                draft=True,
+                **draft_kwargs,
+            )
+        else:
+            process_draft(hw_num, args.problems, prefix=prefix, **draft_kwargs)
+        return
+    if args.variants is not None:
+        if args.watch:
+            parser.error("--variants can't be used with --watch")
+        from .variants import process_variants, read_variant_table
+
+        try:
+            variants = read_variant_table(args.variants)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        process_variants(
+            hw_num,
+            variants,
+            args.problems,
+            prefix=prefix,
+            by_hand=args.by_hand,
+            legacy=args.legacy,
+            latex_jobs=args.latex_jobs,
+            precompile_preamble=args.precompile_preamble,
+            zip_level=args.zip_level,
+            optimize_images=args.optimize_images,
+            image_dpi=args.image_dpi,
+            profile=args.profile,
+            jobs=args.jobs,
+            memory_budget=args.memory_budget,
+        )
+        return
+    if args.watch:
+        watch(hw_num, args.problems, prefix=prefix, interval=args.interval, **kwargs)
+    else:
+        process(
+            hw_num,
+            args.problems,
+            prefix=prefix,
+            use_cache=args.use_cache,
+            **kwargs,
+        )
 
 
 if __name__ == "__main__":
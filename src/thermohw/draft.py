@@ -0,0 +1,144 @@
+"""Render quick HTML drafts of the homework problems, without LaTeX.
+
+Compiling the PDFs with LaTeX takes most of the time of converting a
+problem, which makes checking the layout and the wording of a problem slow
+while writing it. A draft renders the assignment and the solution of each
+problem to HTML instead. The Notebook goes through the same
+`~thermohw.preprocessors.HomeworkPreprocessor` as the PDFs, which removes
+the raw cells and the solution and substitutes the variables, and the
+Markdown cells are rendered by Pandoc with the alert divs shown as boxes
+like those in the PDFs. The Markdown cells are rendered in a single batch
+and cached by `~thermohw.prerender.MarkdownPrerenderer`, so a draft of a
+problem takes well under a second.
+
+The drafts are written to the ``output/draft`` folder of the homework, with
+the attachments of the problems next to them, and don't change the PDFs,
+the zip files, or the cache of converted problems. The PDFs are built by
+`~thermohw.convert_thermo_hw.process` when the homework is published.
+
+Functions
+---------
+get_draft_exporter:
+    Return the HTML exporter of the drafts, building it on the first call.
+
+convert_draft:
+    Write the drafts of the assignment and the solution of a problem.
+
+process_draft:
+    Write the drafts of the problems of a homework.
+
+"""
+
+# Standard Library
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
+from functools import lru_cache
+from pathlib import Path
+
+# Local imports
+from .cache import draft_template_file
+from .convert_thermo_hw import _read_problem, find_problems
+from .profiling import stage
+
+if TYPE_CHECKING:
+    from .exporters import HomeworkHTMLExporter  # noqa: F401 # typing only
+
+DRAFT_DIRECTORY_NAME = "draft"
+
+
+@lru_cache(maxsize=None)
+def get_draft_exporter() -> "HomeworkHTMLExporter":
+    """Return the HTML exporter of the drafts, building it on the first call."""
+    from traitlets.config import Config
+    from .exporters import HomeworkHTMLExporter
+    from .filters import convert_html_div
+    from .preprocessors import HomeworkPreprocessor
+    from .prerender import MarkdownPrerenderer
+
+    c = Config()
+    c.HTMLExporter.template_file = str(draft_template_file)
+    c.HTMLExporter.filters = {"convert_html_div": convert_html_div}
+    c.HomeworkPreprocessor.extract_attachments = True
+    c.MarkdownPrerenderer.to = "html"
+
+    return HomeworkHTMLExporter(
+        preprocessors=[HomeworkPreprocessor, MarkdownPrerenderer], config=c
+    )
+
+
+def convert_draft(
+    problem: Path, directory: Path, by_hand: bool = False, legacy: bool = False
+) -> Tuple[Path, Path]:
+    """Write the HTML drafts of the assignment and the solution of a problem.
+
+    Arguments
+    ---------
+    problem
+        A `~pathlib.Path` to the problem Notebook
+    directory
+        A `~pathlib.Path` to the folder to write the drafts and the
+        attachments to. The attachments are named for the draft they are in.
+    by_hand, legacy, optional
+        See `~thermohw.convert_thermo_hw.convert_problem`.
+
+    Returns
+    -------
+    tuple
+        The paths of the assignment and the solution drafts, named like the
+        Notebooks in the zip files with the ``.html`` extension.
+    """
+    from nbconvert.writers import FilesWriter
+
+    html_exp = get_draft_exporter()
+    writer = FilesWriter(build_directory=str(directory))
+    print("Drafting:", problem)
+    drafts = []
+    with stage("problem", problem=problem.stem):
+        problem_nb, res = _read_problem(problem, by_hand, legacy)
+        for variant, remove_solution, name in (
+            ("assignment", True, problem.stem),
+            ("solution", False, problem.stem + "-soln"),
+        ):
+            res["remove_solution"] = remove_solution
+            # The attachments of both drafts are written to the same folder,
+            # and removing the solution changes the indices of the cells in
+            # their names, so each draft names them with its own key
+            res["unique_key"] = name
+            with stage("export:html", variant=variant):
+                html, resources = html_exp.from_notebook_node(
+                    problem_nb, resources=res
+                )
+            with stage("write", variant=variant):
+                drafts.append(Path(writer.write(html, resources, notebook_name=name)))
+    return drafts[0], drafts[1]
+
+
+def process_draft(
+    hw_num: int,
+    problems_to_do: Optional[Iterable[int]] = None,
+    prefix: Optional[Path] = None,
+    by_hand: Optional[Iterable[int]] = None,
+    legacy: bool = False,
+) -> List[Path]:
+    """Write the HTML drafts of the homework problems in the ``prefix`` folder.
+
+    The drafts are written to the ``output/draft`` folder of the homework.
+    See `~thermohw.convert_thermo_hw.process` for the arguments.
+
+    Returns
+    -------
+    list
+        The paths of the drafts, with the assignment and then the solution
+        of each problem.
+    """
+    if prefix is None:
+        prefix = Path(".")
+
+    directory = (prefix / "output" / DRAFT_DIRECTORY_NAME).resolve()
+    directory.mkdir(parents=True, exist_ok=True)
+    by_hand_problems = set(by_hand) if by_hand is not None else set()
+    drafts: List[Path] = []
+    for problem in find_problems(hw_num, problems_to_do, prefix):
+        problem_by_hand = int(problem.stem.split("-")[-1]) in by_hand_problems
+        drafts.extend(convert_draft(problem, directory, problem_by_hand, legacy))
+    print("Wrote the drafts to", directory)
+    return drafts
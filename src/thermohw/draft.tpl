@@ -0,0 +1,41 @@
+{%- extends 'full.tpl' -%}
+{% from 'celltags.tpl' import celltags %}
+
+{%- block html_head -%}
+{{ super() }}
+<!-- The boxes match the tcolorboxes of the alert divs in homework.tpl -->
+<style type="text/css">
+.successbox, .primarybox, .secondarybox, .warningbox, .dangerbox, .infobox {
+    border: 1px solid;
+    border-radius: 4px;
+    margin: 1em 0;
+    padding: 0.5em 1em;
+}
+.successbox { background-color: #f2fff2; border-color: #00bf00; }
+.primarybox { background-color: #f2f2ff; border-color: #0000bf; }
+.secondarybox { background-color: #f9f9f9; border-color: #606060; }
+.warningbox { background-color: #fffff2; border-color: #bfbf00; }
+.dangerbox { background-color: #fff2f2; border-color: #bf0000; }
+.infobox { background-color: #f2f9f9; border-color: #006060; }
+</style>
+{%- endblock html_head -%}
+
+{#- Render markdown with Pandoc, as in the PDFs, and convert appropriate divs
+    to boxes. Use the HTML rendered by the MarkdownPrerenderer preprocessor,
+    if it is available. -#}
+{% block markdowncell scoped %}
+<div class="cell border-box-sizing text_cell rendered{{ celltags(cell) }}">
+{%- if resources.global_content_filter.include_input_prompt-%}
+    {{ self.empty_in_prompt() }}
+{%- endif -%}
+<div class="inner_cell">
+<div class="text_cell_render border-box-sizing rendered_html">
+{%- if cell.metadata.prerendered_html is defined %}
+{{ cell.metadata.prerendered_html }}
+{%- else %}
+{{ cell.source | strip_files_prefix | convert_pandoc('markdown-implicit_figures+tex_math_double_backslash', 'json') | convert_html_div('html') | convert_pandoc('json', 'html', ['--mathjax']) }}
+{%- endif %}
+</div>
+</div>
+</div>
+{%- endblock markdowncell %}
@@ -0,0 +1,597 @@
+"""Exporters for homework assignments.
+
+Classes
+-------
+StagedExporterMixin:
+    Record the time spent in each preprocessor with the
+    `~thermohw.profiling.profiler`, and apply the preprocessors separately
+    from exporting.
+
+HomeworkNotebookExporter:
+    Export a Notebook to a Notebook, recording the time of each stage.
+
+HomeworkHTMLExporter:
+    Export a Notebook to HTML, for quick drafts of the problems without LaTeX.
+
+HomeworkPDFExporter:
+    Export a Notebook to PDF via LaTeX, optionally compiling against a
+    precompiled format of the LaTeX preamble. LaTeX can also be run as an
+    asyncio subprocess, so that other work is done while it runs.
+
+"""
+
+# Standard Library
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Set, Tuple
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+import asyncio
+import copy
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+# Third-Party
+from nbconvert.exporters.pdf import (
+    LatexFailed,
+    PDFExporter,
+    prepend_to_env_search_path,
+)
+from nbconvert.exporters.html import HTMLExporter
+from nbconvert.exporters.notebook import NotebookExporter
+from traitlets import Bool, Instance, Unicode
+import jinja2
+import nbformat
+
+# Local imports
+from .cache import user_cache_directory
+from .outputs import SpillingFilesWriter
+from .profiling import stage
+
+if TYPE_CHECKING:
+    from nbformat import NotebookNode  # noqa: F401 # typing only
+
+begin_document = r"\begin{document}"
+
+
+@lru_cache(maxsize=None)
+def _relaxed_validator(version: int, version_minor: int) -> Any:
+    """Return the validator of Notebooks that allows additional properties.
+
+    `nbformat.validate` compiles a new validator from the schema every time it
+    is called with ``relax_add_props``, which takes longer than most of the
+    preprocessors, so the validator is only compiled once for each version.
+    """
+    from nbformat.validator import get_validator
+
+    return get_validator(version, version_minor, relax_add_props=True)
+
+
+def validate_relaxed(nb: "NotebookNode") -> None:
+    """Validate ``nb`` as ``nbformat.validate(nb, relax_add_props=True)`` does.
+
+    Raises `nbformat.ValidationError` if the Notebook is invalid.
+    """
+    version, version_minor = nbformat.validator.get_version(nb)
+    validator = _relaxed_validator(version, version_minor)
+    if (version, version_minor) >= (4, 5):
+        ids = [cell.get("id") for cell in nb["cells"]]
+        # nbformat repairs missing and duplicate cell IDs
+        repair_ids = None in ids or len(set(ids)) != len(ids)
+    else:
+        repair_ids = False
+    if validator is None or repair_ids:
+        nbformat.validate(nb, relax_add_props=True)
+        return
+    validator.validate(nb)
+
+
+class _StagedTemplate:
+    """Wrap a Jinja template to record the time spent rendering it."""
+
+    def __init__(self, template: Any) -> None:
+        self._template = template
+
+    def render(self, *args: Any, **kwargs: Any) -> str:
+        with stage("render"):
+            return self._template.render(*args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._template, name)
+
+
+class StagedExporterMixin:
+    """Record the time spent in each preprocessor.
+
+    Each preprocessor is recorded as a ``preprocess:<name>`` stage with the
+    `~thermohw.profiling.profiler`. The Notebook is validated after each
+    preprocessor with `validate_relaxed`, which reuses the validator instead
+    of compiling it again each time.
+
+    The preprocessors can also be applied once with `preprocess`, and the
+    result exported several times inside `skip_preprocessors`, for instance
+    with different values substituted in some cells.
+    """
+
+    # The types of the preprocessors to skip, or an empty tuple to skip all
+    _skipped: Optional[Tuple[type, ...]] = None
+
+    @contextmanager
+    def skip_preprocessors(self, *types: type) -> Iterator[None]:
+        """Skip the preprocessors that are instances of ``types`` in the body.
+
+        Without ``types``, every preprocessor is skipped, for Notebooks that
+        were already preprocessed by `preprocess`. The exporter must not be
+        used by other threads in the meantime.
+        """
+        previous = self._skipped
+        self._skipped = types
+        try:
+            yield
+        finally:
+            self._skipped = previous
+
+    def preprocess(
+        self, nb: "NotebookNode", resources: Optional[Dict[str, Any]] = None
+    ) -> Tuple["NotebookNode", Dict[str, Any]]:
+        """Apply the preprocessors to ``nb`` without exporting it."""
+        resources = self._init_resources(resources)  # type: ignore
+        if "language" in nb["metadata"]:
+            resources["language"] = nb["metadata"]["language"].lower()
+        return self._preprocess(nb, resources)
+
+    def _preprocess(
+        self, nb: "NotebookNode", resources: Dict[str, Any]
+    ) -> Tuple["NotebookNode", Dict[str, Any]]:
+        """Apply the preprocessors in turn, as in `nbconvert.exporters.Exporter`."""
+        skipped = self._skipped
+        if skipped == ():
+            # Nothing changes the Notebook or the resources, so they don't need
+            # to be copied
+            return nb, resources
+        nbc = copy.deepcopy(nb)
+        resc = copy.deepcopy(resources)
+
+        for preprocessor in self._preprocessors:  # type: ignore
+            # Disabled preprocessors don't change the Notebook, so it doesn't
+            # need to be validated again
+            if not getattr(preprocessor, "enabled", True):
+                continue
+            if skipped is not None and isinstance(preprocessor, skipped):
+                continue
+            name = getattr(preprocessor, "__name__", type(preprocessor).__name__)
+            with stage(f"preprocess:{name}"):
+                nbc, resc = preprocessor(nbc, resc)
+            try:
+                validate_relaxed(nbc)
+            except nbformat.ValidationError:
+                self.log.error(  # type: ignore
+                    "Notebook is invalid after preprocessor %s", preprocessor
+                )
+                raise
+
+        return nbc, resc
+
+
+class HomeworkNotebookExporter(StagedExporterMixin, NotebookExporter):  # type: ignore
+    """Export a Notebook to a Notebook, recording the time of each stage."""
+
+
+class HomeworkHTMLExporter(StagedExporterMixin, HTMLExporter):  # type: ignore
+    """Export a Notebook to HTML, recording the time of each stage.
+
+    The drafts of the problems are rendered with this exporter, so that the
+    assignment and the solution can be checked without running LaTeX. With
+    the draft template, the alert divs are shown as boxes like those in the
+    PDFs.
+    """
+
+
+class HomeworkPDFExporter(StagedExporterMixin, PDFExporter):  # type: ignore
+    """Export a Notebook to PDF via LaTeX.
+
+    The LaTeX preamble is the same for every problem, but xelatex reads and
+    processes it again for every PDF. When ``precompile_preamble`` is set,
+    the preamble is dumped to a format file with the ``mylatexformat``
+    package the first time it is seen, and every PDF after that is compiled
+    against the format file. The format files are stored in
+    ``format_directory`` under a hash of the preamble and the LaTeX version,
+    so a new format is built whenever the template changes.
+
+    If the format can't be built or used, for instance because the
+    ``mylatexformat`` package is not installed, the PDF is compiled from the
+    full LaTeX source as usual.
+
+    The PDFs of several problems may be compiled from threads at the same
+    time, so each format is built by one thread while the others wait for
+    it, and is written to the format folder with a unique temporary name
+    before it is moved in place.
+
+    The files extracted from the Notebook are written to the LaTeX build
+    folder by a `~thermohw.outputs.SpillingFilesWriter`, which links the files
+    that were stored on disk instead of reading them into memory.
+
+    The export can also be split in two: `latex_from_notebook_node`
+    preprocesses the Notebook and renders the LaTeX source, and
+    `pdf_from_latex_async` compiles it in a new folder with LaTeX and BibTeX
+    run as asyncio subprocesses, so that the next Notebook can be prepared
+    while LaTeX runs. Several PDFs can be compiled at the same time this way.
+
+    The time spent in each preprocessor, rendering the template, and running
+    LaTeX and BibTeX is recorded with the `~thermohw.profiling.profiler`.
+
+    Compiling the template and the nbconvert templates it extends takes a
+    noticeable part of a short run, so when ``template_cache`` is set, the
+    compiled templates are stored in ``template_cache_directory`` with a
+    Jinja bytecode cache. Jinja checks the hash of the source of each
+    template when it is loaded, so a template is compiled again when it
+    changes.
+    """
+
+    writer = Instance(
+        "thermohw.outputs.SpillingFilesWriter",
+        args=(),
+        kw={"build_directory": "."},
+    )
+
+    precompile_preamble = Bool(
+        False, help="Compile the PDFs against a precompiled format of the preamble."
+    ).tag(config=True)
+
+    format_directory = Unicode(
+        "",
+        help=(
+            "Directory to store the precompiled formats of the preamble. Defaults "
+            "to the latex-formats folder in the user cache directory."
+        ),
+    ).tag(config=True)
+
+    template_cache = Bool(
+        True,
+        help="Cache the compiled Jinja templates on disk.",
+    ).tag(config=True, affects_environment=True)
+
+    template_cache_directory = Unicode(
+        "",
+        help=(
+            "Directory to store the compiled templates in. Defaults to the "
+            "jinja-bytecode folder in the user cache directory."
+        ),
+    ).tag(config=True, affects_environment=True)
+
+    def __init__(self, **kw: Any) -> None:
+        super().__init__(**kw)
+        self._latex_version: Optional[str] = None
+        self._failed_formats: Set[str] = set()
+        self._format_locks: Dict[str, threading.Lock] = {}
+        self._formats_lock = threading.Lock()
+
+    @property
+    def template(self) -> Any:
+        """The Jinja template, recording the time spent rendering it."""
+        return _StagedTemplate(super().template)
+
+    def _create_environment(self) -> Any:
+        """Create the Jinja environment, with a bytecode cache if enabled."""
+        environment = super()._create_environment()
+        if not self.template_cache:
+            return environment
+        directory = Path(
+            self.template_cache_directory or user_cache_directory() / "jinja-bytecode"
+        )
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            self.log.warning("The compiled templates can't be cached: %s", e)
+            return environment
+        # The bytecode depends on the version of Jinja and on the syntax of
+        # the templates, which is set by the exporter
+        pattern = f"{type(self).__name__}-{jinja2.__version__}-%s.cache"
+        environment.bytecode_cache = jinja2.FileSystemBytecodeCache(
+            str(directory), pattern
+        )
+        return environment
+
+    def _get_format_directory(self) -> Path:
+        if self.format_directory:
+            return Path(self.format_directory)
+        return user_cache_directory() / "latex-formats"
+
+    def _get_latex_version(self) -> str:
+        if self._latex_version is None:
+            try:
+                version = subprocess.run(
+                    [self.latex_command[0], "--version"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    stdin=subprocess.DEVNULL,
+                    check=False,
+                ).stdout
+            except OSError:
+                version = b""
+            self._latex_version = version.decode("utf-8", "replace").split("\n")[0]
+        return self._latex_version
+
+    def format_file(self, latex: str) -> Optional[Path]:
+        """Return the precompiled format for the preamble of ``latex``.
+
+        The format is built if it does not exist yet. If the format can't be
+        built, `None` is returned.
+
+        Arguments
+        ---------
+        latex
+            The full LaTeX source of the document
+        """
+        preamble, found, _ = latex.partition(begin_document)
+        if not found:
+            return None
+
+        digest = hashlib.sha256()
+        digest.update(self._get_latex_version().encode("utf-8"))
+        digest.update(preamble.encode("utf-8"))
+        name = f"preamble-{digest.hexdigest()[:16]}"
+        with self._formats_lock:
+            lock = self._format_locks.setdefault(name, threading.Lock())
+        with lock:
+            return self._build_format(name, preamble)
+
+    def _format_failed(self, name: str) -> None:
+        with self._formats_lock:
+            self._failed_formats.add(name)
+
+    def _build_format(self, name: str, preamble: str) -> Optional[Path]:
+        with self._formats_lock:
+            if name in self._failed_formats:
+                return None
+
+        format_directory = self._get_format_directory()
+        fmt = format_directory / f"{name}.fmt"
+        if fmt.is_file():
+            return fmt
+
+        self.log.info("Building the precompiled preamble %s", fmt)
+        format_directory.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory() as td:
+            build_directory = Path(td)
+            tex_file = build_directory / f"{name}.tex"
+            tex_file.write_text(
+                preamble + begin_document + "\n\\end{document}\n", encoding="utf-8"
+            )
+            latex_program = self.latex_command[0]
+            command = [
+                latex_program,
+                "-ini",
+                "-interaction=nonstopmode",
+                f"-jobname={name}",
+                f"&{latex_program}",
+                "mylatexformat.ltx",
+                tex_file.name,
+            ]
+            env = os.environ.copy()
+            if self.texinputs:
+                texinputs = env.get("TEXINPUTS", "")
+                env["TEXINPUTS"] = self.texinputs + os.pathsep + texinputs
+            try:
+                result = subprocess.run(
+                    command,
+                    cwd=td,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    stdin=subprocess.DEVNULL,
+                    env=env,
+                    check=False,
+                )
+            except OSError as e:
+                self.log.warning("Could not build the precompiled preamble: %s", e)
+                self._format_failed(name)
+                return None
+
+            built = build_directory / fmt.name
+            if result.returncode or not built.is_file():
+                self.log.warning(
+                    "Could not build the precompiled preamble, compiling the full "
+                    "document instead:\n%s",
+                    result.stdout.decode("utf-8", "replace"),
+                )
+                self._format_failed(name)
+                return None
+
+            # Replace atomically, in case another process built the same format
+            fd, staging = tempfile.mkstemp(
+                prefix=f".{name}-", suffix=".fmt", dir=format_directory
+            )
+            try:
+                with os.fdopen(fd, "wb") as f, open(built, "rb") as b:
+                    shutil.copyfileobj(b, f)
+                os.replace(staging, fmt)
+            except OSError:
+                os.unlink(staging)
+                raise
+
+        return fmt
+
+    def run_latex(self, filename: str, raise_on_failure: type = LatexFailed) -> bool:
+        """Run xelatex ``latex_count`` times, using the precompiled preamble if set.
+
+        This is run by `~nbconvert.exporters.pdf.PDFExporter.from_notebook_node`
+        in the temporary directory with the LaTeX file ``filename``.
+        """
+        with stage("latex"):
+            return self._run_latex(filename, raise_on_failure)
+
+    def _run_latex(self, filename: str, raise_on_failure: type) -> bool:
+        if not self.precompile_preamble:
+            return super().run_latex(filename, raise_on_failure)
+
+        latex = Path(filename).read_text(encoding="utf-8")
+        fmt = self.format_file(latex)
+        if fmt is None:
+            return super().run_latex(filename, raise_on_failure)
+
+        # LaTeX looks for the format in the current directory first
+        shutil.copyfile(fmt, fmt.name)
+        command: List[str] = [self.latex_command[0], f"-fmt={fmt.stem}"]
+        command.extend(self.latex_command[1:])
+
+        def log_error(command: List[str], out: str) -> None:
+            self.log.warning(
+                "%s failed with the precompiled preamble, compiling the full "
+                "document instead: %s\n%s",
+                command[0],
+                command,
+                out,
+            )
+
+        if self.run_command(command, filename, self.latex_count, log_error):
+            return True
+        self._format_failed(fmt.stem)
+        return super().run_latex(filename, raise_on_failure)
+
+    def run_bib(self, filename: str, raise_on_failure: bool = False) -> bool:
+        """Run bibtex once, recording the time it takes."""
+        with stage("bibtex"):
+            return super().run_bib(filename, raise_on_failure)
+
+    def latex_from_notebook_node(
+        self, nb: "NotebookNode", resources: Optional[Dict[str, Any]] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Preprocess ``nb`` and render the LaTeX source of the PDF.
+
+        The LaTeX is compiled to the PDF by `pdf_from_latex_async`.
+        """
+        return super(PDFExporter, self).from_notebook_node(  # type: ignore
+            nb, resources=resources
+        )
+
+    async def pdf_from_latex_async(
+        self, latex: str, resources: Dict[str, Any]
+    ) -> Tuple[bytes, Dict[str, Any]]:
+        """Compile ``latex`` to a PDF, running LaTeX as asyncio subprocesses.
+
+        The PDF is built in a new temporary folder, instead of changing the
+        working directory of the process, so several PDFs can be built at the
+        same time. The LaTeX is compiled in the same way as by
+        `~nbconvert.exporters.pdf.PDFExporter.from_notebook_node`.
+
+        Arguments
+        ---------
+        latex
+            The LaTeX source from `latex_from_notebook_node`
+        resources
+            The resources from `latex_from_notebook_node`, with the files to
+            write to the build folder
+        """
+        texinputs = resources.get("metadata", {}).get("path") or os.getcwd()
+        env = os.environ.copy()
+        for variable in ("TEXINPUTS", "BIBINPUTS", "BSTINPUTS"):
+            prepend_to_env_search_path(variable, texinputs, env)
+
+        with tempfile.TemporaryDirectory() as build_directory:
+            notebook_name = "notebook"
+            resources["output_extension"] = ".tex"
+            writer = SpillingFilesWriter(build_directory=build_directory)
+            tex_file = os.path.basename(
+                writer.write(latex, resources, notebook_name=notebook_name)
+            )
+            self.log.info("Building PDF")
+            with stage("latex"):
+                await self._run_latex_async(latex, tex_file, build_directory, env)
+            with stage("bibtex"):
+                bib_ok, out = await self._run_command_async(
+                    self.bib_command,
+                    os.path.splitext(tex_file)[0],
+                    1,
+                    build_directory,
+                    env,
+                )
+            if bib_ok:
+                with stage("latex"):
+                    await self._run_latex_async(latex, tex_file, build_directory, env)
+            else:
+                self.log.debug("%s output:\n%s", self.bib_command[0], out)
+
+            pdf_file = Path(build_directory) / f"{notebook_name}.pdf"
+            if not pdf_file.is_file():
+                raise LatexFailed(f"{self.latex_command[0]} did not create a PDF")
+            pdf_data = pdf_file.read_bytes()
+
+        resources["output_extension"] = ".pdf"
+        resources.pop("outputs", None)
+        return pdf_data, resources
+
+    async def _run_latex_async(
+        self, latex: str, tex_file: str, build_directory: str, env: Dict[str, str]
+    ) -> None:
+        if self.precompile_preamble:
+            # Building the format for the first time takes a while
+            loop = asyncio.get_event_loop()
+            fmt = await loop.run_in_executor(None, self.format_file, latex)
+            if fmt is not None:
+                shutil.copyfile(fmt, Path(build_directory) / fmt.name)
+                command: List[str] = [self.latex_command[0], f"-fmt={fmt.stem}"]
+                command.extend(self.latex_command[1:])
+                success, out = await self._run_command_async(
+                    command, tex_file, self.latex_count, build_directory, env
+                )
+                if success:
+                    return
+                self.log.warning(
+                    "%s failed with the precompiled preamble, compiling the full "
+                    "document instead:\n%s",
+                    command[0],
+                    out,
+                )
+                self._format_failed(fmt.stem)
+
+        success, out = await self._run_command_async(
+            self.latex_command, tex_file, self.latex_count, build_directory, env
+        )
+        if not success:
+            self.log.critical("%s failed:\n%s", self.latex_command[0], out)
+            raise LatexFailed(
+                f'Failed to run "{self.latex_command[0]}" command:\n{out}'
+            )
+
+    async def _run_command_async(
+        self,
+        command_list: List[str],
+        filename: str,
+        count: int,
+        build_directory: str,
+        env: Dict[str, str],
+    ) -> Tuple[bool, str]:
+        """Run ``command_list`` ``count`` times and return its success and output.
+
+        The output is written to a file instead of a pipe, so that the
+        command is never blocked while the event loop is busy.
+        """
+        command = [c.format(filename=filename) for c in command_list]
+        if shutil.which(command[0]) is None:
+            raise OSError(
+                f"{command[0]} not found on PATH, if you have not installed "
+                f"{command[0]} you may need to do so."
+            )
+        self.log.info("Running %s %i times: %s", command[0], count, command)
+        output_file = Path(build_directory) / f".{os.path.basename(command[0])}.out"
+        for _ in range(count):
+            with open(output_file, "wb") as output:
+                process = await asyncio.create_subprocess_exec(
+                    *command,
+                    cwd=build_directory,
+                    stdin=subprocess.DEVNULL,
+                    stdout=None if self.verbose else output,
+                    stderr=subprocess.STDOUT,
+                    env=env,
+                )
+                try:
+                    returncode = await process.wait()
+                except asyncio.CancelledError:
+                    process.kill()
+                    raise
+            if returncode:
+                return False, output_file.read_text(encoding="utf-8", errors="replace")
+        return True, ""
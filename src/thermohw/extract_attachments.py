@@ -1,6 +1,8 @@
 """A preprocessor that extracts all of the attachments from the notebook file.
 
 The extracted attachments are returned in the 'resources' dictionary.
+Attachments with the same content are only extracted once, and the extracted
+attachments can be stored on disk instead of in memory.
 
 Based on the ExtractOutputsProcessor in nbconvert... the license for
 nbconvert is
@@ -68,14 +70,18 @@ to indicate the copyright and license terms:
 """
 
 from binascii import a2b_base64
+from collections import OrderedDict
+import hashlib
 import sys
 import os
 import re
-from typing import Tuple, TYPE_CHECKING
+from typing import Any, Dict, Mapping, MutableMapping, Tuple, TYPE_CHECKING
 
-from traitlets import Unicode, Set
+from traitlets import Bool, Int, Unicode, Set
 from nbconvert.preprocessors.base import Preprocessor
 
+from .outputs import DiskOutputs
+
 if TYPE_CHECKING:
     from nbformat import NotebookNode  # noqa: F401 # only imported for type checking
 
@@ -85,6 +91,18 @@ class ExtractAttachmentsPreprocessor(Preprocessor):  # type: ignore # no types a
     Extracts all of the outputs from the notebook file.
 
     The extracted outputs are returned in the 'resources' dictionary.
+
+    Attachments are identified by a hash of their content. When the same
+    attachment appears in several cells, it is stored once under the filename
+    of its first appearance and every cell links to that file. The decoded
+    content is kept in memory for up to ``decoded_cache_size`` bytes, so that
+    an attachment that appears in both variants of a problem, or in several
+    problems, is only decoded once.
+
+    When ``spill_to_disk`` is set, ``resources["outputs"]`` is replaced by a
+    `~thermohw.outputs.DiskOutputs` mapping, so that the extracted files are
+    written to a temporary folder in ``spill_directory`` as they are
+    extracted, instead of being kept in memory.
     """
 
     output_filename_template = Unicode("{unique_key}_{cell_index}_{name}").tag(
@@ -95,6 +113,57 @@ class ExtractAttachmentsPreprocessor(Preprocessor):  # type: ignore # no types a
         {"image/png", "image/jpeg", "image/svg+xml", "application/pdf"}
     ).tag(config=True)
 
+    decoded_cache_size = Int(
+        64 * 2 ** 20,
+        help="Maximum number of bytes of decoded attachments to keep in memory.",
+    ).tag(config=True)
+
+    spill_to_disk = Bool(
+        False, help="Store the extracted files on disk instead of in memory."
+    ).tag(config=True)
+
+    spill_directory = Unicode(
+        "",
+        help=(
+            "Directory to store the extracted files in when spill_to_disk is set. "
+            "Defaults to the system temporary directory."
+        ),
+    ).tag(config=True)
+
+    def __init__(self, **kw: Any) -> None:
+        super().__init__(**kw)
+        self._decoded: "OrderedDict[str, bytes]" = OrderedDict()
+        self._decoded_size = 0
+
+    def decode(self, mime: str, data: str) -> Tuple[str, bytes]:
+        """Return the content hash and the decoded bytes of an attachment.
+
+        The decoded bytes are shared between all of the attachments with the
+        same content.
+        """
+        digest = hashlib.sha256(f"{mime}\n{data}".encode("UTF-8")).hexdigest()
+        decoded = self._decoded.get(digest)
+        if decoded is not None:
+            self._decoded.move_to_end(digest)
+            return digest, decoded
+
+        # Binary files are base64-encoded, SVG is already XML
+        if mime in {"image/png", "image/jpeg", "application/pdf"}:
+            # data is b64-encoded as text (str, unicode),
+            # we want the original bytes
+            decoded = a2b_base64(data)
+        elif sys.platform == "win32":
+            decoded = data.replace("\n", "\r\n").encode("UTF-8")
+        else:
+            decoded = data.encode("UTF-8")
+
+        self._decoded[digest] = decoded
+        self._decoded_size += len(decoded)
+        while self._decoded_size > self.decoded_cache_size and self._decoded:
+            _, evicted = self._decoded.popitem(last=False)
+            self._decoded_size -= len(evicted)
+        return digest, decoded
+
     def preprocess_cell(
         self, cell: "NotebookNode", resources: dict, cell_index: int
     ) -> Tuple["NotebookNode", dict]:
@@ -115,9 +184,18 @@ class ExtractAttachmentsPreprocessor(Preprocessor):  # type: ignore # no types a
         output_files_dir = resources.get("output_files_dir", None)
 
         # Make sure outputs key exists
-        if not isinstance(resources["outputs"], dict):
+        outputs = resources.get("outputs")
+        if self.spill_to_disk and not isinstance(outputs, DiskOutputs):
+            spilled = DiskOutputs(self.spill_directory or None)
+            if isinstance(outputs, Mapping):
+                spilled.update(outputs)
+            resources["outputs"] = spilled
+        elif not isinstance(outputs, MutableMapping):
             resources["outputs"] = {}
 
+        # The filename of each unique attachment in this notebook
+        filenames: Dict[str, str] = resources.setdefault("attachment_filenames", {})
+
         # Loop through all of the attachments in the cell
         for name, attach in cell.get("attachments", {}).items():
             orig_name = name
@@ -126,31 +204,28 @@ class ExtractAttachmentsPreprocessor(Preprocessor):  # type: ignore # no types a
                 if mime not in self.extract_output_types:
                     continue
 
-                # Binary files are base64-encoded, SVG is already XML
-                if mime in {"image/png", "image/jpeg", "application/pdf"}:
-                    # data is b64-encoded as text (str, unicode),
-                    # we want the original bytes
-                    data = a2b_base64(data)
-                elif sys.platform == "win32":
-                    data = data.replace("\n", "\r\n").encode("UTF-8")
+                digest, data = self.decode(mime, data)
+
+                if digest in filenames:
+                    filename = filenames[digest]
                 else:
-                    data = data.encode("UTF-8")
+                    filename = self.output_filename_template.format(
+                        cell_index=cell_index,
+                        name=name,
+                        unique_key=resources.get("unique_key", ""),
+                    )
 
-                filename = self.output_filename_template.format(
-                    cell_index=cell_index,
-                    name=name,
-                    unique_key=resources.get("unique_key", ""),
-                )
+                    if output_files_dir is not None:
+                        filename = os.path.join(output_files_dir, filename)
 
-                if output_files_dir is not None:
-                    filename = os.path.join(output_files_dir, filename)
+                    if name.endswith(".gif") and mime == "image/png":
+                        filename = filename.replace(".gif", ".png")
 
-                if name.endswith(".gif") and mime == "image/png":
-                    filename = filename.replace(".gif", ".png")
+                    filenames[digest] = filename
 
-                # In the resources, make the figure available via
-                #   resources['outputs']['filename'] = data
-                resources["outputs"][filename] = data
+                    # In the resources, make the figure available via
+                    #   resources['outputs']['filename'] = data
+                    resources["outputs"][filename] = data
 
                 # now we need to change the cell source so that it links to the
                 # filename instead of `attachment:`
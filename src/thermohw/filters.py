@@ -3,12 +3,23 @@
 This module uses the JSON output format from Pandoc to look for ``Div``
 elements (which are the Pandoc AST representation of ``div`` elements)
 and convert them to a LaTeX environment with the appropriate name.
+
+The filters can be applied one at a time with `convert_div` and
+`convert_raw_html`, but each of those parses and serializes the whole
+document. `apply_filters` and `convert_filters` apply several filters in a
+single walk over the document, parsing and serializing it only once.
+
+`convert_html_div` converts the same divs to ``div`` elements with the names
+of the LaTeX environments as classes, for the HTML drafts of the problems.
 """
 
 from enum import Enum, auto
-from typing import Any, Optional
+import json
+from typing import Any, Callable, Iterable, List, Optional
+
+from pandocfilters import applyJSONFilters, walk, Div, RawBlock, RawInline
 
-from pandocfilters import applyJSONFilters, RawBlock, RawInline
+FilterAction = Callable[[str, Any, str, Any], Any]
 
 
 # Allowed alert types are all from the Bootstrap alert types
@@ -59,6 +70,44 @@ def convert_div(text: str, format: Optional[str] = None) -> "applyJSONFilters":
     return applyJSONFilters([div_filter], text, format=format)
 
 
+def html_div_filter(key: str, value: list, format: str, meta: Any) -> Optional[list]:
+    """Filter the JSON ``value`` for alert divs to convert to HTML boxes.
+
+    The HTML equivalent of `div_filter`: the classes of the div are replaced
+    by the name of the LaTeX environment, such as ``successbox``, which the
+    draft template styles like the boxes in the PDFs.
+
+    Arguments
+    ---------
+    key
+        Key of the structure
+    value
+        Values in the structure
+    format
+        Output format of the processing
+    meta
+        Meta information
+    """
+    if key != "Div" or format != "html":
+        return None
+
+    [[identifier, classes, attributes], contents] = value
+    try:
+        alert_type = [name.split("-")[1] for name in classes if "-" in name][0]
+    except IndexError:
+        return None
+
+    if alert_type not in ALLOWED_ALERT_TYPES.__members__:
+        return None
+
+    return [Div([identifier, [f"{alert_type}box"], attributes], contents)]
+
+
+def convert_html_div(text: str, format: Optional[str] = None) -> "applyJSONFilters":
+    """Apply the `html_div_filter` action to the text."""
+    return applyJSONFilters([html_div_filter], text, format=format)
+
+
 def raw_html_filter(key: str, value: list, format: str, meta: Any) -> Optional[list]:
     """Filter the JSON ``value`` for raw html to convert to LaTeX.
 
@@ -92,3 +141,82 @@ def raw_html_filter(key: str, value: list, format: str, meta: Any) -> Optional[l
 def convert_raw_html(text: str, format: Optional[str] = None) -> "applyJSONFilters":
     """Apply the `raw_html_filter` action to the text."""
     return applyJSONFilters([raw_html_filter], text, format=format)
+
+
+registered_filters: List[FilterAction] = [div_filter, raw_html_filter]
+
+
+def register_filter(action: FilterAction) -> FilterAction:
+    """Add ``action`` to the filters applied by `convert_filters`.
+
+    The filters are applied in the order they are registered. This function
+    returns ``action``, so it can be used as a decorator.
+    """
+    if action not in registered_filters:
+        registered_filters.append(action)
+    return action
+
+
+def combine_filters(actions: Iterable[FilterAction]) -> FilterAction:
+    """Combine the filter ``actions`` into a single action.
+
+    At each element, the actions are applied in order, and each action is
+    applied to every element returned by the previous actions. Walking the
+    document with the combined action gives the same result as walking it
+    with each action in turn.
+    """
+    actions = list(actions)
+
+    def combined(key: str, value: Any, format: str, meta: Any) -> Any:
+        # Most elements are not changed by any action, so only build the
+        # list of replacement elements once an action returns something.
+        items: Optional[List[Any]] = None
+        for action in actions:
+            if items is None:
+                result = action(key, value, format, meta)
+                if result is not None:
+                    items = result if isinstance(result, list) else [result]
+                continue
+            new_items = []
+            for item in items:
+                result = action(item["t"], item.get("c"), format, meta)
+                if result is None:
+                    new_items.append(item)
+                elif isinstance(result, list):
+                    new_items.extend(result)
+                else:
+                    new_items.append(result)
+            items = new_items
+        return items
+
+    return combined
+
+
+def apply_filters(
+    text: str, actions: Iterable[FilterAction], format: Optional[str] = None
+) -> str:
+    """Apply the filter ``actions`` to the Pandoc JSON ``text`` in a single walk.
+
+    Arguments
+    ---------
+    text
+        The document, in the Pandoc JSON format
+    actions
+        The filter actions to apply, in order
+    format
+        Output format of the processing
+    """
+    doc = json.loads(text)
+    if "meta" in doc:
+        meta = doc["meta"]
+    elif doc[0]:  # old API
+        meta = doc[0]["unMeta"]
+    else:
+        meta = {}
+    altered = walk(doc, combine_filters(actions), format, meta)
+    return json.dumps(altered)
+
+
+def convert_filters(text: str, format: Optional[str] = None) -> str:
+    """Apply all of the `registered_filters` to the text in a single walk."""
+    return apply_filters(text, registered_filters, format=format)
@@ -36,7 +36,12 @@
 ((* endblock commands *))
 
 % Render markdown but remove figure environment and convert
-% appropriate divs to boxes
+% appropriate divs to boxes. Use the LaTeX rendered by the
+% MarkdownPrerenderer preprocessor, if it is available.
 ((* block markdowncell scoped *))
-    ((( cell.source | citation2latex | strip_files_prefix | convert_pandoc('markdown-implicit_figures+tex_math_double_backslash', 'json') | convert_div('latex') | convert_raw_html('latex') | resolve_references | convert_pandoc('json', 'latex'))))
+((* if cell.metadata.prerendered_latex is defined *))
+    ((( cell.metadata.prerendered_latex )))
+((* else *))
+    ((( cell.source | citation2latex | strip_files_prefix | convert_pandoc('markdown-implicit_figures+tex_math_double_backslash', 'json') | convert_filters('latex') | resolve_references | convert_pandoc('json', 'latex'))))
+((* endif *))
 ((* endblock markdowncell *))
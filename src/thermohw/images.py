@@ -0,0 +1,216 @@
+"""Downsample and recompress the images extracted from a Notebook.
+
+Screenshots and photos pasted into a Notebook are usually much larger than
+they appear on the page. LaTeX has to read every byte of each image, and the
+images are copied into the PDF as they are, so large images make the
+conversion slow and the PDFs large. The preprocessor in this module resizes
+each PNG and JPEG image to the resolution it needs at the size it is shown in
+the PDF, and recompresses it. The optimized images are cached on disk by a
+hash of their content and the settings, so each image is only optimized once.
+
+This requires the optional `Pillow <https://python-pillow.org>`__ package.
+
+Classes
+-------
+ImageOptimizer:
+    Preprocess the Notebook to optimize the images in the resources.
+
+"""
+
+# Standard Library
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+import hashlib
+import json
+import os
+
+# Third-Party
+from nbconvert.preprocessors import Preprocessor
+from traitlets import Float, Int, Unicode
+
+# Local imports
+from .cache import user_cache_directory
+
+if TYPE_CHECKING:
+    from nbformat import NotebookNode  # noqa: F401 # typing only
+
+IMAGE_FORMATS = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG"}
+
+# LaTeX uses this resolution for images that don't specify one
+DEFAULT_DPI = 72.0
+
+
+class ImageOptimizer(Preprocessor):  # type: ignore
+    """Resize and recompress the PNG and JPEG images in the resources.
+
+    This preprocessor must run after the
+    `~thermohw.extract_attachments.ExtractAttachmentsPreprocessor`. Each image
+    is shown at its natural size, limited to ``max_width`` by ``max_height``
+    inches by the template. Images with more than ``dpi`` pixels per inch at
+    that size are resized, and the resolution stored in the image is set so
+    that the image is shown at the same size as before. The optimized image
+    is only used if it is smaller than the original.
+
+    The preprocessor is disabled by default. If Pillow is not installed, a
+    warning is logged and the images are not changed.
+    """
+
+    dpi = Int(150, help="Resolution of the images in the PDF.").tag(config=True)
+
+    max_width = Float(
+        5.85, help="Maximum width of an image on the page, in inches."
+    ).tag(config=True)
+
+    max_height = Float(
+        9.9, help="Maximum height of an image on the page, in inches."
+    ).tag(config=True)
+
+    jpeg_quality = Int(85, help="Quality of the recompressed JPEG images.").tag(
+        config=True
+    )
+
+    memory_cache_size = Int(
+        64 * 2 ** 20,
+        help="Maximum number of bytes of optimized images to keep in memory.",
+    ).tag(config=True)
+
+    cache_directory = Unicode(
+        "",
+        help=(
+            "Directory to store the optimized images. Defaults to the images "
+            "folder in the user cache directory."
+        ),
+    ).tag(config=True)
+
+    def __init__(self, **kw: Any) -> None:
+        super().__init__(**kw)
+        self._optimized: "OrderedDict[str, bytes]" = OrderedDict()
+        self._optimized_size = 0
+        self._warned = False
+
+    def _get_cache_directory(self) -> Path:
+        if self.cache_directory:
+            return Path(self.cache_directory)
+        return user_cache_directory() / "images"
+
+    def _settings(self) -> Dict[str, Any]:
+        import PIL
+
+        return {
+            "dpi": self.dpi,
+            "max_width": self.max_width,
+            "max_height": self.max_height,
+            "jpeg_quality": self.jpeg_quality,
+            "pillow": PIL.__version__,
+        }
+
+    def optimize(self, data: bytes, image_format: str) -> bytes:
+        """Return the optimized image, or ``data`` if it can't be made smaller.
+
+        The result is cached on disk by a hash of ``data`` and the settings,
+        and the most recently used results are kept in memory, up to
+        ``memory_cache_size`` bytes.
+
+        Arguments
+        ---------
+        data
+            The content of the image file
+        image_format
+            The format of the image, either ``"PNG"`` or ``"JPEG"``
+        """
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps(self._settings(), sort_keys=True).encode("utf-8"))
+        key = digest.hexdigest()
+        if key in self._optimized:
+            self._optimized.move_to_end(key)
+            return self._optimized[key]
+
+        # An empty file in the cache means that the image can't be optimized
+        cache_file = self._get_cache_directory() / key
+        try:
+            optimized = cache_file.read_bytes()
+        except OSError:
+            optimized = self._optimize(data, image_format) or b""
+            if len(optimized) >= len(data):
+                optimized = b""
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            staging = cache_file.with_name(f".{key}.{os.getpid()}.tmp")
+            staging.write_bytes(optimized)
+            os.replace(staging, cache_file)
+
+        if not optimized:
+            optimized = data
+        self._optimized[key] = optimized
+        self._optimized_size += len(optimized)
+        while self._optimized_size > self.memory_cache_size and self._optimized:
+            _, evicted = self._optimized.popitem(last=False)
+            self._optimized_size -= len(evicted)
+        return optimized
+
+    def _optimize(self, data: bytes, image_format: str) -> Optional[bytes]:
+        from PIL import Image
+
+        try:
+            image = Image.open(BytesIO(data))
+            image.load()
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            self.log.warning("Could not read an image to optimize it: %s", e)
+            return None
+
+        width, height = image.size
+        dpi_x, dpi_y = image.info.get("dpi", (DEFAULT_DPI, DEFAULT_DPI))
+        dpi_x = float(dpi_x) or DEFAULT_DPI
+        dpi_y = float(dpi_y) or DEFAULT_DPI
+
+        # The size the image is shown at, in inches
+        shown_width = width / dpi_x
+        shown_height = height / dpi_y
+        scale = min(1.0, self.max_width / shown_width, self.max_height / shown_height)
+        shown_width *= scale
+        shown_height *= scale
+
+        new_width = max(1, round(shown_width * self.dpi))
+        new_height = max(1, round(shown_height * self.dpi))
+        if new_width < width and new_height < height:
+            image = image.resize((new_width, new_height), Image.LANCZOS)
+            dpi: Tuple[float, float] = (
+                new_width / shown_width,
+                new_height / shown_height,
+            )
+        else:
+            dpi = (dpi_x, dpi_y)
+
+        options: Dict[str, Any] = {"optimize": True, "dpi": dpi}
+        if image_format == "JPEG":
+            options["quality"] = self.jpeg_quality
+            if image.mode not in {"RGB", "L", "CMYK"}:
+                image = image.convert("RGB")
+
+        output = BytesIO()
+        try:
+            image.save(output, image_format, **options)
+        except OSError as e:
+            self.log.warning("Could not save an optimized image: %s", e)
+            return None
+        return output.getvalue()
+
+    def preprocess(
+        self, nb: "NotebookNode", resources: Dict[str, Any]
+    ) -> Tuple["NotebookNode", Dict[str, Any]]:
+        """Optimize the images in ``resources["outputs"]``."""
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            if not self._warned:
+                self.log.warning("Pillow is not installed, images are not optimized.")
+                self._warned = True
+            return nb, resources
+
+        outputs = resources.get("outputs", {})
+        for filename in list(outputs):
+            image_format = IMAGE_FORMATS.get(os.path.splitext(filename)[1].lower())
+            if image_format is not None:
+                outputs[filename] = self.optimize(outputs[filename], image_format)
+        return nb, resources
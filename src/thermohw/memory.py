@@ -0,0 +1,122 @@
+"""Measure and limit the memory used by the homework conversion.
+
+The memory used by a conversion depends on the size of the Notebooks and
+their attachments, and on how many problems are converted at once. Under a
+container memory limit, converting a large homework can be killed for using
+too much memory. A `MemoryBudget` is used to decide when to hold back the
+next problem until the problems in progress are done, and sets the sizes of
+the caches kept in memory.
+
+The resident set size (RSS) is read from ``/proc`` on Linux and from
+`resource.getrusage` elsewhere. On platforms where neither is available, the
+memory is reported as unknown and the budget is never exceeded.
+
+Classes
+-------
+MemoryBudget:
+    A limit on the memory used by the conversion.
+
+Functions
+---------
+parse_size:
+    Parse a size such as ``512M`` or ``2G`` to a number of bytes.
+
+current_rss:
+    Return the resident set size of this process.
+
+peak_rss:
+    Return the peak resident set size of this process.
+
+"""
+
+# Standard Library
+from typing import Iterable, Optional
+import gc
+import os
+import re
+import sys
+
+try:
+    import resource
+except ImportError:  # pragma: no cover # Windows
+    resource = None  # type: ignore
+
+SIZE_UNITS = {"": 1, "K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30, "T": 2 ** 40}
+
+
+def parse_size(value: str) -> int:
+    """Parse a size such as ``512M``, ``2G``, or ``1.5GiB`` to a number of bytes.
+
+    A number without a unit is a number of bytes. The units are powers of
+    1024.
+    """
+    match = re.fullmatch(
+        r"\s*(\d+(?:\.\d*)?)\s*([KMGT]?)(?:i?B)?\s*", value, re.IGNORECASE
+    )
+    if match is None:
+        raise ValueError(f"Invalid size: {value!r}")
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
+
+
+def current_rss() -> Optional[int]:
+    """Return the resident set size of this process in bytes.
+
+    Returns `None` if the size can't be found.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        # Only the peak is available on other platforms
+        return peak_rss()
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def peak_rss() -> Optional[int]:
+    """Return the peak resident set size of this process in bytes."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryBudget:
+    """A limit on the memory used by the conversion.
+
+    Arguments
+    ---------
+    limit
+        The number of bytes of memory that the conversion should stay below,
+        including any worker processes
+    """
+
+    #: The fraction of the budget used by each cache kept in memory
+    cache_fraction = 1 / 16
+
+    def __init__(self, limit: int) -> None:
+        if limit <= 0:
+            raise ValueError(f"The memory budget must be positive, not {limit}.")
+        self.limit = limit
+
+    @property
+    def cache_size(self) -> int:
+        """The number of bytes that each cache kept in memory may use."""
+        return int(self.limit * self.cache_fraction)
+
+    def used(self, worker_rss: Iterable[int] = ()) -> int:
+        """Return the memory used by this process and the ``worker_rss`` sizes."""
+        return (current_rss() or 0) + sum(worker_rss)
+
+    def exceeded(self, worker_rss: Iterable[int] = ()) -> bool:
+        """Return whether the memory used is over the budget.
+
+        Unreachable objects are collected before deciding, so that memory
+        that is only held by reference cycles isn't counted.
+        """
+        worker_rss = list(worker_rss)
+        if self.used(worker_rss) <= self.limit:
+            return False
+        gc.collect()
+        return self.used(worker_rss) > self.limit
@@ -0,0 +1,133 @@
+"""Store the files extracted from a Notebook on disk instead of in memory.
+
+The preprocessors that extract images from a Notebook store the content of
+each file in ``resources["outputs"]``, which is kept in memory for the whole
+export. For Notebooks with many large images, such as photos of solutions
+worked by hand, that uses a lot of memory, especially when several problems
+are converted in parallel. `DiskOutputs` is a mapping that can be used for
+``resources["outputs"]``, which writes each file to a temporary folder as it
+is added and keeps only the paths in memory. `SpillingFilesWriter` links or
+copies those files into the LaTeX build folder instead of reading them back.
+
+Classes
+-------
+DiskOutputs:
+    A mapping of filenames to file contents, stored on disk.
+
+SpillingFilesWriter:
+    Write the output of an exporter and its files to the build folder.
+
+"""
+
+# Standard Library
+from typing import Any, Dict, Iterator, Optional, Union, MutableMapping
+from pathlib import Path
+import copy
+import os
+import shutil
+import tempfile
+import weakref
+
+# Third-Party
+from nbconvert.writers import FilesWriter
+
+
+class DiskOutputs(MutableMapping[str, bytes]):
+    """A mapping of filenames to file contents, stored on disk.
+
+    Each value is written to a file in a new temporary folder when it is set,
+    and read back from the file when it is accessed. The folder is removed
+    when the mapping is closed or garbage collected.
+
+    Arguments
+    ---------
+    directory, optional
+        The folder to create the temporary folder in. Defaults to the system
+        temporary folder.
+    """
+
+    def __init__(self, directory: Optional[Union[str, Path]] = None) -> None:
+        self.directory = Path(
+            tempfile.mkdtemp(prefix="thermohw-outputs-", dir=directory)
+        )
+        self._paths: Dict[str, Path] = {}
+        self._count = 0
+        self._finalizer = weakref.finalize(
+            self, shutil.rmtree, str(self.directory), True
+        )
+
+    def path(self, key: str) -> Path:
+        """Return the path of the file that stores the value of ``key``."""
+        return self._paths[key]
+
+    def link_to(self, key: str, destination: Union[str, Path]) -> None:
+        """Put the file for ``key`` at ``destination``, linking it if possible."""
+        source = self._paths[key]
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+
+    def close(self) -> None:
+        """Remove the stored files."""
+        self._finalizer()
+        self._paths.clear()
+
+    def __getitem__(self, key: str) -> bytes:
+        return self._paths[key].read_bytes()
+
+    def __setitem__(self, key: str, value: bytes) -> None:
+        path = self._paths.get(key)
+        if path is None:
+            # The keys may contain folders, so the files are numbered instead
+            path = self.directory / str(self._count)
+            self._count += 1
+        path.write_bytes(value)
+        self._paths[key] = path
+
+    def __delitem__(self, key: str) -> None:
+        self._paths.pop(key).unlink()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._paths)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> "DiskOutputs":
+        new = DiskOutputs(self.directory.parent)
+        for key, path in self._paths.items():
+            new._paths[key] = new.directory / path.name
+            shutil.copyfile(path, new._paths[key])
+        new._count = self._count
+        return new
+
+
+class SpillingFilesWriter(FilesWriter):  # type: ignore
+    """Write the output of an exporter and its files to the build folder.
+
+    Files stored in a `DiskOutputs` mapping are linked or copied into the
+    build folder, without reading them into memory.
+    """
+
+    def write(
+        self,
+        output: Union[str, bytes],
+        resources: Dict[str, Any],
+        notebook_name: Optional[str] = None,
+        **kw: Any,
+    ) -> str:
+        """Write the files in ``resources["outputs"]`` and then the ``output``."""
+        outputs = resources.get("outputs")
+        if isinstance(outputs, DiskOutputs):
+            build_directory = self.build_directory or resources.get(
+                "metadata", {}
+            ).get("path", "")
+            for filename in outputs:
+                destination = os.path.join(build_directory, filename)
+                if os.path.dirname(destination):
+                    self._makedir(os.path.dirname(destination))
+                outputs.link_to(filename, destination)
+            resources = copy.copy(resources)
+            resources["outputs"] = {}
+        return super().write(output, resources, notebook_name=notebook_name, **kw)
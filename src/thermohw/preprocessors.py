@@ -5,26 +5,42 @@ Notebooks into homework assignments.
 
 Classes
 -------
-HomeworkPreprocessor:
-    Preprocess a homework problem for notes and other things that don't
-    belong in an assignment.
+RawRemover:
+    Remove any raw cells from the Notebook.
 
-SolnRemoverPreprocessor:
+SolutionRemover:
     Preprocess the Notebook to remove the solution section and replace
     it with headings for solution parts.
 
+HomeworkPreprocessor:
+    Remove raw cells and the solution, substitute the variables, and extract
+    the attachments in a single pass over the cells.
+
 """
 
 # Standard Library
-from typing import TYPE_CHECKING, Tuple, List, Dict
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Tuple
+import copy
 import warnings
 
 # Third-Party
 from nbconvert.preprocessors import Preprocessor
 from nbformat.v4 import new_code_cell, new_markdown_cell
+from traitlets import Bool
+
+# Local imports
+from .extract_attachments import ExtractAttachmentsPreprocessor
+from .pymarkdown import PyMarkdownPreprocessor
 
 if TYPE_CHECKING:
     from nbformat import NotebookNode  # noqa: F401 # typing only
+    from traitlets.config import Config  # noqa: F401 # typing only
+
+
+def _template_cell(cell: "NotebookNode") -> "NotebookNode":
+    """Remove the random ID from ``cell`` so that the output is reproducible."""
+    cell.pop("id", None)
+    return cell
 
 
 by_hand_source = (
@@ -32,19 +48,19 @@ by_hand_source = (
     "Attach multiple images, one in each cell, if necessary. Please make "
     "sure the text is clear and legible.**"
 )
-by_hand_cell = new_markdown_cell(source=by_hand_source)
+by_hand_cell = _template_cell(new_markdown_cell(source=by_hand_source))
 
 md_expl_source = (
     "**Write your engineering model, equations, and/or explanation of your process "
     "here.**"
 )
-md_expl_cell = new_markdown_cell(source=md_expl_source)
+md_expl_cell = _template_cell(new_markdown_cell(source=md_expl_source))
 
 code_ans_source = (
     "# Write your code here to solve the problem\n"
     "# Make sure to write your final answer in the cell below."
 )
-code_ans_cell = new_code_cell(source=code_ans_source)
+code_ans_cell = _template_cell(new_code_cell(source=code_ans_source))
 
 md_ans_source = """\
 <div class="alert alert-success">
@@ -53,11 +69,11 @@ md_ans_source = """\
 
 </div>
 """
-md_ans_cell = new_markdown_cell(source=md_ans_source)
+md_ans_cell = _template_cell(new_markdown_cell(source=md_ans_source))
 md_ans_cell.metadata.deletable = False
 
 sketch_source = "**Attach an image of your sketch for this problem in this cell.**"
-sketch_cell = new_markdown_cell(source=sketch_source)
+sketch_cell = _template_cell(new_markdown_cell(source=sketch_source))
 
 
 class RawRemover(Preprocessor):  # type: ignore
@@ -110,6 +126,73 @@ class SolutionRemover(Preprocessor):  # type: ignore
     The processing is only done if the resources->remove_solution key is True.
     """
 
+    def new_cell(
+        self, nb: "NotebookNode", position: int, template: "NotebookNode"
+    ) -> "NotebookNode":
+        """Return a copy of the ``template`` cell to insert at ``position``.
+
+        Notebooks with format 4.5 or later require a unique ID for each cell,
+        which is derived from the position of the cell so that the output is
+        the same every time.
+        """
+        cell = copy.deepcopy(template)
+        if (nb.nbformat, nb.nbformat_minor) >= (4, 5):
+            cell["id"] = f"thermohw-{position}"
+        return cell
+
+    def insert_cell(
+        self,
+        nb: "NotebookNode",
+        keep_cells: List["NotebookNode"],
+        template: "NotebookNode",
+    ) -> None:
+        """Append a copy of the ``template`` cell to ``keep_cells``."""
+        keep_cells.append(self.new_cell(nb, len(keep_cells), template))
+
+    def part_templates(self, tags: List[str], by_hand: bool) -> List["NotebookNode"]:
+        """Return the template cells for a solution part with ``tags``."""
+        if "sketch" in tags:
+            return [sketch_cell]
+        elif by_hand:
+            return [by_hand_cell]
+        else:
+            return [md_expl_cell, code_ans_cell, md_ans_cell]
+
+    def assignment_cells(
+        self,
+        nb: "NotebookNode",
+        cells: Iterable["NotebookNode"],
+        resources: Dict[str, bool],
+    ) -> Iterator["NotebookNode"]:
+        """Yield the cells of the assignment, finding the solution by cell tags.
+
+        The ``cells`` are consumed one at a time, so that other processing
+        can be done on each cell in the same pass.
+        """
+        solution_started = False
+        position = 0
+        for cell in cells:
+            if "tags" in cell.metadata:
+                tags = cell.metadata["tags"][:]
+                del cell.metadata["tags"]
+            else:
+                tags = []
+            output = []
+            if "solution" in tags:
+                solution_started = True
+                output.append(cell)
+            elif "part" in tags:
+                output.append(cell)
+                for template in self.part_templates(tags, resources["by_hand"]):
+                    output.append(self.new_cell(nb, position + len(output), template))
+            else:
+                if tags:
+                    warnings.warn(f"Unknown tag value: {tags}", UserWarning)
+                if not solution_started:
+                    output.append(cell)
+            yield from output
+            position += len(output)
+
     def preprocess(
         self, nb: "NotebookNode", resources: Dict[str, bool]
     ) -> Tuple["NotebookNode", Dict[str, bool]]:
@@ -127,34 +210,7 @@ class SolutionRemover(Preprocessor):  # type: ignore
             )
             return self.legacy_parser(nb, resources)
 
-        keep_cells: List["NotebookNode"] = []
-        solution_started = False
-        for cell in nb.cells:
-            if "tags" in cell.metadata:
-                tags = cell.metadata["tags"][:]
-                del cell.metadata["tags"]
-            else:
-                tags = []
-            if "solution" in tags:
-                solution_started = True
-                keep_cells.append(cell)
-            elif "part" in tags:
-                keep_cells.append(cell)
-                if "sketch" in tags:
-                    keep_cells.append(sketch_cell)
-                elif resources["by_hand"]:
-                    keep_cells.append(by_hand_cell)
-                else:
-                    keep_cells.append(md_expl_cell)
-                    keep_cells.append(code_ans_cell)
-                    keep_cells.append(md_ans_cell)
-            else:
-                if tags:
-                    warnings.warn(f"Unknown tag value: {tags}", UserWarning)
-                if not solution_started:
-                    keep_cells.append(cell)
-
-        nb.cells = keep_cells
+        nb.cells = list(self.assignment_cells(nb, nb.cells, resources))
         return nb, resources
 
     def legacy_parser(
@@ -177,26 +233,95 @@ class SolutionRemover(Preprocessor):  # type: ignore
         keep_cells = nb.cells[: keep_cells_idx[0] + 1]
         if len(keep_cells_idx) == 1:
             if resources["by_hand"]:
-                keep_cells.append(by_hand_cell)
+                self.insert_cell(nb, keep_cells, by_hand_cell)
             else:
                 if "sketch" in nb.cells[keep_cells_idx[0]].source.lower():
-                    keep_cells.append(sketch_cell)
+                    self.insert_cell(nb, keep_cells, sketch_cell)
                 else:
-                    keep_cells.append(md_expl_cell)
-                    keep_cells.append(code_ans_cell)
-                    keep_cells.append(md_ans_cell)
+                    self.insert_cell(nb, keep_cells, md_expl_cell)
+                    self.insert_cell(nb, keep_cells, code_ans_cell)
+                    self.insert_cell(nb, keep_cells, md_ans_cell)
         else:
             for i in keep_cells_idx[1:]:
                 keep_cells.append(nb.cells[i])
                 if resources["by_hand"]:
-                    keep_cells.append(by_hand_cell)
+                    self.insert_cell(nb, keep_cells, by_hand_cell)
                 else:
                     if "sketch" in nb.cells[i].source.lower():
-                        keep_cells.append(sketch_cell)
+                        self.insert_cell(nb, keep_cells, sketch_cell)
                     else:
-                        keep_cells.append(md_expl_cell)
-                        keep_cells.append(code_ans_cell)
-                        keep_cells.append(md_ans_cell)
+                        self.insert_cell(nb, keep_cells, md_expl_cell)
+                        self.insert_cell(nb, keep_cells, code_ans_cell)
+                        self.insert_cell(nb, keep_cells, md_ans_cell)
+
+        nb.cells = keep_cells
+        return nb, resources
+
+
+class HomeworkPreprocessor(Preprocessor):  # type: ignore
+    """Preprocess a homework problem in a single pass over the cells.
+
+    This applies the `RawRemover`, the `SolutionRemover`, the
+    `~thermohw.pymarkdown.PyMarkdownPreprocessor` and, if
+    ``extract_attachments`` is True, the
+    `~thermohw.extract_attachments.ExtractAttachmentsPreprocessor` to each cell
+    in turn, instead of walking the cells once for each preprocessor. The
+    output is the same as running the preprocessors one after the other, but
+    the Notebook is only validated once by the exporter.
+
+    The legacy parser for the solution needs to see every cell before it can
+    decide which to keep, so with the legacy behavior the solution is removed
+    before the rest of the processing.
+    """
+
+    extract_attachments = Bool(
+        False, help="Extract the attachments of the cells to the resources."
+    ).tag(config=True)
+
+    def __init__(self, **kw: Any) -> None:
+        super().__init__(**kw)
+        self.raw_remover = RawRemover(parent=self)
+        self.solution_remover = SolutionRemover(parent=self)
+        self.pymarkdown = PyMarkdownPreprocessor(parent=self)
+        self.attachments = ExtractAttachmentsPreprocessor(parent=self)
+
+    def update_config(self, config: "Config") -> None:
+        """Update the configuration of this and the combined preprocessors."""
+        super().update_config(config)
+        for step in (
+            self.raw_remover,
+            self.solution_remover,
+            self.pymarkdown,
+            self.attachments,
+        ):
+            step.update_config(config)
+
+    def preprocess(
+        self, nb: "NotebookNode", resources: Dict[str, Any]
+    ) -> Tuple["NotebookNode", Dict[str, Any]]:
+        """Preprocess the entire notebook."""
+        cells: Iterable["NotebookNode"] = nb.cells
+        if not resources.get("global_content_filter", {}).get("include_raw", False):
+            cells = (cell for cell in cells if cell.cell_type != "raw")
+
+        if "remove_solution" not in resources:
+            raise KeyError("The resources dictionary must have a remove_solution key.")
+        if resources["remove_solution"]:
+            if resources.get("legacy", True):
+                nb.cells = list(cells)
+                nb, resources = self.solution_remover.preprocess(nb, resources)
+                cells = nb.cells
+            else:
+                cells = self.solution_remover.assignment_cells(nb, cells, resources)
+
+        keep_cells: List["NotebookNode"] = []
+        for index, cell in enumerate(cells):
+            cell, resources = self.pymarkdown.preprocess_cell(cell, resources, index)
+            if self.extract_attachments:
+                cell, resources = self.attachments.preprocess_cell(
+                    cell, resources, index
+                )
+            keep_cells.append(cell)
 
         nb.cells = keep_cells
         return nb, resources
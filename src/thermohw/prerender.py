@@ -0,0 +1,342 @@
+"""Render all of the Markdown cells of a Notebook to LaTeX at once.
+
+The ``markdowncell`` block of the template converts each Markdown cell with
+two Pandoc runs, one from Markdown to JSON and one from JSON to LaTeX. Each
+run starts a new Pandoc process, so for Notebooks with many Markdown cells,
+starting Pandoc takes most of the time of the conversion. The preprocessor in
+this module writes each Markdown cell to its own file and reads all of them
+with one Pandoc run, with ``--file-scope`` so that each cell is read as if it
+were on its own, and writes all of the cells, separated by delimiters, with
+a second run. The LaTeX for each cell is stored in the cell metadata, where
+the template picks it up.
+
+Most cells are the same in the assignment and the solution and from one build
+to the next, so the LaTeX for each cell is also stored in a
+`~thermohw.cache.RenderCache` on disk, and only the cells that are not in the
+cache are rendered.
+
+The cells can be rendered to HTML in the same way, for the drafts written by
+`~thermohw.draft`, with the alert divs converted by
+`~thermohw.filters.html_div_filter`.
+
+Classes
+-------
+MarkdownPrerenderer:
+    Preprocess the Notebook to render the Markdown cells to LaTeX in a
+    single batch.
+
+"""
+
+# Standard Library
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+from pathlib import Path
+import copy
+import json
+import re
+import tempfile
+
+# Third-Party
+from nbconvert.preprocessors import Preprocessor
+from nbconvert.filters import citation2latex, strip_files_prefix
+from nbconvert.filters.filter_links import resolve_one_reference
+from nbconvert.utils.pandoc import get_pandoc_version, pandoc
+from nbconvert.utils.version import check_version
+from traitlets import Bool, Enum, Int, Unicode
+
+# Local imports
+from .cache import RenderCache, user_cache_directory
+from .filters import FilterAction, apply_filters, html_div_filter, registered_filters
+from .profiling import stage
+
+if TYPE_CHECKING:
+    from nbformat import NotebookNode  # noqa: F401 # typing only
+
+MARKDOWN_FORMAT = "markdown-implicit_figures+tex_math_double_backslash"
+
+cell_break = "thermohw-cell-break"
+# Each cell is read from its own file, which starts with an empty div. The
+# identifier of the div shows the prefix that Pandoc adds to the identifiers
+# of each file.
+markdown_cell_start = f'<div id="{cell_break}"></div>'
+latex_cell_break = f"%{cell_break}"
+html_cell_break = f"<!-- {cell_break} -->"
+
+# The delimiter of the cells in each output format
+output_cell_breaks = {"latex": latex_cell_break, "html": html_cell_break}
+# Render math for MathJax in HTML, as in the Notebook
+pandoc_arguments = {"latex": [], "html": ["--mathjax"]}
+
+# Pandoc reads each file on its own with --file-scope since version 2.0
+FILE_SCOPE_VERSION = "2.0"
+# The version of the rendered cells in the cache. Change it when the output
+# for the same source changes, so that the cached cells are rendered again.
+# Version 2 reads each cell in its own scope.
+CACHE_VERSION = "2"
+
+
+def _has_notes(blocks: Any) -> bool:
+    """Return whether the Pandoc JSON ``blocks`` have a footnote."""
+    if isinstance(blocks, dict):
+        return blocks.get("t") == "Note" or _has_notes(blocks.get("c"))
+    if isinstance(blocks, list):
+        return any(_has_notes(item) for item in blocks)
+    return False
+
+
+def output_filters(to: str) -> List[FilterAction]:
+    """Return the Pandoc filters applied to the cells rendered to ``to``."""
+    if to == "html":
+        return [html_div_filter]
+    return registered_filters + [resolve_one_reference]
+
+
+def _prepare_source(source: str, to: str) -> str:
+    """Apply the filters of the template that run before Pandoc to ``source``."""
+    if to == "latex":
+        source = citation2latex(source)
+    return strip_files_prefix(source)
+
+
+def render_markdown_cell(source: str, to: str = "latex") -> str:
+    """Render a single Markdown ``source`` with two Pandoc runs.
+
+    This is the same as the chain of filters in the ``markdowncell`` block of
+    the template for ``to``.
+    """
+    doc_json = pandoc(_prepare_source(source, to), MARKDOWN_FORMAT, "json")
+    doc_json = apply_filters(doc_json, output_filters(to), to)
+    return pandoc(doc_json, "json", to, pandoc_arguments[to])
+
+
+def _read_cells(
+    sources: List[str], to: str
+) -> Optional[Tuple[Dict[str, Any], List[List[Any]]]]:
+    """Read the Markdown ``sources`` with one Pandoc run and apply the filters.
+
+    Each source is written to its own file and read with ``--file-scope``,
+    so that the footnotes, the link references, and the identifiers of the
+    headers of each cell don't depend on the other cells, as if each cell
+    was read on its own.
+
+    Returns
+    -------
+    tuple or None
+        The Pandoc JSON document without its blocks, and the blocks of each
+        source, or `None` if the cells could not be separated again.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for index, source in enumerate(sources):
+            path = Path(directory) / f"cell-{index}.md"
+            path.write_text(
+                f"{markdown_cell_start}\n\n{_prepare_source(source, to)}",
+                encoding="utf-8",
+            )
+            paths.append(str(path))
+        with stage("pandoc", to="json"):
+            doc_json = pandoc("", MARKDOWN_FORMAT, "json", ["--file-scope"] + paths)
+
+    # Remove the prefixes of the files from the identifiers and the links to
+    # them. The prefixes include the random name of the folder, so they
+    # don't appear anywhere else.
+    prefixes = set(re.findall(rf'"([^"]+){re.escape(cell_break)}"', doc_json))
+    for prefix in prefixes:
+        doc_json = doc_json.replace(f'"{prefix}', '"').replace(f'"#{prefix}', '"#')
+    with stage("filters"):
+        doc_json = apply_filters(doc_json, output_filters(to), to)
+
+    doc = json.loads(doc_json)
+    cells: List[List[Any]] = []
+    for block in doc.pop("blocks"):
+        if (
+            block.get("t") == "Div"
+            and block["c"][0][0] == cell_break
+            and not block["c"][1]
+        ):
+            cells.append([])
+        elif cells:
+            cells[-1].append(block)
+        else:
+            return None
+    if len(cells) != len(sources):
+        return None
+    return doc, cells
+
+
+def _write_cells(
+    doc: Dict[str, Any], cells: List[List[Any]], to: str
+) -> Optional[List[str]]:
+    """Write the Pandoc JSON blocks of the ``cells`` to ``to`` with one Pandoc run."""
+    output_break = output_cell_breaks[to]
+    blocks: List[Any] = []
+    for index, cell in enumerate(cells):
+        if index:
+            blocks.append({"t": "RawBlock", "c": [to, output_break]})
+        blocks.extend(cell)
+    with stage("pandoc", to=to):
+        output = pandoc(
+            json.dumps(dict(doc, blocks=blocks)), "json", to, pandoc_arguments[to]
+        )
+    rendered = re.split(rf"^{re.escape(output_break)}$", output, flags=re.MULTILINE)
+    if len(rendered) != len(cells):
+        return None
+    return [part.strip("\n") for part in rendered]
+
+
+def render_markdown_cells(sources: List[str], to: str = "latex") -> Optional[List[str]]:
+    """Render the Markdown ``sources`` to LaTeX or HTML with two Pandoc runs.
+
+    The result is the same as converting each source on its own with the
+    chain of filters in the ``markdowncell`` block of the template for ``to``.
+    Each cell is read in its own scope, so footnotes, link references, and
+    headers in one cell don't change the other cells. The HTML writer puts the
+    footnotes at the end of the document, so the HTML of the cells with
+    footnotes is written with a Pandoc run for each of those cells.
+
+    With a Pandoc older than 2.0, which can't read the cells in their own
+    scope with one run, each cell is rendered on its own.
+
+    Arguments
+    ---------
+    sources
+        A list of the sources of the Markdown cells
+    to, optional
+        The output format, ``latex`` or ``html``
+
+    Returns
+    -------
+    list or None
+        The output for each source, in the same order as ``sources``, or
+        `None` if the cells could not be separated again after conversion.
+    """
+    if not sources:
+        return []
+    if not check_version(get_pandoc_version(), FILE_SCOPE_VERSION):
+        return [render_markdown_cell(source, to) for source in sources]
+
+    read = _read_cells(sources, to)
+    if read is None:
+        return None
+    doc, cells = read
+
+    batch = [j for j, cell in enumerate(cells) if to != "html" or not _has_notes(cell)]
+    groups = [batch] if batch else []
+    groups.extend([j] for j in range(len(cells)) if j not in batch)
+    rendered = [""] * len(sources)
+    for group in groups:
+        output = _write_cells(doc, [cells[j] for j in group], to)
+        if output is None:
+            return None
+        for j, part in zip(group, output):
+            rendered[j] = part
+    return rendered
+
+
+def set_prerendered(
+    nb: "NotebookNode", index: int, rendered: str, to: str = "latex"
+) -> None:
+    """Store the output rendered for the cell at ``index`` in its metadata.
+
+    The output is stored in the ``prerendered_<to>`` key of the metadata.
+    """
+    # Copy the cell instead of modifying it in place, in case the cell is
+    # shared with another Notebook.
+    cell = copy.copy(nb.cells[index])
+    cell.metadata = copy.copy(cell.metadata)
+    cell.metadata[f"prerendered_{to}"] = rendered
+    nb.cells[index] = cell
+
+
+class MarkdownPrerenderer(Preprocessor):  # type: ignore
+    """Render the Markdown cells of the Notebook to LaTeX in a single batch.
+
+    The LaTeX for each Markdown cell is stored in the
+    ``prerendered_latex`` key of the cell metadata. If the cells can't be
+    rendered in a batch, the metadata is not set and the template falls back
+    to converting each cell individually. With ``to`` set to ``html``, the
+    cells are rendered to HTML and stored in ``prerendered_html`` instead.
+
+    This preprocessor must run after any preprocessors that modify the source
+    of the Markdown cells.
+
+    When ``use_cache`` is set, the LaTeX for each cell is stored in a cache
+    in ``cache_directory``, keyed by the source of the cell, the Pandoc
+    version, and the filters, and only the cells that are not in the cache
+    are rendered. The least recently used entries are removed when the cache
+    is larger than ``cache_size`` bytes.
+    """
+
+    to = Enum(
+        ["latex", "html"], "latex", help="The format to render the cells to."
+    ).tag(config=True)
+
+    use_cache = Bool(True, help="Cache the output rendered for each cell.").tag(
+        config=True
+    )
+
+    cache_directory = Unicode(
+        "",
+        help=(
+            "Directory to store the rendered cells in. Defaults to the latex-cells "
+            "or html-cells folder in the user cache directory."
+        ),
+    ).tag(config=True)
+
+    cache_size = Int(
+        32 * 2 ** 20, help="Maximum size of the cache of rendered cells in bytes."
+    ).tag(config=True)
+
+    def _get_cache(self) -> Optional[RenderCache]:
+        if not self.use_cache:
+            return None
+        directory = self.cache_directory or user_cache_directory() / f"{self.to}-cells"
+        filters = output_filters(self.to)
+        context = [CACHE_VERSION, MARKDOWN_FORMAT, str(get_pandoc_version())]
+        if self.to != "latex":
+            context.append(self.to)
+        context.extend(
+            f"{f.__module__}.{getattr(f, '__qualname__', repr(f))}" for f in filters
+        )
+        return RenderCache(Path(directory), context, self.cache_size)
+
+    def render(self, sources: List[str]) -> List[Optional[str]]:
+        """Render the Markdown ``sources`` to ``to``, using the cache.
+
+        The sources that are not in the cache are rendered in a single batch.
+        The output of a source is `None` if the batch could not be rendered.
+        """
+        cache = self._get_cache()
+        rendered: List[Optional[str]] = [None] * len(sources)
+        keys: List[str] = []
+        if cache is not None:
+            keys = [cache.key(source) for source in sources]
+            rendered = [cache.get(key) for key in keys]
+
+        missing = [j for j, latex in enumerate(rendered) if latex is None]
+        if missing:
+            new = render_markdown_cells([sources[j] for j in missing], self.to)
+            if new is None:
+                self.log.warning(
+                    "Markdown cells could not be rendered in a batch, falling back "
+                    "to rendering each cell separately."
+                )
+            else:
+                for j, latex in zip(missing, new):
+                    rendered[j] = latex
+                    if cache is not None:
+                        cache.put(keys[j], latex)
+                if cache is not None:
+                    cache.evict()
+        return rendered
+
+    def preprocess(
+        self, nb: "NotebookNode", resources: Dict[str, Any]
+    ) -> Tuple["NotebookNode", Dict[str, Any]]:
+        """Render the Markdown cells of the Notebook to ``to``."""
+        indices = [i for i, cell in enumerate(nb.cells) if cell.cell_type == "markdown"]
+        rendered = self.render([nb.cells[i].source for i in indices])
+        for index, output in zip(indices, rendered):
+            if output is None:
+                continue
+            set_prerendered(nb, index, output, self.to)
+        return nb, resources
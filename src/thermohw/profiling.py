@@ -0,0 +1,193 @@
+"""Time the stages of the homework conversion.
+
+Each stage of the conversion, such as reading a Notebook, running a
+preprocessor, rendering the template, running Pandoc or LaTeX, and merging
+the PDFs, is wrapped in a `stage`. When the `profiler` is enabled, each
+stage is recorded as an event that can be summarized or written to a trace
+file in the Chrome trace event format, which can be loaded in a trace viewer
+such as ``chrome://tracing`` or https://ui.perfetto.dev.
+
+Functions can be registered with `add_hook` to be called with every event,
+whether or not the profiler is enabled.
+
+When ``track_memory`` is set, each event also records the resident set size
+of the process at the end of the stage, its peak, and how much the stage
+raised the peak, so that the stages that use the most memory can be found.
+
+Classes
+-------
+Profiler:
+    Record the time spent in each stage.
+
+Functions
+---------
+stage:
+    Context manager to record a stage with the global `profiler`.
+
+add_hook:
+    Register a function to be called at the end of every stage.
+
+"""
+
+# Standard Library
+from typing import Any, Callable, Dict, Iterator, List, Union
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import defaultdict
+from pathlib import Path
+import json
+import os
+import threading
+import time
+
+# Local imports
+from .memory import current_rss, peak_rss
+
+Event = Dict[str, Any]
+Hook = Callable[[Event], None]
+
+
+class Profiler:
+    """Record the time spent in each stage of the conversion.
+
+    Stages can be nested, and the arguments of a stage, for instance the name
+    of the problem or the variant being converted, are inherited by the
+    stages nested in it. The arguments are stored in a context variable, so
+    stages in different threads or asyncio tasks don't share them. Events are
+    only recorded when ``enabled`` is set, but the hooks are called for every
+    stage.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.track_memory = False
+        self.events: List[Event] = []
+        self.hooks: List[Hook] = []
+        self._args: ContextVar[Dict[str, Any]] = ContextVar(
+            f"profiler_args_{id(self)}", default={}
+        )
+
+    @contextmanager
+    def stage(self, name: str, **args: Any) -> Iterator[None]:
+        """Record the time spent in the body of the ``with`` statement.
+
+        Arguments
+        ---------
+        name
+            The name of the stage
+        args
+            Additional information about the stage, such as the problem
+        """
+        if not self.enabled and not self.hooks:
+            yield
+            return
+
+        merged = {**self._args.get(), **args}
+        token = self._args.set(merged)
+        start_peak = peak_rss() if self.track_memory else None
+        timestamp = time.time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self._args.reset(token)
+            event_args = merged
+            if self.track_memory:
+                end_peak = peak_rss()
+                event_args = {**merged, "rss": current_rss(), "peak_rss": end_peak}
+                if start_peak is not None and end_peak is not None:
+                    event_args["peak_rss_growth"] = end_peak - start_peak
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": timestamp * 1e6,
+                "dur": duration * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": event_args,
+            }
+            if self.enabled:
+                self.events.append(event)
+            for hook in self.hooks:
+                hook(event)
+
+    def collect(self) -> List[Event]:
+        """Return the recorded events and clear them from the profiler."""
+        events, self.events = self.events, []
+        return events
+
+    def summary(self) -> Dict[str, float]:
+        """Return the total time in seconds spent in each stage."""
+        totals: Dict[str, float] = defaultdict(float)
+        for event in self.events:
+            totals[event["name"]] += event["dur"] / 1e6
+        return dict(totals)
+
+    def memory_summary(self) -> Dict[str, Dict[str, int]]:
+        """Return the peak RSS and the largest rise of the peak for each stage.
+
+        The sizes are in bytes. Only stages recorded with ``track_memory``
+        are included.
+        """
+        memory: Dict[str, Dict[str, int]] = {}
+        for event in self.events:
+            args = event["args"]
+            if args.get("peak_rss") is None:
+                continue
+            stage_memory = memory.setdefault(event["name"], {"peak": 0, "growth": 0})
+            stage_memory["peak"] = max(stage_memory["peak"], args["peak_rss"])
+            stage_memory["growth"] = max(
+                stage_memory["growth"], args.get("peak_rss_growth", 0)
+            )
+        return memory
+
+    def print_summary(self) -> None:
+        """Print the total time spent in each stage, slowest first.
+
+        If the memory was tracked, the peak RSS of the process running each
+        stage and the largest rise of the peak during the stage are printed
+        as well, in MiB.
+        """
+        totals = self.summary()
+        memory = self.memory_summary()
+        counts: Dict[str, int] = defaultdict(int)
+        for event in self.events:
+            counts[event["name"]] += 1
+        header = f"{'stage':<44} {'calls':>6} {'total (s)':>10}"
+        if memory:
+            header += f" {'peak RSS (MiB)':>15} {'raised (MiB)':>13}"
+        print(header)
+        for name, total in sorted(totals.items(), key=lambda t: t[1], reverse=True):
+            line = f"{name:<44} {counts[name]:>6} {total:>10.3f}"
+            if name in memory:
+                line += (
+                    f" {memory[name]['peak'] / 2 ** 20:>15.1f}"
+                    f" {memory[name]['growth'] / 2 ** 20:>13.1f}"
+                )
+            print(line)
+
+    def write_trace(self, path: Union[Path, str]) -> None:
+        """Write the events to ``path`` in the Chrome trace event format."""
+        trace = {"traceEvents": self.events, "displayTimeUnit": "ms"}
+        with open(path, "w") as f:
+            json.dump(trace, f)
+
+
+profiler = Profiler()
+
+
+def stage(name: str, **args: Any) -> Any:
+    """Record a stage with the global `profiler`. See `Profiler.stage`."""
+    return profiler.stage(name, **args)
+
+
+def add_hook(hook: Hook) -> Hook:
+    """Call ``hook`` with the event at the end of every stage.
+
+    Hooks are called in the process that runs the stage, so hooks that should
+    run in worker processes must be registered before the workers start.
+    This function returns ``hook``, so it can be used as a decorator.
+    """
+    profiler.hooks.append(hook)
+    return hook
@@ -0,0 +1,358 @@
+"""A long-running local service that converts homework problems on request.
+
+Starting the converter imports nbconvert and builds the exporters, which takes
+longer than converting a small problem. `ConversionServer` builds the
+exporters once and keeps them warm for every request, so that an editor
+plugin or a script that converts many Notebooks only pays for the start up
+once.
+
+The server speaks HTTP and only uses the standard library. A Notebook is
+converted by sending its JSON as the body of ``POST /convert``, with the
+options in the query string::
+
+    curl --data-binary @homework-1-1.ipynb \\
+        "http://localhost:8765/convert?format=pdf&remove_solution=false" > out.pdf
+
+The options are
+
+format
+    ``pdf`` (the default) or ``notebook``
+remove_solution
+    ``true`` (the default) for the assignment or ``false`` for the solution
+by_hand, legacy
+    ``true`` or ``false`` (the default), see
+    `~thermohw.convert_thermo_hw.convert_problem`
+name
+    The name of the problem, such as ``homework-1-1``, which is used for the
+    names of the attachments
+
+The response is the PDF or the Notebook. Bad requests get a ``400`` response
+and failed conversions a ``500`` response, with the error as plain text.
+``GET /health`` returns ``200`` while the server is running.
+
+The Notebooks are preprocessed and rendered one at a time, since the exporters
+are shared, and up to ``jobs`` PDFs are compiled at the same time by LaTeX
+processes in a separate thread. Up to ``queue_size`` more requests wait for
+their turn, and requests beyond those are refused with ``503`` so that the
+server isn't overloaded.
+
+Classes
+-------
+ConversionServer:
+    An HTTP server that converts Notebooks with warm exporters.
+
+Functions
+---------
+serve:
+    Run a `ConversionServer` until interrupted.
+
+parse_options:
+    Parse the options of a conversion from a query string.
+
+"""
+
+# Standard Library
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import asyncio
+import re
+import sys
+import threading
+import traceback
+
+# Local imports
+from .convert_thermo_hw import configure_exporters, get_exporters, problem_resources
+from .profiling import stage
+
+if TYPE_CHECKING:
+    # typing only
+    from nbformat import NotebookNode  # noqa: F401
+    from traitlets.config import Config  # noqa: F401
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+CONTENT_TYPES = {"pdf": "application/pdf", "notebook": "application/x-ipynb+json"}
+EXTENSIONS = {"pdf": ".pdf", "notebook": ".ipynb"}
+
+# The names of problems are used for the names of files in the build folder
+_NAME_PATTERN = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_.-]*")
+_BOOLEANS = {
+    "true": True,
+    "yes": True,
+    "1": True,
+    "false": False,
+    "no": False,
+    "0": False,
+}
+
+
+def parse_options(query: str) -> Dict[str, Any]:
+    """Parse the options of a conversion from a query string.
+
+    Raises `ValueError` for unknown options and invalid values.
+    """
+    options: Dict[str, Any] = {
+        "format": "pdf",
+        "remove_solution": True,
+        "by_hand": False,
+        "legacy": False,
+        "name": "notebook",
+    }
+    for key, values in parse_qs(query, keep_blank_values=True).items():
+        value = values[-1]
+        if key not in options:
+            raise ValueError(f"Unknown option: {key!r}")
+        if key == "format":
+            if value not in CONTENT_TYPES:
+                raise ValueError(f"The format must be pdf or notebook, not {value!r}")
+            options[key] = value
+        elif key == "name":
+            if _NAME_PATTERN.fullmatch(value) is None:
+                raise ValueError(f"Invalid name: {value!r}")
+            options[key] = value
+        else:
+            try:
+                options[key] = _BOOLEANS[value.lower()]
+            except KeyError:
+                raise ValueError(
+                    f"The option {key} must be true or false, not {value!r}"
+                ) from None
+    return options
+
+
+class _ConversionHandler(BaseHTTPRequestHandler):
+    """Handle the requests to a `ConversionServer`."""
+
+    server: "ConversionServer"
+
+    def do_GET(self) -> None:
+        if urlsplit(self.path).path == "/health":
+            self._send(200, b"ok\n", "text/plain; charset=utf-8")
+        else:
+            self._send_text(404, f"Not found: {self.path}")
+
+    def do_POST(self) -> None:
+        url = urlsplit(self.path)
+        if url.path != "/convert":
+            self._send_text(404, f"Not found: {self.path}")
+            return
+        try:
+            options = parse_options(url.query)
+        except ValueError as e:
+            self._send_text(400, str(e))
+            return
+
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self._send_text(411, "The Content-Length header is required")
+            return
+        try:
+            size = int(length)
+            if size < 0:
+                raise ValueError
+        except ValueError:
+            self._send_text(400, f"Invalid Content-Length: {length!r}")
+            return
+        if size > self.server.max_request_size:
+            self._send_text(
+                413, f"The Notebook is larger than {self.server.max_request_size} bytes"
+            )
+            return
+
+        # Take a slot before reading the body, so that the requests that are
+        # turned away don't hold their Notebooks in memory
+        if not self.server.queue_slots.acquire(blocking=False):
+            self.send_response(503)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.end_headers()
+            self.wfile.write(b"Too many conversions are waiting, try again later\n")
+            return
+        error: Optional[Tuple[int, str]] = None
+        try:
+            nb = _read_notebook(self.rfile.read(size))
+            try:
+                data = self.server.convert(nb, **options)
+            except Exception as e:
+                traceback.print_exc()
+                error = (500, f"The conversion failed: {e}")
+        except Exception as e:
+            error = (400, f"Invalid Notebook: {e}")
+        finally:
+            # Free the slot before answering, so that the client can send the
+            # next request as soon as it has the response
+            self.server.queue_slots.release()
+        if error is not None:
+            self._send_text(*error)
+            return
+
+        fmt = options["format"]
+        self._send(
+            200,
+            data,
+            CONTENT_TYPES[fmt],
+            filename=options["name"] + EXTENSIONS[fmt],
+        )
+
+    def _send(
+        self, code: int, data: bytes, content_type: str, filename: Optional[str] = None
+    ) -> None:
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if filename is not None:
+            disposition = f'attachment; filename="{filename}"'
+            self.send_header("Content-Disposition", disposition)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_text(self, code: int, message: str) -> None:
+        self._send(code, (message + "\n").encode("utf-8"), "text/plain; charset=utf-8")
+
+
+def _read_notebook(data: bytes) -> "NotebookNode":
+    """Read and validate a Notebook from the body of a request."""
+    import nbformat
+
+    nb = nbformat.convert(nbformat.reader.reads(data.decode("utf-8")), 4)
+    # nbformat.reads only logs the errors, and an invalid Notebook would fail
+    # later with a less helpful error
+    nbformat.validate(nb)
+    if "celltoolbar" in nb.metadata:
+        del nb.metadata["celltoolbar"]
+    return nb
+
+
+class ConversionServer(ThreadingHTTPServer):
+    """An HTTP server that converts Notebooks with warm exporters.
+
+    The exporters from `~thermohw.convert_thermo_hw.get_exporters` are built
+    when the server is created and are used for every request. See the
+    module for the API.
+
+    Arguments
+    ---------
+    address
+        The host and port to listen on. Port 0 picks a free port, which is
+        in ``server_address`` afterwards.
+    jobs, optional
+        The number of PDFs to compile at the same time
+    queue_size, optional
+        The number of requests that can wait while ``jobs`` requests are
+        being converted, before new requests are refused
+    max_request_size, optional
+        The largest Notebook in bytes that is accepted
+    config, optional
+        The configuration of the exporters, such as from
+        `~thermohw.convert_thermo_hw.exporter_config`
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        jobs: int = 1,
+        queue_size: int = 16,
+        max_request_size: int = 64 * 2 ** 20,
+        config: Optional["Config"] = None,
+    ) -> None:
+        if jobs < 1:
+            raise ValueError(f"The number of jobs must be at least 1, not {jobs}.")
+        if queue_size < 0:
+            raise ValueError(f"The queue size can't be negative, not {queue_size}.")
+        self.jobs = jobs
+        self.max_request_size = max_request_size
+        self.queue_slots = threading.BoundedSemaphore(jobs + queue_size)
+        super().__init__(address, _ConversionHandler)
+
+        self.nb_exp, self.pdf_exp = get_exporters()
+        if config is not None:
+            configure_exporters(config)
+        # The exporters and their preprocessors keep state between calls
+        self._export_lock = threading.Lock()
+
+        # The PDFs are compiled by asyncio subprocesses in a separate thread,
+        # so the next request is preprocessed while LaTeX runs
+        self._loop = asyncio.new_event_loop()
+        if sys.version_info < (3, 8) and sys.platform != "win32":
+            # The default child watcher of Python 3.7 only works with a loop
+            # attached in the main thread
+            asyncio.get_child_watcher().attach_loop(self._loop)
+        self._latex_slots: Optional[asyncio.Semaphore] = None
+        self._loop_thread = threading.Thread(
+            target=self._loop.run_forever, name="thermohw-latex", daemon=True
+        )
+        self._loop_thread.start()
+
+    def convert(
+        self,
+        nb: "NotebookNode",
+        format: str = "pdf",
+        remove_solution: bool = True,
+        by_hand: bool = False,
+        legacy: bool = False,
+        name: str = "notebook",
+    ) -> bytes:
+        """Convert ``nb`` and return the PDF or the Notebook.
+
+        This is called by the request handler threads. See the module for the
+        arguments.
+        """
+        res = problem_resources(name, by_hand, legacy)
+        res["remove_solution"] = remove_solution
+        variant = "assignment" if remove_solution else "solution"
+        with stage("request", problem=name, variant=variant):
+            if format == "notebook":
+                with self._export_lock, stage("export:notebook"):
+                    notebook, _ = self.nb_exp.from_notebook_node(nb, resources=res)
+                return notebook.encode("utf-8")
+
+            with self._export_lock, stage("export:latex"):
+                latex, resources = self.pdf_exp.latex_from_notebook_node(
+                    nb, resources=res
+                )
+            future = asyncio.run_coroutine_threadsafe(
+                self._compile_pdf(latex, resources), self._loop
+            )
+            return future.result()
+
+    async def _compile_pdf(self, latex: str, resources: Dict[str, Any]) -> bytes:
+        if self._latex_slots is None:
+            # Created in the thread of the event loop, which it is bound to
+            self._latex_slots = asyncio.Semaphore(self.jobs)
+        async with self._latex_slots:
+            pdf, _ = await self.pdf_exp.pdf_from_latex_async(latex, resources)
+        return pdf
+
+    def server_close(self) -> None:
+        """Close the socket and stop the thread that compiles the PDFs."""
+        super().server_close()
+        if self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+
+
+def serve(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    jobs: int = 1,
+    queue_size: int = 16,
+    config: Optional["Config"] = None,
+) -> None:
+    """Run a `ConversionServer` until interrupted with ``Ctrl+C``.
+
+    See `ConversionServer` for the arguments.
+    """
+    server = ConversionServer((host, port), jobs, queue_size, config=config)
+    with server:
+        host, port = server.server_address[:2]
+        print(f"Serving on http://{host}:{port}, press Ctrl+C to stop")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -3,25 +3,387 @@ Utility functions for the converters.
 """
 
 # Standard Library
-from typing import List
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 from io import BytesIO
+from pathlib import Path
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+import hashlib
+import json
+import os
 
 # Third-Party
-from pdfrw import PdfReader, PdfWriter
+from pdfrw import PdfArray, PdfDict, PdfReader, PdfWriter
 
 
-def combine_pdf_as_bytes(pdfs: List[BytesIO]) -> bytes:
+PdfSource = Union[BytesIO, Path, str]
+ZipMember = Tuple[str, Union[Path, bytes, str]]
+
+# Fixed timestamp for the members of zip files, the earliest date that the
+# format supports, so that the same inputs give byte-identical archives.
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# The page index of a combined PDF is stored next to it with this suffix
+PAGE_INDEX_SUFFIX = ".pages.json"
+
+
+def _write_atomic(output: Path, write: Callable[[BinaryIO], None]) -> None:
+    temporary = output.with_name(f".{output.name}.{os.getpid()}.tmp")
+    try:
+        with temporary.open("wb") as f:
+            write(f)
+        os.replace(temporary, output)
+    except BaseException:
+        if temporary.exists():
+            temporary.unlink()
+        raise
+
+
+def _insertion_index(names: Sequence[str], name: str, order: Sequence[str]) -> int:
+    """Return where to insert a new ``name`` among the existing ``names``.
+
+    ``name`` goes before the first of the ``names`` that comes after it in
+    ``order``, or at the end if there is none or ``name`` is not in ``order``.
+    """
+    if name not in order:
+        return len(names)
+    position = order.index(name)
+    for index, other in enumerate(names):
+        if other in order and order.index(other) > position:
+            return index
+    return len(names)
+
+
+def _read_pages(pdf: PdfSource) -> list:
+    if not isinstance(pdf, BytesIO):
+        pdf = str(pdf)
+    return PdfReader(pdf).pages
+
+
+def _combine(pdfs: Iterable[PdfSource]) -> Tuple[PdfWriter, List[int]]:
+    writer = PdfWriter()
+    page_counts = []
+    for pdf in pdfs:
+        pages = _read_pages(pdf)
+        writer.addpages(pages)
+        page_counts.append(len(pages))
+    return writer, page_counts
+
+
+def deduplicate_resources(writer: PdfWriter) -> None:
+    """Share identical objects between the resources of the pages of ``writer``.
+
+    Each PDF made by LaTeX embeds its own copy of the fonts, images, and
+    other resources it uses, so a combined PDF has a copy from every input.
+    The indirect objects in the resources of each page, such as the fonts
+    and XObjects and the streams they use, are compared by their content, and
+    every reference to a copy is replaced by a reference to the first one, so
+    that each is written once. The streams are also compressed when the PDF
+    is written, if they aren't already.
+    """
+    # The signature and the shared object for each object that was visited
+    visited: Dict[int, Tuple[Any, str]] = {}
+    in_progress = set()
+    shared: Dict[str, Any] = {}
+
+    def visit(obj: Any) -> Tuple[Any, str]:
+        if not isinstance(obj, (PdfDict, PdfArray)):
+            return obj, f"{type(obj).__name__}:{obj}"
+        key = id(obj)
+        if key in visited:
+            return visited[key]
+        if key in in_progress:
+            # A reference back to an object being visited can't be compared,
+            # and the unique signature keeps its ancestors from being shared.
+            return obj, f"cycle:{key}"
+
+        in_progress.add(key)
+        if isinstance(obj, PdfDict):
+            items = []
+            for name, value in list(obj.iteritems()):
+                new_value, signature = visit(value)
+                if new_value is not value:
+                    obj[name] = new_value
+                items.append(f"{name} {signature}")
+            content = "<<" + " ".join(sorted(items)) + ">>"
+            if obj.stream is not None:
+                stream = obj.stream.encode("utf-8", "surrogatepass")
+                content += "stream:" + hashlib.sha256(stream).hexdigest()
+        else:
+            items = []
+            for index, value in enumerate(obj):
+                new_value, signature = visit(value)
+                if new_value is not value:
+                    obj[index] = new_value
+                items.append(signature)
+            content = "[" + " ".join(items) + "]"
+        in_progress.discard(key)
+
+        if obj.indirect:
+            digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+            result = (shared.setdefault(digest, obj), f"@{digest}")
+        else:
+            result = (obj, content)
+        visited[key] = result
+        return result
+
+    for page in writer.pagearray:
+        if page.Resources is not None:
+            page.Resources = visit(page.Resources)[0]
+    writer.compress = True
+
+
+def _file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(2 ** 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def page_index_path(pdf: Union[Path, str]) -> Path:
+    """Return the path of the page index of the combined PDF ``pdf``."""
+    pdf = Path(pdf)
+    return pdf.with_name(pdf.name + PAGE_INDEX_SUFFIX)
+
+
+def write_page_index(pdf: Union[Path, str], parts: Iterable[Tuple[str, int]]) -> None:
+    """Write the page index of the combined PDF ``pdf``.
+
+    Arguments
+    ---------
+    pdf
+        The path of the combined PDF
+    parts
+        An iterable of ``(label, pages)`` pairs with the label and the number
+        of pages of each part of the PDF, in order
+
+    """
+    pdf = Path(pdf)
+    index = {
+        "sha256": _file_digest(pdf),
+        "parts": [[label, pages] for label, pages in parts],
+    }
+    _write_atomic(
+        page_index_path(pdf), lambda f: f.write(json.dumps(index).encode("utf-8"))
+    )
+
+
+def read_page_index(pdf: Union[Path, str]) -> Optional[List[Tuple[str, int]]]:
+    """Return the labels and number of pages of each part of the combined PDF.
+
+    Returns `None` if ``pdf`` or its index doesn't exist, or if ``pdf`` has
+    changed since the index was written.
+    """
+    pdf = Path(pdf)
+    try:
+        index = json.loads(page_index_path(pdf).read_text(encoding="utf-8"))
+        if index["sha256"] != _file_digest(pdf):
+            return None
+        return [(str(label), int(pages)) for label, pages in index["parts"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def combine_pdfs(
+    pdfs: Iterable[PdfSource],
+    output: Union[Path, str],
+    labels: Optional[Sequence[str]] = None,
+    keep_existing: bool = False,
+    deduplicate: bool = False,
+    order: Optional[Sequence[str]] = None,
+) -> bool:
+    """Combine PDFs and write the result directly to the file ``output``.
+
+    The result is written to a temporary file next to ``output`` and renamed,
+    so ``output`` is never left partially written.
+
+    If ``labels`` are given, an index of the pages of each of the ``pdfs`` is
+    written next to ``output``. With ``keep_existing``, the index is used to
+    replace only the pages of the parts with the same labels in the existing
+    ``output``, keeping the pages of the other parts. The replaced parts keep
+    their position, and new parts are inserted before the first part that
+    comes after them in ``order``, or added at the end.
+
+    Arguments
+    ---------
+    pdfs
+        An iterable of paths to PDF files, or BytesIO representations of PDFs
+    output
+        The path of the combined PDF
+    labels, optional
+        The label of each of the ``pdfs``, such as the name of the problem
+    keep_existing, optional
+        Keep the parts of the existing ``output`` that are not replaced by one
+        of the ``pdfs``. Requires ``labels``.
+    deduplicate, optional
+        Write the fonts and other resources that are the same in several of
+        the ``pdfs`` once, and compress the streams. See
+        `deduplicate_resources`.
+    order, optional
+        The labels of all of the parts, including those that are kept, in
+        the order of the combined PDF. Defaults to ``labels``.
+
+    Returns
+    -------
+    bool
+        Whether the pages of the existing ``output`` were kept. This is False
+        if ``output`` or its page index doesn't exist, or if ``output`` changed
+        since the index was written, in which case only the ``pdfs`` are
+        combined.
+
+    """
+    output = Path(output)
+    if labels is None:
+        if keep_existing:
+            raise ValueError("The labels are required to keep the existing pages.")
+        writer, _ = _combine(pdfs)
+        if deduplicate:
+            deduplicate_resources(writer)
+        _write_atomic(output, writer.write)
+        return False
+
+    pdfs = list(pdfs)
+    if len(pdfs) != len(labels):
+        raise ValueError("There must be one label for each PDF.")
+
+    existing = read_page_index(output) if keep_existing else None
+    if existing is None:
+        writer, page_counts = _combine(pdfs)
+        if deduplicate:
+            deduplicate_resources(writer)
+        _write_atomic(output, writer.write)
+        write_page_index(output, zip(labels, page_counts))
+        return False
+
+    replacements = dict(zip(labels, pdfs))
+    existing_pages = _read_pages(output)
+    part_labels = []
+    part_pages = []
+    end = 0
+    for label, count in existing:
+        start, end = end, end + count
+        if label in replacements:
+            pages = _read_pages(replacements.pop(label))
+        else:
+            pages = existing_pages[start:end]
+        part_labels.append(label)
+        part_pages.append(pages)
+    for label, pdf in replacements.items():
+        index = _insertion_index(part_labels, label, order or labels)
+        part_labels.insert(index, label)
+        part_pages.insert(index, _read_pages(pdf))
+
+    writer = PdfWriter()
+    parts = []
+    for label, pages in zip(part_labels, part_pages):
+        writer.addpages(pages)
+        parts.append((label, len(pages)))
+
+    if deduplicate:
+        deduplicate_resources(writer)
+    _write_atomic(output, writer.write)
+    write_page_index(output, parts)
+    return True
+
+
+def write_zip(
+    output: Union[Path, str],
+    members: Iterable[ZipMember],
+    compresslevel: int = 6,
+    keep_existing: bool = False,
+    order: Optional[Sequence[str]] = None,
+) -> None:
+    """Write a zip file with ``members`` in a single pass.
+
+    Every member has the same fixed timestamp and permissions, so the same
+    members always give a byte-identical archive. The archive is written to a
+    temporary file next to ``output`` and renamed.
+
+    Arguments
+    ---------
+    output
+        The path of the zip file
+    members
+        An iterable of ``(name, data)`` pairs, where ``data`` is the path of
+        a file or the content of the member
+    compresslevel, optional
+        The level of compression from 0 to 9, where 0 stores the members
+        without compression
+    keep_existing, optional
+        If ``output`` exists, keep its members that are not replaced by one of
+        ``members``. The replaced members keep their position in the archive,
+        and new members are inserted before the first member that comes
+        after them in ``order``, or added at the end.
+    order, optional
+        The names of all of the members, including those that are kept, in
+        the order of the archive. Defaults to the order of ``members``.
+
+    """
+    if not 0 <= compresslevel <= 9:
+        raise ValueError(
+            f"The compression level must be from 0 to 9, not {compresslevel}."
+        )
+    output = Path(output)
+
+    contents: Dict[str, Union[Path, bytes, str]] = {}
+    if keep_existing and output.is_file():
+        with ZipFile(output) as zip_file:
+            for name in zip_file.namelist():
+                contents[name] = zip_file.read(name)
+    members = list(members)
+    if order is None:
+        order = [name for name, _ in members]
+    names = list(contents)
+    for name, data in members:
+        if name not in contents:
+            names.insert(_insertion_index(names, name, order), name)
+        contents[name] = data
+
+    compress_type = ZIP_DEFLATED if compresslevel > 0 else ZIP_STORED
+
+    def write(f: BinaryIO) -> None:
+        with ZipFile(f, mode="w") as zip_file:
+            for name in names:
+                data = contents[name]
+                if isinstance(data, Path):
+                    data = data.read_bytes()
+                info = ZipInfo(name, date_time=ZIP_DATE_TIME)
+                info.create_system = 3
+                info.external_attr = 0o644 << 16
+                zip_file.writestr(
+                    info, data, compress_type=compress_type, compresslevel=compresslevel
+                )
+
+    _write_atomic(output, write)
+
+
+def combine_pdf_as_bytes(pdfs: List[BytesIO], deduplicate: bool = False) -> bytes:
     """Combine PDFs and return a byte-string with the result.
 
     Arguments
     ---------
     pdfs
         A list of BytesIO representations of PDFs
+    deduplicate, optional
+        Write the fonts and other resources that are the same in several of
+        the ``pdfs`` once, and compress the streams. See
+        `deduplicate_resources`.
 
     """
-    writer = PdfWriter()
-    for pdf in pdfs:
-        writer.addpages(PdfReader(pdf).pages)
+    writer, _ = _combine(pdfs)
+    if deduplicate:
+        deduplicate_resources(writer)
     bio = BytesIO()
     writer.write(bio)
     bio.seek(0)
@@ -0,0 +1,545 @@
+"""Convert personalized variants of the homework problems for each student.
+
+The Markdown cells of a problem can use variables, such as ``{{V}}``, whose
+values are stored in the cell metadata and substituted by
+`~thermohw.pymarkdown.PyMarkdownPreprocessor`. To give each student different
+numbers, the values of some of the variables for each student are read from
+a table by `read_variant_table`, and the problems are converted once for
+each row of the table.
+
+Most of the work of converting a problem doesn't depend on the values:
+reading the Notebook, removing the solution, extracting the attachments,
+and rendering the Markdown cells that don't use the variables. A
+`VariantRenderer` does that once for the assignment and once for the
+solution, with the variables of the table left in place. For each variant,
+only the values are substituted and the template is rendered. The Markdown
+cells that use the variables are rendered to LaTeX for all of the variants
+with one batch of Pandoc runs, and the PDFs of the variants are compiled
+with up to ``latex_jobs`` LaTeX processes at once while the next variants
+are rendered. With ``jobs``, the problems of a homework are converted in
+that many worker processes at once, and with a ``memory_budget``, no new
+variants or problems are started while the memory used is over the budget,
+as in `~thermohw.convert_thermo_hw.process`.
+
+Classes
+-------
+VariantRenderer:
+    Render the variants of a problem, sharing the work that is the same for
+    every variant.
+
+Functions
+---------
+read_variant_table:
+    Read the values of the variables for each variant from a CSV file.
+
+convert_variants:
+    Convert every variant of a problem.
+
+process_variants:
+    Convert every variant of the problems of a homework, and write the
+    merged PDFs and zip files of each variant.
+
+"""
+
+# Standard Library
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+import asyncio
+import copy
+import csv
+import re
+import tempfile
+
+# Local imports
+from .cache import ProblemFiles, result_files
+from .convert_thermo_hw import (
+    _HomeworkBuild,
+    _init_worker,
+    _read_problem,
+    configure_exporters,
+    exporter_config,
+    get_exporters,
+)
+from .memory import MemoryBudget
+from .profiling import Event, profiler, stage
+
+if TYPE_CHECKING:
+    # typing only
+    from nbformat import NotebookNode  # noqa: F401
+
+Variant = Tuple[str, Dict[str, str]]
+
+# The same pattern as the python-markdown extension
+VARIABLE_PATTERN = re.compile("{{(.*?)}}")
+
+# The IDs of the variants are used as folder names
+_ID_PATTERN = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_.@-]*")
+
+
+def read_variant_table(path: Union[Path, str]) -> List[Variant]:
+    """Read the values of the variables for each variant from a CSV file.
+
+    The first column is the ID of each variant, such as the student ID, and
+    the header of each other column is the name of a variable. Empty rows
+    are ignored.
+
+    Returns
+    -------
+    list
+        The ID and a dictionary of the values of the variables of each
+        variant, in the order of the rows
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        rows = list(csv.reader(f))
+    if not rows or len(rows[0]) < 2:
+        raise ValueError(
+            f"The variant table {path} needs a header with an ID column and at "
+            "least one variable."
+        )
+    names = [name.strip() for name in rows[0][1:]]
+    if len(set(names)) != len(names) or not all(names):
+        raise ValueError(f"The variable names in {path} must be unique: {names}")
+
+    variants: List[Variant] = []
+    ids: Set[str] = set()
+    for row_number, row in enumerate(rows[1:], start=2):
+        if not any(value.strip() for value in row):
+            continue
+        if len(row) != len(names) + 1:
+            raise ValueError(
+                f"Row {row_number} of {path} has {len(row)} columns instead of "
+                f"{len(names) + 1}."
+            )
+        variant_id = row[0].strip()
+        if _ID_PATTERN.fullmatch(variant_id) is None:
+            raise ValueError(f"Invalid ID in row {row_number} of {path}: {row[0]!r}")
+        if variant_id in ids:
+            raise ValueError(f"Duplicate ID in row {row_number} of {path}: {row[0]!r}")
+        ids.add(variant_id)
+        variants.append((variant_id, dict(zip(names, row[1:]))))
+    return variants
+
+
+class VariantRenderer:
+    """Render the variants of a problem, sharing the work that is the same.
+
+    The preprocessors of the exporters are applied to the problem once, with
+    the variables in ``names`` left in place. The Markdown cells of all of the
+    variants are rendered to LaTeX in one batch by `prerender`, and `latex`
+    and `notebook` only substitute the values of a variant and render the
+    template.
+
+    Arguments
+    ---------
+    nb
+        The problem Notebook, which is not modified
+    resources
+        The export resources of the problem, with ``remove_solution`` set for
+        the assignment or the solution
+    names
+        The names of the variables that have different values in each
+        variant. The other variables are substituted from the cell metadata
+        as usual.
+    """
+
+    def __init__(
+        self, nb: "NotebookNode", resources: Dict[str, Any], names: Iterable[str]
+    ) -> None:
+        from .prerender import MarkdownPrerenderer
+
+        self.nb_exp, self.pdf_exp = get_exporters()
+        self.names = set(names)
+        self._latex: Dict[str, Optional[str]] = {}
+        self._prerenderer = next(
+            (
+                p
+                for p in self.pdf_exp._preprocessors
+                if isinstance(p, MarkdownPrerenderer) and p.enabled
+            ),
+            None,
+        )
+
+        nb = self._keep_variables(nb)
+        with stage("preprocess:shared"):
+            self._notebook, self._notebook_resources = self.nb_exp.preprocess(
+                nb, resources
+            )
+            # The Markdown cells are rendered by prerender instead
+            with self.pdf_exp.skip_preprocessors(MarkdownPrerenderer):
+                self._pdf_notebook, self._pdf_resources = self.pdf_exp.preprocess(
+                    nb, resources
+                )
+
+    def _uses_variables(self, cell: "NotebookNode") -> bool:
+        return cell.cell_type == "markdown" and any(
+            match.group(1) in self.names
+            for match in VARIABLE_PATTERN.finditer(cell.source)
+        )
+
+    def _keep_variables(self, nb: "NotebookNode") -> "NotebookNode":
+        """Return a copy of ``nb`` where the variables in the table aren't replaced.
+
+        Each variable is stored in the cell metadata as its own placeholder,
+        so the preprocessors substitute the placeholder for it.
+        """
+        nb = copy.deepcopy(nb)
+        for cell in nb.cells:
+            if self._uses_variables(cell):
+                variables = dict(cell.metadata.get("variables", {}))
+                variables.update((name, f"{{{{{name}}}}}") for name in self.names)
+                cell.metadata["variables"] = variables
+        return nb
+
+    def _substitute(
+        self, nb: "NotebookNode", values: Mapping[str, str]
+    ) -> "NotebookNode":
+        """Return a copy of ``nb`` with the ``values`` of a variant substituted.
+
+        Only the cells that use the variables are copied.
+        """
+
+        def replace(match: "re.Match[str]") -> str:
+            name = match.group(1)
+            if name not in self.names:
+                return match.group(0)
+            return values.get(name, "")
+
+        nb = copy.copy(nb)
+        nb.cells = list(nb.cells)
+        for index, cell in enumerate(nb.cells):
+            if self._uses_variables(cell):
+                cell = copy.copy(cell)
+                cell.source = VARIABLE_PATTERN.sub(replace, cell.source)
+                nb.cells[index] = cell
+        return nb
+
+    def prerender(self, variants: Iterable[Mapping[str, str]]) -> None:
+        """Render the Markdown cells of all of the ``variants`` to LaTeX.
+
+        The cells that are not rendered yet are rendered in a single batch,
+        including the cells that are the same in every variant.
+        """
+        if self._prerenderer is None:
+            return
+        sources: Dict[str, None] = {}
+        for cell in self._pdf_notebook.cells:
+            if cell.cell_type == "markdown" and not self._uses_variables(cell):
+                sources[cell.source] = None
+        for values in variants:
+            for cell in self._substitute(self._pdf_notebook, values).cells:
+                if cell.cell_type == "markdown":
+                    sources[cell.source] = None
+        missing = [source for source in sources if source not in self._latex]
+        if missing:
+            with stage("prerender"):
+                self._latex.update(zip(missing, self._prerenderer.render(missing)))
+
+    def latex(self, values: Mapping[str, str]) -> Tuple[str, Dict[str, Any]]:
+        """Render the LaTeX of the variant with ``values``.
+
+        The LaTeX is compiled to a PDF by
+        `~thermohw.exporters.HomeworkPDFExporter.pdf_from_latex_async`.
+        """
+        from .prerender import set_prerendered
+
+        self.prerender([values])
+        nb = self._substitute(self._pdf_notebook, values)
+        for index, cell in enumerate(nb.cells):
+            if cell.cell_type == "markdown":
+                latex = self._latex.get(cell.source)
+                if latex is not None:
+                    set_prerendered(nb, index, latex)
+        with self.pdf_exp.skip_preprocessors():
+            return self.pdf_exp.latex_from_notebook_node(
+                nb, resources=copy.copy(self._pdf_resources)
+            )
+
+    def notebook(self, values: Mapping[str, str]) -> str:
+        """Return the Notebook of the variant with ``values``."""
+        nb = self._substitute(self._notebook, values)
+        with self.nb_exp.skip_preprocessors():
+            notebook, _ = self.nb_exp.from_notebook_node(
+                nb, resources=copy.copy(self._notebook_resources)
+            )
+        return notebook
+
+
+async def _convert_variants_async(
+    problem: Path,
+    variants: Sequence[Variant],
+    directory: Path,
+    by_hand: bool,
+    legacy: bool,
+    latex_jobs: int,
+    budget: Optional[MemoryBudget] = None,
+) -> Dict[str, ProblemFiles]:
+    _, pdf_exp = get_exporters()
+    names = {name for _, values in variants for name in values}
+    with stage("problem", problem=problem.stem):
+        problem_nb, res = _read_problem(problem, by_hand, legacy)
+        renderers = []
+        for remove_solution in (True, False):
+            variant = "assignment" if remove_solution else "solution"
+            with stage("shared", variant=variant):
+                renderer = VariantRenderer(
+                    problem_nb, dict(res, remove_solution=remove_solution), names
+                )
+                renderer.prerender(values for _, values in variants)
+            renderers.append(renderer)
+
+    latex_slots = asyncio.Semaphore(latex_jobs)
+
+    async def compile_pdf(latex: str, resources: Dict[str, Any], path: Path) -> None:
+        async with latex_slots:
+            pdf, _ = await pdf_exp.pdf_from_latex_async(latex, resources)
+        path.write_bytes(pdf)
+
+    results: Dict[str, ProblemFiles] = {}
+    running: Set["asyncio.Future[None]"] = set()
+    try:
+        for variant_id, values in variants:
+            files = result_files(directory / variant_id)
+            files[0].parent.mkdir(parents=True, exist_ok=True)
+            for renderer, pdf_file, nb_file in (
+                (renderers[0], files[0], files[1]),
+                (renderers[1], files[2], files[3]),
+            ):
+                with stage("variant", problem=problem.stem, id=variant_id):
+                    latex, resources = renderer.latex(values)
+                    nb_file.write_text(renderer.notebook(values), encoding="utf-8")
+                running.add(
+                    asyncio.ensure_future(compile_pdf(latex, resources, pdf_file))
+                )
+                # Let the LaTeX process start, and keep only a few rendered
+                # variants waiting for LaTeX and the memory below the budget
+                await asyncio.sleep(0)
+                while len(running) > latex_jobs or (
+                    running and budget is not None and budget.exceeded()
+                ):
+                    done, running = await asyncio.wait(
+                        running, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        future.result()
+            results[variant_id] = files
+        if running:
+            done, running = await asyncio.wait(running)
+            for future in done:
+                future.result()
+    except BaseException:
+        for future in running:
+            future.cancel()
+        raise
+    return results
+
+
+def convert_variants(
+    problem: Path,
+    variants: Sequence[Variant],
+    directory: Path,
+    by_hand: bool = False,
+    legacy: bool = False,
+    latex_jobs: int = 1,
+    memory_budget: Optional[int] = None,
+) -> Dict[str, ProblemFiles]:
+    """Convert every variant of a problem and write the files to ``directory``.
+
+    Arguments
+    ---------
+    problem
+        A `~pathlib.Path` to the problem Notebook
+    variants
+        The ID and the values of the variables of each variant, such as from
+        `read_variant_table`
+    directory
+        The folder to write the files of each variant to, in a folder named
+        for its ID
+    by_hand, legacy, optional
+        See `~thermohw.convert_thermo_hw.convert_problem`.
+    latex_jobs, optional
+        The number of LaTeX processes to run at once
+    memory_budget, optional
+        The number of bytes of memory that the conversion should stay below.
+        Over the budget, no new variants are rendered until the PDFs in
+        progress are compiled.
+
+    Returns
+    -------
+    dict
+        The assignment PDF, the assignment Notebook, the solution PDF, and the
+        solution Notebook of each variant, by ID
+    """
+    if latex_jobs < 1:
+        raise ValueError(
+            f"The number of LaTeX jobs must be at least 1, not {latex_jobs}."
+        )
+    budget = None if memory_budget is None else MemoryBudget(memory_budget)
+    print("Working on:", problem, f"({len(variants)} variants)")
+    return asyncio.run(
+        _convert_variants_async(
+            problem, variants, directory, by_hand, legacy, latex_jobs, budget
+        )
+    )
+
+
+def _convert_variants_to_files(
+    problem: Path,
+    variants: Sequence[Variant],
+    directory: Path,
+    by_hand: bool,
+    legacy: bool,
+    latex_jobs: int,
+) -> Tuple[Dict[str, ProblemFiles], List[Event]]:
+    """Convert the variants of a problem in a worker process.
+
+    The events recorded by the profiler of the worker are sent back with the
+    paths of the files.
+    """
+    files = convert_variants(problem, variants, directory, by_hand, legacy, latex_jobs)
+    return files, profiler.collect()
+
+
+def process_variants(
+    hw_num: int,
+    variants: Sequence[Variant],
+    problems_to_do: Optional[Iterable[int]] = None,
+    prefix: Optional[Path] = None,
+    by_hand: Optional[Iterable[int]] = None,
+    legacy: bool = False,
+    latex_jobs: int = 1,
+    precompile_preamble: bool = False,
+    zip_level: int = 6,
+    optimize_images: bool = False,
+    image_dpi: int = 150,
+    profile: Optional[Path] = None,
+    jobs: int = 1,
+    memory_budget: Optional[int] = None,
+) -> None:
+    """Convert every variant of the homework problems in the ``prefix`` folder.
+
+    The merged PDFs and zip files of each variant are written to a folder
+    named for its ID in the ``output/variants`` folder, with the same names
+    as the files of `~thermohw.convert_thermo_hw.process`.
+
+    Arguments
+    ---------
+    hw_num
+        The number of this homework
+    variants
+        The ID and the values of the variables of each variant, such as from
+        `read_variant_table`
+    problems_to_do, prefix, by_hand, legacy, precompile_preamble, optional
+        See `~thermohw.convert_thermo_hw.process`.
+    latex_jobs, zip_level, optimize_images, image_dpi, profile, optional
+        See `~thermohw.convert_thermo_hw.process`.
+    jobs, memory_budget, optional
+        See `~thermohw.convert_thermo_hw.process`. The variants of each
+        problem are converted in one worker process.
+    """
+    if jobs < 1:
+        raise ValueError(f"The number of jobs must be at least 1, not {jobs}.")
+    if latex_jobs < 1:
+        raise ValueError(
+            f"The number of LaTeX jobs must be at least 1, not {latex_jobs}."
+        )
+    if prefix is None:
+        prefix = Path(".")
+    budget = None if memory_budget is None else MemoryBudget(memory_budget)
+    config = exporter_config(
+        precompile_preamble,
+        optimize_images,
+        image_dpi,
+        cache_size=None if budget is None else budget.cache_size,
+    )
+    configure_exporters(config)
+    if profile is not None or budget is not None:
+        profiler.enabled = True
+        profiler.track_memory = budget is not None
+        profiler.collect()
+
+    homework = _HomeworkBuild(hw_num, prefix, problems_to_do, by_hand, legacy)
+    output_directory = homework.output_directory / "variants"
+    output_directory.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(
+        dir=output_directory, prefix=".build-"
+    ) as build_directory:
+        tasks = [
+            (
+                problem,
+                variants,
+                Path(build_directory) / problem.stem,
+                problem_by_hand,
+                legacy,
+                latex_jobs,
+            )
+            for problem, problem_by_hand in zip(
+                homework.problems, homework.by_hand_flags
+            )
+        ]
+        # The results are stored by problem, so the merged outputs are in the
+        # order of the problems regardless of the order they finish in
+        converted: List[Dict[str, ProblemFiles]] = [{} for _ in tasks]
+        if jobs > 1 and len(tasks) > 1:
+            # The latest RSS of each worker process, from its profiler events
+            worker_rss: Dict[int, int] = {}
+
+            def add_result(index: int, result: Tuple[Any, List[Event]]) -> None:
+                converted[index], events = result
+                for event in events:
+                    if event["args"].get("rss") is not None:
+                        worker_rss[event["pid"]] = event["args"]["rss"]
+                profiler.events.extend(events)
+
+            with ProcessPoolExecutor(
+                max_workers=jobs,
+                initializer=_init_worker,
+                initargs=(config, profiler.enabled, profiler.track_memory),
+            ) as executor:
+                futures: Dict["Future[Tuple[Any, List[Event]]]", int] = {}
+                for index, task in enumerate(tasks):
+                    while (
+                        budget is not None
+                        and futures
+                        and (
+                            len(futures) >= jobs
+                            or budget.exceeded(worker_rss.values())
+                        )
+                    ):
+                        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            add_result(futures.pop(future), future.result())
+                    futures[executor.submit(_convert_variants_to_files, *task)] = index
+                for future, index in futures.items():
+                    add_result(index, future.result())
+        else:
+            for index, task in enumerate(tasks):
+                converted[index] = convert_variants(*task, memory_budget=memory_budget)
+
+        results: Dict[str, List[ProblemFiles]] = {
+            variant_id: [problem_files[variant_id] for problem_files in converted]
+            for variant_id, _ in variants
+        }
+        for variant_id, files_list in results.items():
+            build = copy.copy(homework)
+            build.output_directory = output_directory / variant_id
+            build.output_directory.mkdir(exist_ok=True)
+            build.results = list(files_list)
+            build.finish(zip_level)
+
+    if profile is not None:
+        profiler.write_trace(profile)
+    if profile is not None or budget is not None:
+        profiler.print_summary()
@@ -0,0 +1,22 @@
+"""Shared fixtures of the tests."""
+from typing import Iterator
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="session", autouse=True)
+def user_cache_home(tmp_path_factory: pytest.TempPathFactory) -> Iterator[None]:
+    """Keep the user caches of the tests out of the real cache directory.
+
+    The rendered Markdown cells and the compiled templates are cached in
+    ``$XDG_CACHE_HOME/thermohw``, which is set to a temporary folder for the
+    session, including the processes started by the tests.
+    """
+    previous = os.environ.get("XDG_CACHE_HOME")
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path_factory.mktemp("cache"))
+    yield
+    if previous is None:
+        del os.environ["XDG_CACHE_HOME"]
+    else:
+        os.environ["XDG_CACHE_HOME"] = previous
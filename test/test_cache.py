@@ -0,0 +1,27 @@
+"""Test the cache module."""
+from pathlib import Path
+
+from thermohw.cache import BuildCache, write_result
+
+
+def test_cache_round_trip(tmp_path: Path) -> None:
+    """Test that a stored entry is returned and replaces older entries."""
+    problem = tmp_path / "homework-1-1.ipynb"
+    problem.write_text("{}")
+    cache = BuildCache(tmp_path / ".cache")
+    key = cache.key(problem)
+    assert cache.get(key) is None
+
+    result = (b"%PDF-assignment", "{}", b"%PDF-solution", "{}")
+    files = cache.put(key, write_result(tmp_path / "build" / "1", result)[0].parent)
+    assert cache.get(key) == files
+    contents = [b"%PDF-assignment", b"{}", b"%PDF-solution", b"{}"]
+    assert [f.read_bytes() for f in files] == contents
+    assert cache.key(problem, by_hand=True) != key
+
+    problem.write_text('{"cells": []}')
+    new_key = cache.key(problem)
+    assert new_key != key
+    cache.put(new_key, write_result(tmp_path / "build" / "2", result)[0].parent)
+    assert cache.get(key) is None
+    assert cache.get(new_key) is not None
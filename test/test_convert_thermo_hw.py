@@ -1,9 +1,57 @@
 """Test the convert_thermo_hw module."""
+from argparse import ArgumentTypeError
+from typing import Any
+from pathlib import Path
+import asyncio
+import json
 import os
+import subprocess
+import sys
+import types
+import zipfile
 import pkg_resources
 
 import nbformat
-from thermohw.convert_thermo_hw import pdf_exp, nb_exp
+import pytest
+from nbformat.v4 import new_markdown_cell
+from thermohw import convert_thermo_hw
+from thermohw.convert_thermo_hw import (
+    convert_problem,
+    convert_problem_async,
+    find_homeworks,
+    main,
+    nb_exp,
+    parse_homework_numbers,
+    pdf_exp,
+    process,
+    process_course,
+    watch,
+)
+
+
+def write_problem(folder: Path, hw_num: int, number: int) -> Path:
+    """Write a problem Notebook with its number in the first cell."""
+    filename = pkg_resources.resource_filename(__name__, "test-cell-tags.ipynb")
+    nb = nbformat.read(filename, as_version=4)
+    nb.metadata.pop("celltoolbar", None)
+    nb.cells.insert(0, new_markdown_cell(f"Problem {hw_num}.{number}"))
+    folder.mkdir(parents=True, exist_ok=True)
+    problem = folder / f"homework-{hw_num}-{number}.ipynb"
+    nbformat.write(nb, str(problem))
+    return problem
+
+
+def read_outputs(output: Path, hw_num: int) -> dict:
+    """Return the Notebooks in the zip files and the page index of the PDFs."""
+    outputs = {}
+    for name in (f"homework-{hw_num}", f"homework-{hw_num}-soln"):
+        with zipfile.ZipFile(output / f"{name}.zip") as archive:
+            outputs[f"{name}.zip"] = [
+                (info.filename, archive.read(info)) for info in archive.infolist()
+            ]
+        pages = (output / f"{name}.pdf.pages.json").read_text()
+        outputs[f"{name}.pdf"] = json.loads(pages)["parts"]
+    return outputs
 
 
 def test_convert_pathological_image_name() -> None:
@@ -29,3 +77,154 @@ def test_tags() -> None:
         del problem_nb.metadata["celltoolbar"]
     solution_nb, _ = nb_exp.from_notebook_node(problem_nb, res)
     assert len(solution_nb) > 0
+
+
+def test_lazy_imports() -> None:
+    """Test that the command line interface starts without importing nbconvert."""
+    code = (
+        "import sys\n"
+        "from thermohw.convert_thermo_hw import main\n"
+        "try:\n"
+        "    main(['--help'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "heavy = ('nbconvert', 'nbformat', 'traitlets', 'pdfrw', 'pandocfilters')\n"
+        "print(','.join(m for m in heavy if m in sys.modules), file=sys.stderr)\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    assert result.stderr.decode("utf-8").strip() == ""
+
+
+def test_find_homeworks(tmp_path: Path) -> None:
+    """Test that homework folders are found and ranges are parsed."""
+    for name in ("homework-10", "homework-2", "homework-notes"):
+        (tmp_path / "homework" / name).mkdir(parents=True)
+    assert find_homeworks(tmp_path) == [2, 10]
+    assert parse_homework_numbers("3") == [3]
+    assert parse_homework_numbers("2-5") == [2, 3, 4, 5]
+    with pytest.raises(ArgumentTypeError):
+        parse_homework_numbers("5-2")
+
+
+def test_convert_problem_async() -> None:
+    """Test that running LaTeX as asyncio subprocesses gives the same files."""
+    filename = pkg_resources.resource_filename(__name__, "test-cell-tags.ipynb")
+    problem = Path(filename)
+
+    async def convert() -> tuple:
+        return await convert_problem_async(problem, asyncio.Semaphore(2))
+
+    result = asyncio.run(convert())
+    expected = convert_problem(problem)
+    # The PDFs have timestamps, so only compare the Notebooks exactly
+    assert result[1] == expected[1]
+    assert result[3] == expected[3]
+    assert result[0].startswith(b"%PDF")
+    assert result[2].startswith(b"%PDF")
+
+
+def test_jobs_are_checked(capsys: pytest.CaptureFixture) -> None:
+    """Test that the numbers of jobs are checked on the command line."""
+    for option in ("--jobs", "--latex-jobs"):
+        with pytest.raises(SystemExit):
+            main(["--hw", "1", option, "0"])
+        assert f"{option} must be at least 1" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("jobs, latex_jobs", [(2, 1), (1, 2)])
+def test_process_jobs(tmp_path: Path, jobs: int, latex_jobs: int) -> None:
+    """Test that converting problems concurrently matches a serial run."""
+    for number in (1, 2, 3):
+        write_problem(tmp_path, 1, number)
+    process(1, prefix=tmp_path, use_cache=False)
+    expected = read_outputs(tmp_path / "output", 1)
+    assert [name for name, _ in expected["homework-1.zip"]] == [
+        "homework-1-1.ipynb",
+        "homework-1-2.ipynb",
+        "homework-1-3.ipynb",
+    ]
+    for number, (_, content) in enumerate(expected["homework-1.zip"], 1):
+        assert f"Problem 1.{number}".encode("utf-8") in content
+
+    process(1, prefix=tmp_path, use_cache=False, jobs=jobs, latex_jobs=latex_jobs)
+    assert read_outputs(tmp_path / "output", 1) == expected
+
+
+def test_process_new_problem(tmp_path: Path) -> None:
+    """Test that a new problem is added in its place among the kept problems."""
+    for number in (1, 3):
+        write_problem(tmp_path, 1, number)
+    process(1, prefix=tmp_path)
+    write_problem(tmp_path, 1, 2)
+    process(1, [2], prefix=tmp_path)
+    outputs = read_outputs(tmp_path / "output", 1)
+    labels = ["homework-1-1", "homework-1-2", "homework-1-3"]
+    assert [name for name, _ in outputs["homework-1.zip"]] == [
+        f"{label}.ipynb" for label in labels
+    ]
+    assert [name for name, _ in outputs["homework-1-soln.zip"]] == [
+        f"{label}-soln.ipynb" for label in labels
+    ]
+    for name in ("homework-1.pdf", "homework-1-soln.pdf"):
+        assert [label for label, _ in outputs[name]] == labels
+
+
+def test_watch(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that only the problems that changed are converted again."""
+    problems = [write_problem(tmp_path, 1, number) for number in (1, 2, 3)]
+    converted = []
+    convert_problem_to_files = convert_thermo_hw._convert_problem_to_files
+
+    def recording_convert(problem: Path, *args: Any) -> Any:
+        converted.append(problem.name)
+        return convert_problem_to_files(problem, *args)
+
+    sleeps = []
+
+    def sleep(interval: float) -> None:
+        # Change a problem after the first conversion, and stop once it has
+        # been converted again
+        sleeps.append(interval)
+        if len(sleeps) == 2:
+            nb = nbformat.read(str(problems[1]), as_version=4)
+            nb.cells[0].source = "Problem 1.2, changed"
+            nbformat.write(nb, str(problems[1]))
+        elif len(converted) > 3:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(
+        convert_thermo_hw, "_convert_problem_to_files", recording_convert
+    )
+    monkeypatch.setattr(convert_thermo_hw, "time", types.SimpleNamespace(sleep=sleep))
+    watch(1, prefix=tmp_path, interval=0)
+    assert converted == [problem.name for problem in problems] + [problems[1].name]
+    assert b"Problem 1.2, changed" in dict(
+        read_outputs(tmp_path / "output", 1)["homework-1.zip"]
+    )["homework-1-2.ipynb"]
+
+
+def test_process_course(tmp_path: Path) -> None:
+    """Test that every homework of the course is written."""
+    for hw_num, problems in ((1, 2), (2, 1), (10, 1)):
+        for number in range(1, problems + 1):
+            write_problem(tmp_path / "homework" / f"homework-{hw_num}", hw_num, number)
+    (tmp_path / "homework" / "homework-3").mkdir()
+    process_course(course_root=tmp_path, jobs=2)
+
+    for hw_num, problems in ((1, 2), (2, 1), (10, 1)):
+        folder = tmp_path / "homework" / f"homework-{hw_num}"
+        outputs = read_outputs(folder / "output", hw_num)
+        labels = [f"homework-{hw_num}-{n}" for n in range(1, problems + 1)]
+        assert [label for label, _ in outputs[f"homework-{hw_num}.pdf"]] == labels
+        assert [name for name, _ in outputs[f"homework-{hw_num}-soln.zip"]] == [
+            f"{label}-soln.ipynb" for label in labels
+        ]
+        for label, content in outputs[f"homework-{hw_num}.zip"]:
+            number = label.split("-")[-1].split(".")[0]
+            assert f"Problem {hw_num}.{number}".encode("utf-8") in content
+    assert not (tmp_path / "homework" / "homework-3" / "output").exists()
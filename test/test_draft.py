@@ -0,0 +1,90 @@
+"""Test the draft module."""
+from pathlib import Path
+import base64
+import re
+import shutil
+import pkg_resources
+
+import nbformat
+import pytest
+from nbformat.v4 import new_markdown_cell
+
+from thermohw.draft import process_draft
+
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+def test_process_draft(tmp_path: Path) -> None:
+    """Test that the drafts of the assignment and the solution are written."""
+    for index, name in enumerate(
+        ("test-cell-tags.ipynb", "test-pathological-image-name.ipynb"), start=1
+    ):
+        filename = pkg_resources.resource_filename(__name__, name)
+        shutil.copyfile(filename, tmp_path / f"homework-1-{index}.ipynb")
+
+    drafts = process_draft(1, prefix=tmp_path)
+    draft_directory = tmp_path / "output" / "draft"
+    assert [draft.name for draft in drafts] == [
+        "homework-1-1.html",
+        "homework-1-1-soln.html",
+        "homework-1-2.html",
+        "homework-1-2-soln.html",
+    ]
+    assert all(draft.parent == draft_directory.resolve() for draft in drafts)
+
+    assignment, solution = (draft.read_text() for draft in drafts[:2])
+    # The variables are substituted and the solution is only in the solution
+    assert "32000 m<sup>3</sup>" in assignment
+    assert "By definition, the relative humidity" not in assignment
+    assert "By definition, the relative humidity" in solution
+    # The alert divs are shown as boxes, and the math is left for MathJax
+    assert '<div class="successbox">' in assignment
+    assert solution.count('<div class="successbox">') == 3
+    assert r"\(" in solution
+
+    # The attachments are written next to the drafts
+    attachments = [
+        path for path in draft_directory.iterdir() if path.suffix != ".html"
+    ]
+    assert sorted(path.name.split("_")[0] for path in attachments) == [
+        "homework-1-2",
+        "homework-1-2-soln",
+    ]
+    for path in attachments:
+        draft = drafts[2] if path.name.startswith("homework-1-2_") else drafts[3]
+        assert path.name in draft.read_text()
+
+
+def png(content: bytes) -> dict:
+    """Return a PNG attachment that ends with ``content``."""
+    data = base64.b64encode(b"\x89PNG\r\n\x1a\n" + content).decode("ascii")
+    return {"image/png": data}
+
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+def test_draft_attachments(tmp_path: Path) -> None:
+    """Test that each draft links to its own attachments."""
+    filename = pkg_resources.resource_filename(__name__, "test-cell-tags.ipynb")
+    nb = nbformat.read(filename, as_version=4)
+    nb.metadata.pop("celltoolbar", None)
+    # The heading of the second part is in both drafts
+    nb.cells[11].source += "\n\n![photo](attachment:image.png)"
+    nb.cells[11].attachments = {"image.png": png(b"assignment")}
+    # The assignment has one cell instead of these solution cells, so its
+    # heading of the second part has the index of the last of these cells in
+    # the solution
+    for index, source in enumerate(["One", "Two", "![photo](attachment:image.png)"]):
+        nb.cells.insert(9 + index, new_markdown_cell(source))
+    nb.cells[11].attachments = {"image.png": png(b"solution")}
+    nbformat.write(nb, str(tmp_path / "homework-1-1.ipynb"))
+
+    assignment, solution = process_draft(1, prefix=tmp_path)
+    images = {}
+    for draft in (assignment, solution):
+        images[draft.name] = [
+            (draft.parent / src).read_bytes()[8:]
+            for src in re.findall(r'<img src="([^"]+)"', draft.read_text())
+        ]
+    assert images == {
+        "homework-1-1.html": [b"assignment"],
+        "homework-1-1-soln.html": [b"solution", b"assignment"],
+    }
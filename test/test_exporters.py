@@ -0,0 +1,168 @@
+"""Test the exporters module."""
+from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import asyncio
+import copy
+import sys
+
+import jinja2
+import nbformat
+import pytest
+from traitlets.config import Config
+
+from thermohw.cache import template_file, user_cache_directory
+from thermohw.exporters import (
+    HomeworkPDFExporter,
+    _relaxed_validator,
+    validate_relaxed,
+)
+
+
+def test_template_bytecode_cache(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that the compiled template is loaded from the cache by a new exporter."""
+    config = Config()
+    config.PDFExporter.template_file = str(template_file)
+    config.HomeworkPDFExporter.template_cache_directory = str(tmp_path)
+
+    compiled = []
+    compile_template = jinja2.Environment.compile
+
+    def counting_compile(self: jinja2.Environment, *args: Any, **kwargs: Any) -> Any:
+        compiled.append(args)
+        return compile_template(self, *args, **kwargs)
+
+    monkeypatch.setattr(jinja2.Environment, "compile", counting_compile)
+
+    assert HomeworkPDFExporter(config=config).template is not None
+    assert len(compiled) == 1
+    assert len(list(tmp_path.iterdir())) == 1
+
+    assert HomeworkPDFExporter(config=config).template is not None
+    assert len(compiled) == 1
+
+    config.HomeworkPDFExporter.template_cache = False
+    assert HomeworkPDFExporter(config=config).template is not None
+    assert len(compiled) == 2
+
+
+def test_template_cache_directory() -> None:
+    """Test that the compiled templates are cached in the user cache directory."""
+    config = Config()
+    config.PDFExporter.template_file = str(template_file)
+    assert HomeworkPDFExporter(config=config).template is not None
+    assert list((user_cache_directory() / "jinja-bytecode").iterdir())
+    # The tests use a temporary cache directory, see conftest.py
+    assert Path.home() / ".cache" not in user_cache_directory().parents
+
+
+# A stand-in for xelatex, which logs each run, builds the format with -ini,
+# and writes an empty PDF otherwise. FAKE_LATEX_FAIL makes the runs with
+# the option it names fail.
+fake_latex = """\
+import os, sys, time
+args = sys.argv[1:]
+if args == ["--version"]:
+    sys.exit(print("Fake LaTeX 1.0"))
+with open(os.environ["FAKE_LATEX_LOG"], "a") as log:
+    log.write(" ".join(args) + "\\n")
+fail = os.environ.get("FAKE_LATEX_FAIL")
+if fail and any(arg.startswith(fail) for arg in args):
+    sys.exit(1)
+if "-ini" in args:
+    time.sleep(0.2)
+    name = next(a for a in args if a.startswith("-jobname=")).split("=")[1]
+    open(name + ".fmt", "w").write("format")
+else:
+    open("notebook.pdf", "w").write("%PDF")
+"""
+
+latex_source = "\\documentclass{article}\n\\begin{document}\nText\n\\end{document}\n"
+
+
+@pytest.fixture
+def format_exporter(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> HomeworkPDFExporter:
+    """Return an exporter that precompiles the preamble with a fake LaTeX."""
+    latex = tmp_path / "latex"
+    latex.write_text(f"#!{sys.executable}\n{fake_latex}")
+    latex.chmod(0o755)
+    monkeypatch.setenv("FAKE_LATEX_LOG", str(tmp_path / "latex.log"))
+    return HomeworkPDFExporter(
+        precompile_preamble=True,
+        format_directory=str(tmp_path / "formats"),
+        latex_command=[str(latex), "{filename}"],
+        bib_command=[sys.executable, "-c", "raise SystemExit(1)"],
+        latex_count=1,
+    )
+
+
+def latex_runs(tmp_path: Path) -> list:
+    """Return the arguments of each run of the fake LaTeX."""
+    return (tmp_path / "latex.log").read_text().splitlines()
+
+
+def test_format_built_once(
+    format_exporter: HomeworkPDFExporter, tmp_path: Path
+) -> None:
+    """Test that the format is built once when it is needed by several threads."""
+    with ThreadPoolExecutor(8) as executor:
+        formats = list(executor.map(format_exporter.format_file, [latex_source] * 8))
+    assert len(set(formats)) == 1
+    assert formats[0].read_text() == "format"
+    assert [path.name for path in (tmp_path / "formats").iterdir()] == [
+        formats[0].name
+    ]
+    assert len(latex_runs(tmp_path)) == 1
+
+
+@pytest.mark.parametrize("fail", ["-ini", "-fmt"])
+def test_format_fallback(
+    format_exporter: HomeworkPDFExporter,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    fail: str,
+) -> None:
+    """Test that the PDF is compiled without the format if it fails."""
+    monkeypatch.setenv("FAKE_LATEX_FAIL", fail)
+    pdf, _ = asyncio.run(format_exporter.pdf_from_latex_async(latex_source, {}))
+    assert pdf == b"%PDF"
+    assert len(format_exporter._failed_formats) == 1
+    runs = latex_runs(tmp_path)
+    assert "-ini" in runs[0]
+    assert "-fmt" not in runs[-1]
+
+    # The format is not tried again
+    asyncio.run(format_exporter.pdf_from_latex_async(latex_source, {}))
+    assert len(latex_runs(tmp_path)) == len(runs) + 1
+    assert format_exporter.format_file(latex_source) is None
+
+
+def test_validate_relaxed(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that Notebooks are validated like nbformat.validate does."""
+    nb = nbformat.v4.new_notebook(cells=[nbformat.v4.new_markdown_cell("a")])
+    nb.cells[0]["prerendered"] = "a"
+    _relaxed_validator.cache_clear()
+    compiled = []
+    get_validator = nbformat.validator.get_validator
+
+    def counting_get_validator(*args: Any, **kwargs: Any) -> Any:
+        compiled.append(args)
+        return get_validator(*args, **kwargs)
+
+    monkeypatch.setattr(nbformat.validator, "get_validator", counting_get_validator)
+    validate_relaxed(nb)
+    validate_relaxed(nb)
+    # The validator is only compiled once
+    assert len(compiled) == 1
+
+    nb.cells.append(copy.deepcopy(nb.cells[0]))
+    validate_relaxed(nb)
+    assert nb.cells[0]["id"] != nb.cells[1]["id"]
+
+    nb.cells[0]["source"] = 1
+    with pytest.raises(nbformat.ValidationError):
+        validate_relaxed(nb)
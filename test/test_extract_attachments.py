@@ -23,3 +23,28 @@ def test_pathological_image_name() -> None:
     cell, resources = preproc.preprocess_cell(in_cell, {"outputs": {}}, 0)
     assert cell.source == f"![{fname}.png](_0_{repl}.png)"
     assert resources["outputs"][f"_0_{repl}.png"] == a2b_base64(data)
+
+
+def test_duplicate_attachments() -> None:
+    """Test that attachments with the same content are only extracted once."""
+    data = (
+        "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB"
+        "0C8AAAAASUVORK5CYII="
+    )
+    resources = {"outputs": {}, "unique_key": "hw"}
+    sources = []
+    for index, name in enumerate(["logo.png", "copy.png"]):
+        in_cell = new_markdown_cell(source=f"![{name}](attachment:{name})")
+        in_cell["attachments"] = {name: {"image/png": data}}
+        cell, resources = preproc.preprocess_cell(in_cell, resources, index)
+        sources.append(cell.source)
+    assert sources == ["![logo.png](hw_0_logo.png)", "![copy.png](hw_0_logo.png)"]
+    assert list(resources["outputs"]) == ["hw_0_logo.png"]
+
+    other_resources = {"outputs": {}, "unique_key": "hw"}
+    in_cell = new_markdown_cell(source="![logo.png](attachment:logo.png)")
+    in_cell["attachments"] = {"logo.png": {"image/png": data}}
+    _, other_resources = preproc.preprocess_cell(in_cell, other_resources, 3)
+    assert other_resources["outputs"]["hw_3_logo.png"] is resources["outputs"][
+        "hw_0_logo.png"
+    ]
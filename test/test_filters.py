@@ -0,0 +1,52 @@
+"""Test the filters module."""
+import json
+
+from pandocfilters import Div, Para, RawInline, Str
+
+from thermohw.filters import (
+    apply_filters,
+    convert_div,
+    convert_filters,
+    convert_html_div,
+    convert_raw_html,
+    div_filter,
+    raw_html_filter,
+)
+
+
+def make_doc() -> str:
+    """Make a Pandoc JSON document with alert divs and raw HTML."""
+    para = Para(
+        [Str("H"), RawInline("html", "<sub>"), Str("2"), RawInline("html", "</sub>")]
+    )
+    nested = Div(["", ["alert", "alert-warning"], []], [para])
+    blocks = [
+        para,
+        Div(["", ["alert", "alert-success"], []], [para, nested]),
+        Div(["", ["not-an-alert"], []], [para]),
+    ]
+    return json.dumps({"pandoc-api-version": [1, 22], "meta": {}, "blocks": blocks})
+
+
+def test_fused_filters_match_chained_filters() -> None:
+    """Test that a single walk gives the same result as chained walks."""
+    doc = make_doc()
+    chained = convert_raw_html(convert_div(doc, "latex"), "latex")
+    assert apply_filters(doc, [div_filter, raw_html_filter], "latex") == chained
+    assert convert_filters(doc, "latex") == chained
+
+
+def test_other_formats_are_unchanged() -> None:
+    """Test that the filters don't change documents for other formats."""
+    doc = make_doc()
+    assert json.loads(convert_filters(doc, "html")) == json.loads(doc)
+
+
+def test_html_div() -> None:
+    """Test that alert divs are converted to boxes in HTML."""
+    doc = make_doc()
+    assert convert_html_div(doc, "latex") == convert_filters(doc, "html")
+    blocks = json.loads(convert_html_div(doc, "html"))["blocks"]
+    assert blocks[1]["c"][0] == ["", ["successbox"], []]
+    assert blocks[1]["c"][1][1]["c"][0] == ["", ["warningbox"], []]
+    assert blocks[2]["c"][0] == ["", ["not-an-alert"], []]
@@ -0,0 +1,34 @@
+"""Test the images module."""
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+from thermohw.images import ImageOptimizer
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def test_optimize_large_image(tmp_path: Path) -> None:
+    """Test that a large image is resized but shown at the same size."""
+    image = Image.new("RGB", (3000, 1500), (200, 30, 30))
+    buffer = BytesIO()
+    image.save(buffer, "PNG", dpi=(300, 300))
+    data = buffer.getvalue()
+
+    optimizer = ImageOptimizer(cache_directory=str(tmp_path), dpi=100)
+    resources = {"outputs": {"hw_0_big.png": data, "notes.txt": b"text"}}
+    _, resources = optimizer.preprocess(None, resources)
+
+    optimized = resources["outputs"]["hw_0_big.png"]
+    assert len(optimized) < len(data)
+    assert resources["outputs"]["notes.txt"] == b"text"
+    result = Image.open(BytesIO(optimized))
+    # 3000 px at 300 dpi is 10 in, which is shown at the maximum width
+    assert result.size == (585, 292)
+    assert result.size[0] / result.info["dpi"][0] == pytest.approx(5.85, rel=1e-3)
+
+    # The result is read from the cache by a new optimizer
+    assert len(list(tmp_path.iterdir())) == 1
+    other = ImageOptimizer(cache_directory=str(tmp_path), dpi=100)
+    assert other.optimize(data, "PNG") == optimized
@@ -0,0 +1,45 @@
+"""Test the memory module."""
+import pytest
+
+from thermohw.memory import MemoryBudget, current_rss, parse_size
+from thermohw.profiling import Profiler
+
+
+def test_parse_size() -> None:
+    """Test that sizes with and without units are parsed."""
+    assert parse_size("1024") == 1024
+    assert parse_size("512M") == 512 * 2 ** 20
+    assert parse_size("1.5GiB") == 3 * 2 ** 29
+    assert parse_size("2 gb") == 2 * 2 ** 30
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_memory_budget() -> None:
+    """Test that the budget counts this process and the workers."""
+    rss = current_rss()
+    if rss is None:
+        pytest.skip("The memory used can't be measured on this platform")
+    budget = MemoryBudget(rss + 2 ** 30)
+    assert not budget.exceeded()
+    assert budget.exceeded([2 ** 31])
+    assert budget.cache_size == budget.limit // 16
+    with pytest.raises(ValueError):
+        MemoryBudget(0)
+
+
+def test_profiler_tracks_memory() -> None:
+    """Test that the peak RSS of each stage is recorded and summarized."""
+    profiler = Profiler()
+    profiler.enabled = True
+    with profiler.stage("untracked"):
+        pass
+    profiler.track_memory = True
+    with profiler.stage("allocate", problem="homework-1-1"):
+        data = bytearray(2 ** 20)
+    del data
+    untracked, tracked = profiler.events
+    assert "peak_rss" not in untracked["args"]
+    assert tracked["args"]["problem"] == "homework-1-1"
+    if tracked["args"]["peak_rss"] is not None:
+        assert set(profiler.memory_summary()) == {"allocate"}
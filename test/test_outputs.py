@@ -0,0 +1,31 @@
+"""Test the outputs module."""
+from pathlib import Path
+import copy
+
+from thermohw.outputs import DiskOutputs, SpillingFilesWriter
+
+
+def test_disk_outputs(tmp_path: Path) -> None:
+    """Test that the outputs are stored on disk and written to the build folder."""
+    outputs = DiskOutputs(tmp_path)
+    outputs["figure.png"] = b"png"
+    outputs["files/plot.pdf"] = b"pdf"
+    assert dict(outputs) == {"figure.png": b"png", "files/plot.pdf": b"pdf"}
+    assert outputs.path("figure.png").parent == outputs.directory
+
+    copied = copy.deepcopy(outputs)
+    del outputs["figure.png"]
+    assert list(outputs) == ["files/plot.pdf"]
+    assert copied["figure.png"] == b"png"
+
+    build = tmp_path / "build"
+    writer = SpillingFilesWriter(build_directory=str(build))
+    resources = {"outputs": copied, "output_extension": ".tex"}
+    writer.write("latex", resources, notebook_name="notebook")
+    assert (build / "figure.png").read_bytes() == b"png"
+    assert (build / "files" / "plot.pdf").read_bytes() == b"pdf"
+    assert (build / "notebook.tex").read_text() == "latex"
+
+    directory = copied.directory
+    copied.close()
+    assert not directory.exists()
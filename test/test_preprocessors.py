@@ -0,0 +1,100 @@
+"""Test the preprocessors module."""
+from typing import Any, Dict
+import copy
+import pkg_resources
+
+import nbformat
+import pytest
+from nbformat.v4 import new_markdown_cell, new_notebook, new_raw_cell
+
+from thermohw import (
+    ExtractAttachmentsPreprocessor,
+    HomeworkPreprocessor,
+    PyMarkdownPreprocessor,
+    RawRemover,
+    SolutionRemover,
+)
+
+data = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB"
+    "0C8AAAAASUVORK5CYII="
+)
+
+
+def make_legacy_notebook() -> nbformat.NotebookNode:
+    """Return a problem with the solution marked by headers."""
+    statement = new_markdown_cell(source="The volume is {{V}}.")
+    statement.metadata["variables"] = {"V": "2.0 m<sup>3</sup>"}
+    figure = new_markdown_cell(source="![fig.png](attachment:fig.png)")
+    figure["attachments"] = {"fig.png": {"image/png": data}}
+    cells = [
+        new_markdown_cell(source="# Homework 1-1"),
+        new_raw_cell(source="A raw cell"),
+        statement,
+        figure,
+        new_markdown_cell(source="## Solution"),
+        new_markdown_cell(source="### Part a"),
+        copy.deepcopy(figure),
+        new_markdown_cell(source="### Part b: sketch"),
+    ]
+    nb = new_notebook(cells=cells)
+    for index, cell in enumerate(nb.cells):
+        cell["id"] = f"cell-{index}"
+    return nb
+
+
+def chained(nb: nbformat.NotebookNode, resources: Dict[str, Any]) -> Any:
+    """Apply the preprocessors one after the other."""
+    for preprocessor in [
+        RawRemover(),
+        SolutionRemover(),
+        PyMarkdownPreprocessor(),
+        ExtractAttachmentsPreprocessor(),
+    ]:
+        nb, resources = preprocessor.preprocess(nb, resources)
+    return nb, resources
+
+
+@pytest.mark.filterwarnings("ignore::FutureWarning")
+@pytest.mark.parametrize("remove_solution", [True, False])
+@pytest.mark.parametrize("by_hand", [True, False])
+@pytest.mark.parametrize("legacy", [True, False])
+def test_homework_preprocessor_matches_chain(
+    legacy: bool, by_hand: bool, remove_solution: bool
+) -> None:
+    """Test that the single pass gives the same output as the separate passes."""
+    if legacy:
+        nb = make_legacy_notebook()
+    else:
+        filename = pkg_resources.resource_filename(__name__, "test-cell-tags.ipynb")
+        nb = nbformat.read(filename, as_version=4)
+    resources = {
+        "remove_solution": remove_solution,
+        "by_hand": by_hand,
+        "legacy": legacy,
+        "delete_pymarkdown": True,
+        "unique_key": "homework-1-1",
+        "outputs": {},
+    }
+
+    expected = chained(copy.deepcopy(nb), copy.deepcopy(resources))
+    preprocessor = HomeworkPreprocessor(extract_attachments=True)
+    assert preprocessor.preprocess(nb, resources) == expected
+
+
+def test_homework_preprocessor_requires_remove_solution() -> None:
+    """Test that the remove_solution key is required, as in SolutionRemover."""
+    with pytest.raises(KeyError):
+        HomeworkPreprocessor().preprocess(make_legacy_notebook(), {})
+
+
+def test_raw_cells_are_kept() -> None:
+    """Test that raw cells are kept when include_raw is set."""
+    resources = {
+        "remove_solution": False,
+        "global_content_filter": {"include_raw": True},
+    }
+    nb, _ = HomeworkPreprocessor().preprocess(make_legacy_notebook(), resources)
+    assert [c.cell_type for c in nb.cells].count("raw") == 1
+    # Attachments are only extracted when extract_attachments is set
+    assert "attachment:fig.png" in nb.cells[3].source
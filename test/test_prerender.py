@@ -0,0 +1,130 @@
+"""Test the prerender module."""
+from pathlib import Path
+from typing import Any
+import copy
+import os
+
+import pytest
+from nbformat.v4 import new_markdown_cell, new_notebook
+from nbconvert.filters import citation2latex, strip_files_prefix
+from nbconvert.filters.filter_links import resolve_references
+from nbconvert.utils.pandoc import pandoc
+
+from thermohw.filters import convert_div, convert_html_div, convert_raw_html
+from thermohw import prerender
+from thermohw.cache import RenderCache
+from thermohw.prerender import (
+    MARKDOWN_FORMAT,
+    MarkdownPrerenderer,
+    render_markdown_cells,
+)
+
+
+def render_cell(source: str) -> str:
+    """Render a single cell with the filters of the template."""
+    doc_json = pandoc(
+        strip_files_prefix(citation2latex(source)), MARKDOWN_FORMAT, "json"
+    )
+    doc_json = resolve_references(
+        convert_raw_html(convert_div(doc_json, "latex"), "latex")
+    )
+    return pandoc(doc_json, "json", "latex")
+
+
+def render_html_cell(source: str) -> str:
+    """Render a single cell with the filters of the draft template."""
+    doc_json = pandoc(strip_files_prefix(source), MARKDOWN_FORMAT, "json")
+    doc_json = convert_html_div(doc_json, "html")
+    return pandoc(doc_json, "json", "html", ["--mathjax"])
+
+
+def test_batch_matches_single_cells() -> None:
+    """Test that rendering in a batch matches rendering each cell."""
+    sources = [
+        "# Title\n\nWater is H<sub>2</sub>O",
+        '<div class="alert alert-success">\n\n**Answer:**\n\n</div>',
+        "",
+        "- a list\n- of items",
+        "$$\nx^2\n$$",
+    ]
+    assert render_markdown_cells(sources) == [render_cell(s) for s in sources]
+
+
+def test_html_batch_matches_single_cells() -> None:
+    """Test that rendering to HTML in a batch matches the draft template."""
+    sources = [
+        "# Title\n\nWater is H<sub>2</sub>O",
+        '<div class="alert alert-success">\n\n**Answer:** $x^2$\n\n</div>',
+        "",
+        "$$\nx^2\n$$",
+    ]
+    expected = [render_html_cell(s) for s in sources]
+    assert render_markdown_cells(sources, "html") == expected
+    assert '<div class="successbox">' in expected[1]
+
+
+# Cells that would change each other if they were read as one document: the
+# footnotes and the headers are numbered across the document, and a link
+# reference applies to the whole document.
+scoped_sources = [
+    "A note[^1]\n\n[^1]: The first note",
+    "Another note[^1]\n\n[^1]: The second note",
+    "# Solution\n\nFirst",
+    "# Solution\n\nSecond, see [the solution](#solution)",
+    "[Steam tables]\n\n[steam tables]: https://example.com/steam",
+    "A link to the [steam tables]",
+    "<div>\n\nno end",
+    "text",
+]
+
+
+@pytest.mark.parametrize("to", ["latex", "html"])
+def test_cells_are_scoped(to: str) -> None:
+    """Test that the cells of a batch don't change each other."""
+    render = render_cell if to == "latex" else render_html_cell
+    expected = [render(s) for s in scoped_sources]
+    assert render_markdown_cells(scoped_sources, to) == expected
+    assert "second note" not in expected[0]
+    assert "\\href" not in expected[5]
+
+
+def test_cached_cells(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that cached cells are not rendered again."""
+    nb = new_notebook(cells=[new_markdown_cell("Water is H<sub>2</sub>O")])
+    prerenderer = MarkdownPrerenderer(cache_directory=str(tmp_path))
+    first, _ = prerenderer.preprocess(copy.deepcopy(nb), {})
+    latex = first.cells[0].metadata["prerendered_latex"]
+    assert latex == render_cell(nb.cells[0].source)
+
+    def fail(*args: Any) -> None:
+        raise AssertionError("Pandoc should not run")
+
+    monkeypatch.setattr(prerender, "pandoc", fail)
+    second, _ = prerenderer.preprocess(copy.deepcopy(nb), {})
+    assert second.cells[0].metadata["prerendered_latex"] == latex
+
+
+def test_cache_version(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the cells cached by an older version are rendered again."""
+    source = "A note[^1]\n\n[^1]: The note"
+    prerenderer = MarkdownPrerenderer(cache_directory=str(tmp_path))
+    old_cache = prerenderer._get_cache()
+    old_cache.put(old_cache.key(source), "stale")
+    assert prerenderer.render([source]) == ["stale"]
+
+    monkeypatch.setattr(prerender, "CACHE_VERSION", "3")
+    assert prerenderer.render([source]) == [render_cell(source)]
+
+
+def test_render_cache_eviction(tmp_path: Path) -> None:
+    """Test that the least recently used entries are removed."""
+    cache = RenderCache(tmp_path, ["pandoc 2"], max_size=10)
+    keys = [cache.key(source) for source in ("a", "b", "c")]
+    assert RenderCache(tmp_path, ["pandoc 3"]).key("a") != keys[0]
+    for index, key in enumerate(keys):
+        cache.put(key, "xxxx")
+        os.utime(tmp_path / key, (index, index))
+    assert cache.get(keys[0]) == "xxxx"
+    cache.evict()
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == cache.get(keys[2]) == "xxxx"
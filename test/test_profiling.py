@@ -0,0 +1,37 @@
+"""Test the profiling module."""
+from pathlib import Path
+import json
+
+from thermohw.profiling import Profiler
+
+
+def test_profiler_records_nested_stages(tmp_path: Path) -> None:
+    """Test that nested stages inherit arguments and are written as a trace."""
+    profiler = Profiler()
+    seen = []
+    profiler.hooks.append(lambda event: seen.append(event["name"]))
+
+    with profiler.stage("ignored"):
+        pass
+    assert profiler.events == []
+    assert seen == ["ignored"]
+
+    profiler.enabled = True
+    with profiler.stage("problem", problem="homework-1-1"):
+        with profiler.stage("export", variant="solution"):
+            pass
+    inner, outer = profiler.events
+    assert inner["args"] == {"problem": "homework-1-1", "variant": "solution"}
+    assert outer["args"] == {"problem": "homework-1-1"}
+    assert outer["ts"] <= inner["ts"]
+    assert outer["dur"] >= inner["dur"]
+    assert set(profiler.summary()) == {"problem", "export"}
+
+    trace = tmp_path / "trace.json"
+    profiler.write_trace(trace)
+    events = json.loads(trace.read_text())["traceEvents"]
+    assert [e["name"] for e in events] == ["export", "problem"]
+    assert all(e["ph"] == "X" for e in events)
+
+    assert profiler.collect() == events
+    assert profiler.events == []
@@ -0,0 +1,109 @@
+"""Test the server module."""
+from typing import Iterator, Tuple
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+import json
+import socket
+import threading
+import pkg_resources
+
+import pytest
+
+from thermohw.server import ConversionServer, parse_options
+
+
+@pytest.fixture(scope="module")
+def server_url() -> Iterator[str]:
+    """Run a server on a free port for the tests in this module."""
+    server = ConversionServer(("127.0.0.1", 0), jobs=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    yield f"http://{host}:{port}"
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def post(url: str, body: bytes) -> Tuple[int, str, bytes]:
+    """Send ``body`` to ``url`` and return the status, content type, and body."""
+    try:
+        with urlopen(Request(url, data=body, method="POST")) as response:
+            return response.status, response.headers["Content-Type"], response.read()
+    except HTTPError as e:
+        return e.code, e.headers["Content-Type"], e.read()
+
+
+def test_parse_options() -> None:
+    """Test the defaults and the validation of the options."""
+    options = parse_options("format=notebook&by_hand=yes&name=homework-1-1")
+    assert options == {
+        "format": "notebook",
+        "remove_solution": True,
+        "by_hand": True,
+        "legacy": False,
+        "name": "homework-1-1",
+    }
+    for query in ("format=html", "by_hand=maybe", "name=../x", "solution=false"):
+        with pytest.raises(ValueError):
+            parse_options(query)
+
+
+@pytest.mark.filterwarnings("ignore::FutureWarning")
+def test_convert(server_url: str) -> None:
+    """Test that Notebooks are converted to PDFs and Notebooks."""
+    filename = pkg_resources.resource_filename(__name__, "test-cell-tags.ipynb")
+    with open(filename, "rb") as f:
+        body = f.read()
+
+    status, content_type, pdf = post(f"{server_url}/convert?name=homework-1-1", body)
+    assert status == 200
+    assert content_type == "application/pdf"
+    assert pdf.startswith(b"%PDF")
+
+    notebooks = []
+    for remove_solution in ("true", "false"):
+        url = f"{server_url}/convert?format=notebook&remove_solution={remove_solution}"
+        status, content_type, notebook = post(url, body)
+        assert status == 200
+        assert content_type == "application/x-ipynb+json"
+        notebooks.append(json.loads(notebook))
+    assignment, solution = notebooks
+    assert assignment["cells"] != solution["cells"]
+
+
+def test_bad_requests(server_url: str) -> None:
+    """Test that bad requests get an error response."""
+    with urlopen(f"{server_url}/health") as response:
+        assert response.read() == b"ok\n"
+    assert post(f"{server_url}/convert", b"not json")[0] == 400
+    assert post(f"{server_url}/convert", b'{"cells": 1}')[0] == 400
+    assert post(f"{server_url}/convert?format=html", b"{}")[0] == 400
+    assert post(f"{server_url}/other", b"{}")[0] == 404
+
+
+def test_full_queue() -> None:
+    """Test that requests are refused before their body is read."""
+    server = ConversionServer(("127.0.0.1", 0), jobs=1, queue_size=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    try:
+        assert server.queue_slots.acquire(blocking=False)
+        # The body is never sent, so the server would wait for it if it read it
+        with socket.create_connection((host, port), timeout=5) as connection:
+            connection.sendall(
+                b"POST /convert HTTP/1.1\r\nHost: x\r\nContent-Length: 100\r\n\r\n"
+            )
+            assert connection.recv(1024).startswith(b"HTTP/1.0 503")
+        server.queue_slots.release()
+
+        # The slot is released when the Notebook is invalid
+        url = f"http://{host}:{port}/convert"
+        assert post(url, b"not json")[0] == 400
+        assert server.queue_slots.acquire(blocking=False)
+        server.queue_slots.release()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -0,0 +1,163 @@
+"""Test the utils module."""
+from io import BytesIO
+from pathlib import Path
+from zipfile import ZipFile
+
+from pdfrw import IndirectPdfDict, PdfArray, PdfDict, PdfName, PdfReader, PdfWriter
+
+from thermohw.utils import (
+    combine_pdf_as_bytes,
+    combine_pdfs,
+    page_index_path,
+    read_page_index,
+    write_zip,
+)
+
+
+def make_pdf(pages: int, font: str = "") -> bytes:
+    """Make a PDF with the given number of empty pages.
+
+    If ``font`` is given, each page uses a font with an embedded file with
+    the content of ``font``.
+    """
+    writer = PdfWriter()
+    for _ in range(pages):
+        page = PdfDict(Type=PdfName.Page, MediaBox=PdfArray([0, 0, 612, 792]))
+        if font:
+            font_file = IndirectPdfDict()
+            font_file.stream = font
+            descriptor = IndirectPdfDict(
+                Type=PdfName.FontDescriptor, FontFile=font_file
+            )
+            page.Resources = PdfDict(
+                Font=PdfDict(
+                    F1=IndirectPdfDict(
+                        Type=PdfName.Font,
+                        BaseFont=PdfName.LMRoman10,
+                        FontDescriptor=descriptor,
+                    )
+                )
+            )
+        writer.addpage(page)
+    bio = BytesIO()
+    writer.write(bio)
+    return bio.getvalue()
+
+
+def test_combine_pdfs_from_files(tmp_path: Path) -> None:
+    """Test that PDFs in files and in memory are combined into a file."""
+    first = tmp_path / "first.pdf"
+    first.write_bytes(make_pdf(2))
+    output = tmp_path / "combined.pdf"
+    combine_pdfs([first, BytesIO(make_pdf(3))], output)
+    assert len(PdfReader(str(output)).pages) == 5
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["combined.pdf", "first.pdf"]
+
+
+def test_combine_pdfs_keep_existing(tmp_path: Path) -> None:
+    """Test that only the pages of the replaced parts are changed."""
+    output = tmp_path / "combined.pdf"
+    parts = [BytesIO(make_pdf(n)) for n in (1, 2, 3)]
+    assert not combine_pdfs(parts, output, ["a", "b", "c"])
+    assert read_page_index(output) == [("a", 1), ("b", 2), ("c", 3)]
+
+    assert combine_pdfs(
+        [BytesIO(make_pdf(4)), BytesIO(make_pdf(1))],
+        output,
+        ["b", "d"],
+        keep_existing=True,
+    )
+    assert read_page_index(output) == [("a", 1), ("b", 4), ("c", 3), ("d", 1)]
+    assert len(PdfReader(str(output)).pages) == 9
+
+    # The index is ignored if the PDF was changed by something else
+    output.write_bytes(make_pdf(2))
+    assert read_page_index(output) is None
+    assert not combine_pdfs([BytesIO(make_pdf(1))], output, ["b"], True)
+    assert len(PdfReader(str(output)).pages) == 1
+    assert page_index_path(output).is_file()
+
+
+def test_combine_pdfs_insert_new_parts(tmp_path: Path) -> None:
+    """Test that new parts are inserted in their order, not at the end."""
+    output = tmp_path / "combined.pdf"
+    combine_pdfs([BytesIO(make_pdf(n)) for n in (1, 3)], output, ["a", "c"])
+
+    combine_pdfs(
+        [BytesIO(make_pdf(n)) for n in (1, 2, 3)],
+        output,
+        ["a", "b", "c"],
+        keep_existing=True,
+    )
+    assert read_page_index(output) == [("a", 1), ("b", 2), ("c", 3)]
+
+    # Only the new part is converted, in the order of all of the parts
+    combine_pdfs(
+        [BytesIO(make_pdf(4))],
+        output,
+        ["d"],
+        keep_existing=True,
+        order=["a", "d", "b", "c"],
+    )
+    assert read_page_index(output) == [("a", 1), ("d", 4), ("b", 2), ("c", 3)]
+    assert len(PdfReader(str(output)).pages) == 10
+
+
+def test_deduplicate_resources() -> None:
+    """Test that identical fonts in the combined PDFs are only written once."""
+    shared = "shared font " * 1000
+    pdfs = [make_pdf(1, shared), make_pdf(2, shared), make_pdf(1, "other font")]
+    combined = combine_pdf_as_bytes([BytesIO(pdf) for pdf in pdfs])
+    deduplicated = combine_pdf_as_bytes(
+        [BytesIO(pdf) for pdf in pdfs], deduplicate=True
+    )
+    assert len(deduplicated) < len(combined) / 2
+
+    pages = PdfReader(BytesIO(deduplicated)).pages
+    assert len(pages) == 4
+    fonts = [page.Resources.Font.F1 for page in pages]
+    assert fonts[0] is fonts[1] is fonts[2]
+    assert fonts[3] is not fonts[0]
+    # The streams are compressed
+    assert fonts[3].FontDescriptor.FontFile.Filter == PdfName.FlateDecode
+
+
+def test_combine_pdf_as_bytes() -> None:
+    """Test that PDFs are combined into a byte-string."""
+    combined = combine_pdf_as_bytes([BytesIO(make_pdf(1)), BytesIO(make_pdf(2))])
+    assert len(PdfReader(BytesIO(combined)).pages) == 3
+
+
+def test_write_zip_is_reproducible(tmp_path: Path) -> None:
+    """Test that the same members give byte-identical archives."""
+    member = tmp_path / "member.ipynb"
+    member.write_text("{}")
+    output = tmp_path / "archive.zip"
+    write_zip(output, [("a.ipynb", member), ("b.ipynb", "{}")])
+    first = output.read_bytes()
+    member.touch()
+    write_zip(output, [("a.ipynb", member), ("b.ipynb", "{}")])
+    assert output.read_bytes() == first
+
+
+def test_write_zip_keep_existing(tmp_path: Path) -> None:
+    """Test that existing members are kept or replaced in place."""
+    output = tmp_path / "archive.zip"
+    write_zip(output, [("a", "1"), ("b", "2")], compresslevel=0)
+    write_zip(output, [("a", "3"), ("c", "4")], keep_existing=True)
+    with ZipFile(output) as zip_file:
+        assert zip_file.namelist() == ["a", "b", "c"]
+        assert zip_file.read("a") == b"3"
+
+
+def test_write_zip_insert_new_members(tmp_path: Path) -> None:
+    """Test that new members are inserted in their order, not at the end."""
+    output = tmp_path / "archive.zip"
+    write_zip(output, [("a", "1"), ("c", "3")])
+    write_zip(output, [("b", "2")], keep_existing=True, order=["a", "b", "c"])
+    with ZipFile(output) as zip_file:
+        assert zip_file.namelist() == ["a", "b", "c"]
+    expected = output.read_bytes()
+
+    write_zip(output, [("a", "1"), ("b", "2"), ("c", "3")])
+    assert output.read_bytes() == expected
@@ -0,0 +1,114 @@
+"""Test the variants module."""
+from pathlib import Path
+import copy
+import json
+import pkg_resources
+
+import nbformat
+import pytest
+from nbformat.v4 import new_markdown_cell
+
+from thermohw.convert_thermo_hw import nb_exp, pdf_exp, problem_resources
+from thermohw.variants import (
+    VariantRenderer,
+    convert_variants,
+    process_variants,
+    read_variant_table,
+)
+
+variants = [
+    ("alice", {"V": "1.0 m<sup>3</sup>"}),
+    ("bob", {"V": "3.5 m<sup>3</sup>"}),
+]
+
+
+def make_notebook() -> nbformat.NotebookNode:
+    """Return a problem with a cell that uses variables."""
+    filename = pkg_resources.resource_filename(__name__, "test-cell-tags.ipynb")
+    nb = nbformat.read(filename, as_version=4)
+    statement = new_markdown_cell(source="The volume is {{V}} and the mass is {{m}}.")
+    statement.metadata["variables"] = {"V": "2.0 m<sup>3</sup>", "m": "4 kg"}
+    statement["id"] = "statement"
+    nb.cells.insert(1, statement)
+    return nb
+
+
+def test_read_variant_table(tmp_path: Path) -> None:
+    """Test that the variants are read and invalid tables are rejected."""
+    table = tmp_path / "variants.csv"
+    table.write_text('student,V,m\nalice,1,"2, 3"\n\nbob,4,5\n')
+    assert read_variant_table(table) == [
+        ("alice", {"V": "1", "m": "2, 3"}),
+        ("bob", {"V": "4", "m": "5"}),
+    ]
+    for content in ("student\nalice\n", "id,V\na,1\na,2\n", "id,V\na\n", "id,V\n/,1\n"):
+        table.write_text(content)
+        with pytest.raises(ValueError):
+            read_variant_table(table)
+
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+@pytest.mark.parametrize("remove_solution", [True, False])
+def test_variants_match_conversion(remove_solution: bool) -> None:
+    """Test that each variant is the same as converting it on its own."""
+    nb = make_notebook()
+    res = problem_resources("homework-1-1", False, False)
+    res["remove_solution"] = remove_solution
+    renderer = VariantRenderer(nb, res, ["V"])
+    renderer.prerender(values for _, values in variants)
+
+    for _, values in variants:
+        expected_nb = copy.deepcopy(nb)
+        expected_nb.cells[1].metadata["variables"]["V"] = values["V"]
+        expected_latex, _ = pdf_exp.latex_from_notebook_node(expected_nb, res)
+        expected_notebook, _ = nb_exp.from_notebook_node(expected_nb, res)
+
+        latex, resources = renderer.latex(values)
+        assert latex == expected_latex
+        assert "outputs" in resources
+        assert renderer.notebook(values) == expected_notebook
+        assert values["V"] in renderer.notebook(values)
+    # The Notebook of the problem is not changed
+    assert nb == make_notebook()
+
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+def test_convert_variants(tmp_path: Path) -> None:
+    """Test that the files of every variant are written."""
+    problem = tmp_path / "homework-1-1.ipynb"
+    nbformat.write(make_notebook(), str(problem))
+    results = convert_variants(problem, variants, tmp_path / "build", latex_jobs=2)
+    assert list(results) == ["alice", "bob"]
+    for variant_id, values in variants:
+        assignment_pdf, assignment_nb, solution_pdf, solution_nb = results[variant_id]
+        assert assignment_pdf.read_bytes().startswith(b"%PDF")
+        assert solution_pdf.read_bytes().startswith(b"%PDF")
+        assert values["V"] in assignment_nb.read_text()
+        assert values["V"] in solution_nb.read_text()
+
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+def test_process_variants_jobs(tmp_path: Path) -> None:
+    """Test that converting the problems in worker processes matches a serial run."""
+    for number in (1, 2):
+        nb = make_notebook()
+        nb.cells[1].source += f" Problem {number}."
+        nbformat.write(nb, str(tmp_path / f"homework-1-{number}.ipynb"))
+
+    def outputs() -> dict:
+        files = {}
+        for variant_id, _ in variants:
+            folder = tmp_path / "output" / "variants" / variant_id
+            for name in ("homework-1.zip", "homework-1-soln.zip"):
+                files[variant_id, name] = (folder / name).read_bytes()
+            pages = (folder / "homework-1.pdf.pages.json").read_text()
+            files[variant_id, "pages"] = json.loads(pages)["parts"]
+        return files
+
+    process_variants(1, variants, prefix=tmp_path)
+    expected = outputs()
+    labels = [label for label, _ in expected["alice", "pages"]]
+    assert labels == ["homework-1-1", "homework-1-2"]
+
+    process_variants(1, variants, prefix=tmp_path, jobs=2, memory_budget=2 ** 40)
+    assert outputs() == expected